@@ -0,0 +1,225 @@
+"""HTTP response caching"""
+
+from collections import OrderedDict
+import os
+import threading
+import time
+from urllib.parse import parse_qsl
+
+from app import metrics, snapshot
+
+# GET endpoints whose responses only change when the snapshot is reloaded
+CACHEABLE_PREFIXES = (
+    "/cities",
+    "/crime_scr/",
+    "/walk_scr/",
+    "/rent_rate/",
+    "/air_qual_scr/",
+    "/population_data/",
+    "/city_scr/",
+    "/city/",
+    "/rankings",
+)
+
+# Paths under CACHEABLE_PREFIXES answered from other data than the
+# snapshot, e.g. /rent_rate/{city}/history from app.rent_history, whose
+# changes a snapshot version ETag would not track
+UNCACHEABLE_SUFFIXES = (
+    "/history",
+)
+
+# Weight querystring parameters and their endpoint default value
+WEIGHT_PARAMS = {"crime": 5, "walk": 5, "air": 5, "rent": 5}
+
+
+class ResponseCache:
+    """
+    ResponseCache is a bounded, thread-safe LRU cache of serialized
+    responses whose entries also expire after ttl seconds
+
+    Entries are keyed on (snapshot version, normalized request), so
+    reloading the snapshot retires every entry of the previous version.
+    The cache holds at most maxsize entries and maxbytes bytes of them;
+    a value larger than max_entry_bytes is not cached at all
+    """
+
+    def __init__(self, maxsize=1024, ttl=600.0, maxbytes=64 << 20, max_entry_bytes=1 << 20):
+        self.maxsize  = maxsize
+        self.ttl      = ttl
+        self.maxbytes = maxbytes
+        self.max_entry_bytes = max_entry_bytes
+        self.entries  = OrderedDict()     # key -> (expires at, value, bytes)
+        self.nbytes   = 0
+        self.lock     = threading.Lock()
+        self.hits     = 0
+        self.misses   = 0
+
+    def get(self, key):
+        """
+        get returns the cached value of key or None
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry == None or entry[0] < now:
+                if entry != None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, nbytes=0):
+        """
+        put caches value, nbytes long, under key, evicting the least
+        recently used entries beyond maxsize or maxbytes; returns False
+        if value is too large to cache
+        """
+        if nbytes > self.max_entry_bytes:
+            return False
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + self.ttl, value, nbytes)
+            self.nbytes += nbytes
+            while len(self.entries) > self.maxsize or self.nbytes > self.maxbytes:
+                self._remove(next(iter(self.entries)))
+        return True
+
+    def _remove(self, key):
+        self.nbytes -= self.entries.pop(key)[2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "maxsize": self.maxsize, "bytes": self.nbytes,
+                    "maxbytes": self.maxbytes, "hits": self.hits, "misses": self.misses}
+
+
+# Responses cached by ResponseCacheMiddleware
+response_cache = ResponseCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", 600)),
+    maxbytes=int(os.getenv("RESPONSE_CACHE_BYTES", 64 << 20)),
+    max_entry_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BODY", 1 << 20)),
+)
+
+
+def cache_metrics():
+    """
+    cache_metrics returns the response cache's counters as metrics lines
+    """
+    stats = response_cache.stats()
+    return (metrics.counter("cityspire_response_cache_hits_total", "Responses served from the response cache.", stats["hits"])
+            + metrics.counter("cityspire_response_cache_misses_total", "Cacheable requests not found in the response cache.", stats["misses"])
+            + metrics.counter("cityspire_response_cache_entries", "Responses held in the response cache.", stats["size"], "gauge")
+            + metrics.counter("cityspire_response_cache_bytes", "Bytes of responses held in the response cache.", stats["bytes"], "gauge"))
+
+
+metrics.COLLECTORS.append(cache_metrics)
+
+
+def normalize_query(query_string):
+    """
+    normalize_query returns a canonical form of a querystring so that
+    equivalent requests share a cache entry: parameters are sorted and
+    weights are filled in with their defaults, so `/city_scr/Houston`
+    and `/city_scr/Houston?rent=5&crime=05` are the same request
+    """
+    params = dict(parse_qsl(query_string.decode("latin-1"), keep_blank_values=True))
+    for name, default in WEIGHT_PARAMS.items():
+        value = params.get(name, default)
+        try:
+            params[name] = str(int(value))
+        except ValueError:
+            params[name] = value
+    return "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+
+
+class ResponseCacheMiddleware:
+    """
+    ResponseCacheMiddleware serves the cacheable GET endpoints with
+    conditional request and server-side caching support
+
+      - every 200 response carries an ETag derived from the snapshot
+        version and a Cache-Control header, except those the endpoint
+        sent with `Cache-Control: no-store`, such as a 200 answering an
+        unknown city with an "Error" payload
+      - requests whose If-None-Match matches the current ETag get an
+        empty 304 response without running the endpoint
+      - those response bodies are kept in response_cache and replayed
+        for equivalent requests until the snapshot changes
+
+    Uses these environment variables if they exist:
+      - CACHE_MAX_AGE:        Cache-Control max-age in seconds (default 300)
+      - RESPONSE_CACHE_SIZE:  maximum cached responses (default 1024)
+      - RESPONSE_CACHE_TTL:   seconds a cached response is kept (default 600)
+      - RESPONSE_CACHE_BYTES: maximum bytes of cached responses (default 64 MiB)
+      - RESPONSE_CACHE_MAX_BODY: largest response cached, in bytes (default 1 MiB)
+    """
+
+    def __init__(self, app):
+        self.app   = app
+        self.cache = response_cache
+        self.cache_control = f"public, max-age={int(os.getenv('CACHE_MAX_AGE', 300))}".encode()
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] not in ("GET", "HEAD")
+                or not scope["path"].startswith(CACHEABLE_PREFIXES)
+                or scope["path"].endswith(UNCACHEABLE_SUFFIXES)):
+            await self.app(scope, receive, send)
+            return
+
+        etag = f'W/"{snapshot.current().version}"'.encode()
+        cache_headers = [(b"etag", etag), (b"cache-control", self.cache_control)]
+
+        # Does the client already hold the current representation?
+        for name, value in scope["headers"]:
+            if name == b"if-none-match":
+                tags = [tag.strip() for tag in value.split(b",")]
+                if etag in tags or b"*" in tags:
+                    await send({"type": "http.response.start", "status": 304, "headers": cache_headers})
+                    await send({"type": "http.response.body", "body": b""})
+                    return
+                break
+
+        key = (etag, scope["method"], scope["path"], normalize_query(scope["query_string"]))
+        cached = self.cache.get(key)
+        if cached != None:
+            headers, body = cached
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        # Run the endpoint, tagging and capturing its response
+        start = {}
+        chunks = []
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                if message["status"] == 200 and not any(
+                        name == b"cache-control" and b"no-store" in value for name, value in headers):
+                    message = dict(message)
+                    message["headers"] = headers + cache_headers
+                    start["headers"] = message["headers"]
+                    start["size"] = sum(len(name) + len(value) for name, value in message["headers"])
+            elif message["type"] == "http.response.body" and "headers" in start:
+                body = message.get("body", b"")
+                start["size"] += len(body)
+                if start["size"] > self.cache.max_entry_bytes:
+                    # too large to cache; stop holding on to it
+                    start.clear()
+                    chunks.clear()
+                else:
+                    chunks.append(body)
+                    if not message.get("more_body", False):
+                        self.cache.put(key, (start["headers"], b"".join(chunks)), start["size"])
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,264 @@
+"""City code resolution index"""
+
+from bisect import bisect_left
+import re
+import unicodedata
+
+import numpy as np
+
+# Word forms folded together when normalizing names ("Saint Louis" -> "st louis")
+WORD_FORMS = {"saint": "st", "fort": "ft", "mount": "mt"}
+
+# Common user-typed names for supported cities, by normalized alias
+ALIASES = {
+    "nyc":          "New_York_City",
+    "new york":     "New_York_City",
+    "ny ny":        "New_York_City",
+    "la":           "Los_Angeles",
+    "sf":           "San_Francisco",
+    "philly":       "Philadelphia",
+    "dc":           "Washington",
+    "washington dc": "Washington",
+    "vegas":        "Las_Vegas",
+    "nola":         "New_Orleans",
+    "okc":          "Oklahoma_City",
+    "kc":           "Kansas_City",
+    "slc":          "Salt_Lake_City",
+}
+
+STATE_NAMES = {
+    "AL": "alabama", "AK": "alaska", "AZ": "arizona", "AR": "arkansas", "CA": "california",
+    "CO": "colorado", "CT": "connecticut", "DE": "delaware", "DC": "district of columbia",
+    "FL": "florida", "GA": "georgia", "HI": "hawaii", "ID": "idaho", "IL": "illinois",
+    "IN": "indiana", "IA": "iowa", "KS": "kansas", "KY": "kentucky", "LA": "louisiana",
+    "ME": "maine", "MD": "maryland", "MA": "massachusetts", "MI": "michigan", "MN": "minnesota",
+    "MS": "mississippi", "MO": "missouri", "MT": "montana", "NE": "nebraska", "NV": "nevada",
+    "NH": "new hampshire", "NJ": "new jersey", "NM": "new mexico", "NY": "new york",
+    "NC": "north carolina", "ND": "north dakota", "OH": "ohio", "OK": "oklahoma", "OR": "oregon",
+    "PA": "pennsylvania", "RI": "rhode island", "SC": "south carolina", "SD": "south dakota",
+    "TN": "tennessee", "TX": "texas", "UT": "utah", "VT": "vermont", "VA": "virginia",
+    "WA": "washington", "WV": "west virginia", "WI": "wisconsin", "WY": "wyoming",
+}
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+# Fuzzy matches at or above this similarity resolve without asking the user
+FUZZY_ACCEPT  = 0.8
+# Fuzzy matches at or above this similarity are offered as suggestions
+FUZZY_SUGGEST = 0.4
+
+
+def normalize(text):
+    """
+    normalize folds a user-typed city name or city code into a lookup key:
+    accents, case, punctuation and underscores are dropped and common word
+    forms are folded, e.g. "Saint Louis, MO" and "St_Louis mo" -> "st louis mo"
+    """
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    words = _NON_ALNUM.sub(" ", text.lower()).split()
+    return " ".join([WORD_FORMS.get(word, word) for word in words])
+
+
+def trigrams(key):
+    """
+    trigrams returns the set of three character substrings of a padded key
+    """
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def trigram_codes(keys):
+    """
+    trigram_codes is the vectorized form of trigrams for a list of keys:
+    it returns the key number and the uint64 code (three 21-bit code
+    points) of every trigram of every padded key, one per occurrence
+    """
+    padded = [f"  {key} " for key in keys]
+    chars = np.frombuffer("".join(padded).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    lengths = np.array([len(key) for key in padded], dtype=np.intp)
+    counts = lengths - 2
+    # position of every trigram's first character in chars: the start of
+    # its key plus its offset in the key
+    shift = (np.cumsum(lengths) - lengths) - (np.cumsum(counts) - counts)
+    pos = np.repeat(shift, counts) + np.arange(counts.sum())
+    codes = (chars[pos] << np.uint64(42)) | (chars[pos + 1] << np.uint64(21)) | chars[pos + 2]
+    return np.repeat(np.arange(len(keys)), counts), codes
+
+
+class CityIndex:
+    """
+    CityIndex resolves user-typed city names to canonical city codes
+
+      - resolve:  exact lookup of normalized names, city codes,
+                  state-qualified names and aliases, with a trigram
+                  fuzzy fallback for close misspellings; a name shared
+                  by several cities resolves only with its state
+      - suggest:  the cities sharing an ambiguous name, or the best
+                  fuzzy matches for names that do not resolve
+      - complete: prefix autocomplete over the active cities' names
+
+    cities is the snapshot's sequence of city dicts; rows are positions
+    in that sequence
+
+    The fuzzy keys' trigrams are indexed as sorted arrays built in one
+    pass: the keys containing gram_codes[i] are
+    postings[gram_starts[i]:gram_starts[i + 1]]
+    """
+
+    def __init__(self, cities):
+        self.exact     = {}                  # normalized key -> city_code
+        self.ambiguous = {}                  # key shared by several codes -> the codes
+        self.keys      = []                  # fuzzy-searchable keys
+        self.key_codes = []                  # city_code per fuzzy key
+
+        names = []
+        for row, city in enumerate(cities):
+            code     = city["city_code"]
+            code_key = normalize(code)
+            name     = normalize(city["city"] or "")
+            state    = (city["state"] or "").upper()
+
+            self._add(code_key, code)
+            self._add(name, code)
+            self._add(f"{name} {state.lower()}", code)
+            if state in STATE_NAMES:
+                self._add(f"{name} {STATE_NAMES[state]}", code)
+
+            if city.get("active") == "yes":
+                names.append((name, row))
+                if code_key != name:
+                    names.append((code_key, row))
+
+        known = set(self.exact.values())
+        for alias, code in ALIASES.items():
+            if code in known and alias not in self.exact:
+                self._add(alias, code)
+
+        # sorted (name, row) pairs for prefix autocomplete
+        names.sort()
+        self.prefix_keys = [name for name, _ in names]
+        self.prefix_rows = [row for _, row in names]
+
+        self._index_trigrams()
+
+    def _add(self, key, code):
+        if not key:
+            return
+        if key in self.exact:
+            if code == self.exact[key] or code in self.ambiguous.get(key, ()):
+                return
+            # a name shared by several cities; fuzzy matches of it tie
+            self.ambiguous.setdefault(key, [self.exact[key]]).append(code)
+        else:
+            self.exact[key] = code
+        self.keys.append(key)
+        self.key_codes.append(code)
+
+    def _index_trigrams(self):
+        """
+        _index_trigrams builds the trigram postings of the fuzzy keys, the
+        distinct trigram count of every key and the rank of every key's
+        city code among the sorted codes
+        """
+        key_ids, codes = trigram_codes(self.keys)
+        # key_ids ascend, so a stable sort by trigram orders the pairs by
+        # (trigram, key); keep one pair per distinct trigram of a key
+        order = np.argsort(codes, kind="stable")
+        key_ids, codes = key_ids[order], codes[order]
+        distinct = np.ones(len(codes), dtype=bool)
+        distinct[1:] = (codes[1:] != codes[:-1]) | (key_ids[1:] != key_ids[:-1])
+        key_ids, codes = key_ids[distinct], codes[distinct]
+
+        firsts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.empty(0, dtype=np.intp)
+        self.gram_codes  = codes[firsts]
+        self.gram_starts = np.append(firsts, len(codes))
+        self.postings    = key_ids.astype(np.int32)
+        self.key_grams   = np.bincount(key_ids, minlength=len(self.keys))
+
+        self.code_set = set(self.key_codes)
+        self.codes = sorted(self.code_set)
+        rank = {code: i for i, code in enumerate(self.codes)}
+        self.key_ranks = np.array([rank[code] for code in self.key_codes], dtype=np.intp)
+        # most fuzzy keys of any one city code
+        self.code_keys = int(np.bincount(self.key_ranks).max()) if len(self.codes) else 0
+
+    def _fuzzy(self, key, limit=None):
+        """
+        _fuzzy returns (similarity, city_code) pairs of every key sharing
+        a trigram with key, best first, or of the best limit of them;
+        similarity is the Dice coefficient of the two trigram sets
+        """
+        grams = np.unique(trigram_codes([key])[1])
+        if len(self.gram_codes) == 0:
+            return []
+        at = np.minimum(np.searchsorted(self.gram_codes, grams), len(self.gram_codes) - 1)
+        at = at[self.gram_codes[at] == grams]
+        if len(at) == 0:
+            return []
+
+        # count the trigrams each key shares with key
+        shared = np.concatenate([self.postings[self.gram_starts[i]:self.gram_starts[i + 1]] for i in at.tolist()])
+        counts = np.bincount(shared, minlength=len(self.keys))
+        key_ids = np.flatnonzero(counts)
+        sims = 2.0 * counts[key_ids] / (len(grams) + self.key_grams[key_ids])
+
+        # the best limit codes are among the best limit * code_keys keys
+        if limit != None and 0 < limit * self.code_keys < len(sims):
+            cut = np.partition(sims, len(sims) - limit * self.code_keys)[len(sims) - limit * self.code_keys]
+            key_ids, sims = key_ids[sims >= cut], sims[sims >= cut]
+
+        # the best key of every city code, best first (ties by code)
+        ranks = self.key_ranks[key_ids]
+        order = np.lexsort((ranks, -sims))
+        ranks, sims = ranks[order], sims[order]
+        best = np.sort(np.unique(ranks, return_index=True)[1])
+        return [(sim, self.codes[rank]) for sim, rank in zip(sims[best].tolist(), ranks[best].tolist())][:limit]
+
+    def resolve(self, text):
+        """
+        resolve returns the canonical city code of a user-typed city name
+        or None if it matches no city closely enough or is the name of
+        several cities, e.g. "kansas city" but not "kansas city, ks"
+        """
+        if text in self.code_set:
+            return text
+        key = normalize(text)
+        if key in self.ambiguous:
+            return None
+        code = self.exact.get(key)
+        if code != None or not key:
+            return code
+
+        matches = self._fuzzy(key, 2)
+        if matches and matches[0][0] >= FUZZY_ACCEPT:
+            # accept only an unambiguous best match
+            if len(matches) == 1 or matches[1][0] < matches[0][0]:
+                return matches[0][1]
+        return None
+
+    def suggest(self, text, limit=5):
+        """
+        suggest returns up to limit city codes resembling a user-typed
+        name; for a name shared by several cities these are its cities
+        """
+        key = normalize(text)
+        if not key:
+            return []
+        if key in self.ambiguous:
+            return sorted(self.ambiguous[key])[:limit]
+        return [code for sim, code in self._fuzzy(key, limit) if sim >= FUZZY_SUGGEST]
+
+    def complete(self, prefix, limit=10):
+        """
+        complete returns the rows of up to limit active cities whose
+        normalized name or city code starts with prefix, in name order
+        """
+        key = normalize(prefix)
+        rows = []
+        i = bisect_left(self.prefix_keys, key)
+        while i < len(self.prefix_keys) and self.prefix_keys[i].startswith(key) and len(rows) < limit:
+            if self.prefix_rows[i] not in rows:
+                rows.append(self.prefix_rows[i])
+            i += 1
+        return rows
@@ -1,63 +1,89 @@
 import os
 import logging
+import threading
+import time
+from contextlib import contextmanager
 
 from dotenv import load_dotenv
 import psycopg2
+from psycopg2.pool import PoolError
 from urllib.parse import urlparse
 
 log = logging.getLogger(__name__)
 
 class DBSession:
     """
-    Define a DBSession class that handles connecting to a Postgres database
-    and provides methods to test the connection and return a connection object
-    for use
+    Define a DBSession class that maintains a bounded, thread-safe pool of
+    connections to a Postgres database and provides methods to check
+    connections out of and back into the pool
+
+    Pool sizing and reconnect behavior come from these optional
+    environment variables:
+      - DB_POOL_MIN:         connections opened up front (default 1)
+      - DB_POOL_MAX:         maximum open connections (default 10)
+      - DB_POOL_TIMEOUT:     seconds to wait for a free connection (default 10)
+      - DB_POOL_PING_AFTER:  seconds a connection may sit idle before it is
+                             pinged on checkout (default 30)
+      - DB_CONNECT_RETRIES:  connection attempts before giving up (default 3)
+      - DB_CONNECT_BACKOFF:  seconds before the first retry; doubles on
+                             every further retry (default 0.5)
 
     Usage:
        # Create a database session object
        db_sess = DBSession()
 
-       # Connect to the database
+       # Open the pool's initial connections
        db_conn_attempt = db_sess.connect()
 
        # Determine if any connection errors occurred
        if db_conn_attempt["error"] == None:
-           # no errors connecting, assign the connection object for use
-           db_conn = db_conn_attempt["value"]
+           # no errors connecting, check out a connection for use
+           with db_sess.connection() as db_conn:
+               # ... use the connection...
        else:
            # a connection error has occurred
            # ... handle the connection error...
     """
-    
-    def __init__(self):
+
+    def __init__(self, minconn=None, maxconn=None):
         # Load environment variables
         load_dotenv()
         # Fetch environment variable values
         self.DATABASE_URL     = os.getenv("DATABASE_URL")
+        # Set up pool sizing and reconnect values
+        self.minconn        = minconn if minconn != None else int(os.getenv("DB_POOL_MIN", 1))
+        self.maxconn        = maxconn if maxconn != None else int(os.getenv("DB_POOL_MAX", 10))
+        self.timeout        = float(os.getenv("DB_POOL_TIMEOUT", 10))
+        self.pingAfter      = float(os.getenv("DB_POOL_PING_AFTER", 30))
+        self.retries        = int(os.getenv("DB_CONNECT_RETRIES", 3))
+        self.backoff        = float(os.getenv("DB_CONNECT_BACKOFF", 0.5))
         # Set up other instance values
-        self.dbconn         = None      # database connection object
+        self.idle           = []        # idle connections: (connection, returned at)
+        self.size           = 0         # open connections (idle and checked out)
+        self.cond           = threading.Condition()
         self.valEnvVarErr   = []        # env var validation errors
         self.valEnvVarsFlg  = False     # flag: validated env var values
         self.isConnectedFlg = False     # flag: successful db connection
+        self.isClosedFlg    = False     # flag: close_connection was called
 
         # Validate the database related environment variables
         self.val_env_vars()
-            
+
         # Are there any validation errors?
         if len(self.valEnvVarErr) != 0:
             # one or more env vars are missing - return error message
             log.error("error: one or more invalid env var values: {err_str}".format(err_str="; ".join(self.valEnvVarErr)))
         else:
-            # no validation errors found 
+            # no validation errors found
             self.valEnvVarsFlg = True
-        
+
     def connect(self):
         """
-        Connect to the Postgres database
+        Open the pool's initial connections to the Postgres database
 
         Returns a dictionary
           - "error": None if no connection error has occurred or an error message
-          - "value": database connection object or None if an error has occurred
+          - "value": the DBSession object or None if an error has occurred
         """
         # Define a return dict
         ret_dict = {
@@ -67,54 +93,52 @@ class DBSession:
         if self.isConnectedFlg:
             # Already connected to the database
             log.info("attempting to connect to the database but a connection already exists")
-            ret_dict["value"] = self.dbconn
+            ret_dict["value"] = self
             return ret_dict
-            
+
         if not self.valEnvVarsFlg:
             # Invalid database environment variables
             log.error("attempting to connect to the database one or more environment variables are invalid")
             ret_dict["error"] = "invalid environment variables"
             return ret_dict
 
-        result = urlparse(self.DATABASE_URL)
-        username = result.username
-        password = result.password
-        database = result.path[1:]
-        hostname = result.hostname
-        port = 5432
-            
-        # Configure a Postgres database connection object
-        self.dbconn = psycopg2.connect(user =        username,
-                                       password =    password,
-                                       host =        hostname,
-                                       port =        port,
-                                       database =    database)
-                                   
-        # Test the database connection
+        # (Re)open the pool
+        with self.cond:
+            self.isClosedFlg = False
+
+        # Open the minimum number of connections and test one of them
+        conns = []
         try:
-            cursor = self.dbconn.cursor()
+            for _ in range(max(self.minconn, 1)):
+                conns.append(self.getconn())
+            cursor = conns[0].cursor()
             # Print PostgreSQL Connection properties
-            log.info("Connecting to the database with these credentials: {conn_details}\n".format(conn_details=self.dbconn.get_dsn_parameters()))
+            log.info("Connecting to the database with these credentials: {conn_details}\n".format(conn_details=conns[0].get_dsn_parameters()))
 
             # Print PostgreSQL version
             cursor.execute("SELECT version();")
             record = cursor.fetchone()
+            cursor.close()
             log.info("Successfully connected to the database: {conn_details}\n".format(conn_details=record))
             self.isConnectedFlg = True
-            ret_dict["value"] = self.dbconn
+            ret_dict["value"] = self
 
         except (Exception, psycopg2.Error) as error:
-            self.dbconn = None
             self.isConnectedFlg = False
             log.error("Error while connecting to PostgreSQL: {err}".format(err=error))
             ret_dict["error"] = "error: error connecting to the database: " + str(error)
             ret_dict["value"] = None
-            
+
+        finally:
+            # return every connection opened, even if a later one failed
+            for conn in conns:
+                self.putconn(conn)
+
         return ret_dict
-        
+
     def test_connection(self):
         """
-        Test the instance's current database connection
+        Test a pooled database connection
 
         Returns a dictionary
           - "error": None if no connection error has occurred or an error message
@@ -127,33 +151,182 @@ class DBSession:
         }
         # Test the database connection
         try:
-            cursor = self.dbconn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
 
-            # Print PostgreSQL version
-            cursor.execute("SELECT version();")
-            record = cursor.fetchone()
+                # Print PostgreSQL version
+                cursor.execute("SELECT version();")
+                record = cursor.fetchone()
+                cursor.close()
             log.info("Successfully connected to the database: {conn_details}\n".format(conn_details=record))
             self.isConnectedFlg = True
             ret_dict["value"] = record
 
         except (Exception, psycopg2.Error) as error:
-            self.dbconn = None
-            self.isConnectedFlg = False
             log.error("Error while connecting to PostgreSQL: {err}".format(err=error))
             ret_dict["error"] = "error connecting to the database: {err}".format(err=error)
             ret_dict["value"] = None
-        
+
         return ret_dict
 
+    def getconn(self):
+        """
+        Check a live connection out of the pool
+
+        Reuses an idle connection when one passes its liveness check,
+        otherwise opens a new one while the pool is below its maximum size
+        and waits up to DB_POOL_TIMEOUT seconds for a connection to be
+        returned when it is not
+
+        Raises psycopg2.pool.PoolError when no connection becomes available
+        or the pool has been closed and psycopg2.OperationalError when the
+        database cannot be reached
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn = None
+            with self.cond:
+                while not self.isClosedFlg and not self.idle and self.size >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolError("connection pool exhausted")
+                    self.cond.wait(remaining)
+
+                if self.isClosedFlg:
+                    raise PoolError("connection pool is closed")
+                if self.idle:
+                    conn, returned_at = self.idle.pop()
+                else:
+                    # reserve a slot for a new connection
+                    self.size += 1
+
+            if conn == None:
+                try:
+                    return self._open()
+                except Exception:
+                    self._release_slot()
+                    raise
+
+            if self._is_alive(conn, returned_at):
+                return conn
+
+            # drop the dead connection and try again
+            log.info("discarding a dead pooled database connection")
+            self._discard(conn)
+
+    def putconn(self, conn):
+        """
+        Return a checked out connection to the pool; connections returned
+        after close_connection are closed
+        """
+        try:
+            if conn.closed == 0:
+                # end any transaction the caller left open
+                conn.rollback()
+        except psycopg2.Error:
+            pass
+
+        with self.cond:
+            if conn.closed == 0 and not self.isClosedFlg:
+                self.idle.append((conn, time.monotonic()))
+                self.cond.notify()
+                return
+
+        self._discard(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for the duration of a with block
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
     def close_connection(self):
         """
-        Close the instance's current database connection
+        Close the pool: its idle database connections are closed now,
+        checked out ones when they are returned, and getconn raises
+        PoolError until the next connect
         """
-        if self.dbconn != None:
-            self.dbconn.close()
+        with self.cond:
+            idle, self.idle = self.idle, []
+            self.size -= len(idle)
+            self.isConnectedFlg = False
+            self.isClosedFlg = True
+            self.cond.notify_all()
+
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
 
         return
 
+    def _open(self):
+        """
+        Open a new database connection, retrying with exponential backoff
+        """
+        result = urlparse(self.DATABASE_URL)
+        username = result.username
+        password = result.password
+        database = result.path[1:]
+        hostname = result.hostname
+        port = 5432
+
+        delay = self.backoff
+        for attempt in range(1, self.retries + 1):
+            try:
+                # Configure a Postgres database connection object
+                return psycopg2.connect(user =        username,
+                                        password =    password,
+                                        host =        hostname,
+                                        port =        port,
+                                        database =    database)
+            except psycopg2.OperationalError as error:
+                if attempt == self.retries:
+                    raise
+                log.error("Error while connecting to PostgreSQL (attempt {n}): {err}".format(n=attempt, err=error))
+                time.sleep(delay)
+                delay *= 2
+
+    def _is_alive(self, conn, returned_at):
+        """
+        Check an idle connection before handing it out; connections idle
+        for longer than DB_POOL_PING_AFTER seconds are pinged
+        """
+        if conn.closed != 0:
+            return False
+        if time.monotonic() - returned_at < self.pingAfter:
+            return True
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        """
+        Close a connection and free its slot in the pool
+        """
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        self._release_slot()
+
+    def _release_slot(self):
+        with self.cond:
+            self.size -= 1
+            self.cond.notify()
+
     # val_env_vars validates database related environment variables
     def val_env_vars(self):
         """
@@ -162,8 +335,11 @@ class DBSession:
         and assigns errors to self.valEnvVarErr
         """
         # Validate the database connection environment variables
-        if len(self.DATABASE_URL) == 0:
+        if not self.DATABASE_URL:
             # DS_DB_USER is missing
             self.valEnvVarErr.append("DATABASE_URL environment variable is missing")
 
-        return
\ No newline at end of file
+        if self.minconn < 0 or self.maxconn < max(self.minconn, 1):
+            self.valEnvVarErr.append("DB_POOL_MIN/DB_POOL_MAX must satisfy 0 <= min <= max and max >= 1")
+
+        return
@@ -0,0 +1,266 @@
+"""Rent forecasting model
+
+Replaces the notebook's per-city Prophet fits (notebooks/CitySpire_Rent_Data.ipynb)
+with one vectorized least squares fit over every city's monthly rents
+(see app.rent_history). Each city's log rent is modelled as
+
+    log(rent) = a + b * t + c * sin(2 pi t) + d * cos(2 pi t)
+
+with t in years since the last month trained on: a trend fitted to the
+last `window` months, plus yearly seasonality. Forecasts are
+exp(features(month) . coefficients), so the forecast of one city is a
+single dot product and the forecasts of every city one matrix product.
+
+The trainer writes the coefficients to a small .npz artifact, which the
+API loads on startup (RENT_FORECAST_MODEL):
+
+    python -m app.forecast --output rent_forecast.npz
+"""
+
+import argparse
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+import numpy as np
+
+from app import rent_history
+from app.dbsession import DBSession
+
+log = logging.getLogger(__name__)
+
+# Artifact layout version; bump when the features change
+ARTIFACT_VERSION = 1
+
+FEATURES = ("intercept", "trend", "sin_year", "cos_year")
+
+# Months a city needs in the window to get a model
+MIN_MONTHS = 12
+
+# Ridge penalty on the non-intercept coefficients, keeping short or gappy
+# series from extrapolating wildly
+RIDGE = 1e-3
+
+# Longest forecast served; the feature rows of these months are precomputed
+MAX_HORIZON = 24
+
+
+def features(months, origin):
+    """
+    features returns the float64 (len(months), 4) design matrix of
+    month_numbers months, in FEATURES order, with t in years since the
+    month_number origin
+    """
+    t = (np.asarray(months, dtype=np.float64) - origin) / 12.0
+    return np.column_stack([np.ones_like(t), t, np.sin(2 * np.pi * t), np.cos(2 * np.pi * t)])
+
+
+def fit(history, window=36):
+    """
+    fit fits every city of a RentHistory at once and returns the fitted
+    city codes, their float64 (n, 4) coefficients and in-window RMSE of
+    log rent; cities with fewer than MIN_MONTHS rents in the last window
+    months are left out
+
+    The weighted normal equations of every city are built with two
+    einsums over the shared month axis (weight 0 for missing months) and
+    solved in one batched np.linalg.solve call
+    """
+    n_months = history.rents.shape[1]
+    lo = max(n_months - window, 0)
+    months = history.first + np.arange(lo, n_months)
+    X = features(months, months[-1])                         # (m, p)
+
+    rents = history.rents[:, lo:].astype(np.float64)         # (n, m)
+    known = ~np.isnan(rents) & (rents > 0)
+    y = np.where(known, np.log(np.where(known, rents, 1.0)), 0.0)
+    w = known.astype(np.float64)
+
+    keep = w.sum(axis=1) >= MIN_MONTHS
+    y, w = y[keep], w[keep]
+
+    penalty = np.diag([0.0] + [RIDGE] * (len(FEATURES) - 1))
+    A = np.einsum("nm,mp,mq->npq", w, X, X) + penalty        # (n, p, p)
+    b = np.einsum("nm,mp,nm->np", w, X, y)                   # (n, p)
+    coef = np.linalg.solve(A, b[:, :, None])[:, :, 0]
+
+    resid = (y - coef @ X.T) * w
+    rmse = np.sqrt((resid ** 2).sum(axis=1) / w.sum(axis=1))
+
+    codes = [code for code, row in sorted(history.index.items(), key=lambda item: item[1])]
+    return [code for code, k in zip(codes, keep) if k], coef, rmse
+
+
+class RentForecaster:
+    """
+    RentForecaster serves forecasts from a trained artifact
+
+      - codes:  city_code of each row
+      - coef:   float64 (n, 4), coefficients in FEATURES order
+      - end:    month_number of the last month trained on; forecasts
+                start the month after
+      - index:  city_code -> row
+      - X:      float64 (MAX_HORIZON, 4) features of the months after end
+      - labels: YYYY-MM labels of those months
+    """
+
+    def __init__(self, codes, coef, end, meta=None):
+        self.codes  = list(codes)
+        self.coef   = np.ascontiguousarray(coef, dtype=np.float64)
+        self.end    = int(end)
+        self.meta   = meta or {}
+        self.index  = {code: row for row, code in enumerate(self.codes)}
+        self.X      = features(self.months(MAX_HORIZON), self.end)
+        self.labels = [rent_history.month_label(m) for m in self.months(MAX_HORIZON).tolist()]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def months(self, horizon):
+        """
+        months returns the month_numbers of the next horizon months
+        """
+        return self.end + 1 + np.arange(horizon)
+
+    def forecast(self, city_code, horizon):
+        """
+        forecast returns a city's rents for the next horizon (at most
+        MAX_HORIZON) months, or None if the city has no model
+        """
+        row = self.index.get(city_code)
+        if row == None:
+            return None
+        return np.exp(self.X[:horizon] @ self.coef[row])
+
+    def forecast_all(self, horizon):
+        """
+        forecast_all returns the float64 (n, horizon) rents of every city
+        for the next horizon months
+        """
+        if horizon <= MAX_HORIZON:
+            return np.exp(self.coef @ self.X[:horizon].T)
+        return np.exp(self.coef @ features(self.months(horizon), self.end).T)
+
+    def save(self, path):
+        """
+        save writes the artifact to path (.npz, no pickled objects)
+        """
+        np.savez(path, version=ARTIFACT_VERSION, codes=np.array(self.codes, dtype=str), coef=self.coef,
+                 end=self.end, features=np.array(FEATURES, dtype=str),
+                 **{key: np.asarray(value) for key, value in self.meta.items()})
+
+    @classmethod
+    def load(cls, path):
+        """
+        load reads an artifact written by save
+
+        Raises ValueError if the artifact has another layout version
+        """
+        with np.load(path, allow_pickle=False) as npz:
+            if int(npz["version"]) != ARTIFACT_VERSION or tuple(npz["features"]) != FEATURES:
+                raise ValueError(f"{path} is not a version {ARTIFACT_VERSION} rent forecast artifact")
+            meta = {key: npz[key] for key in npz.files if key not in ("version", "codes", "coef", "end", "features")}
+            return cls(npz["codes"].tolist(), npz["coef"], int(npz["end"]), meta)
+
+
+def train(history, window=36):
+    """
+    train fits a RentForecaster on a RentHistory
+    """
+    codes, coef, rmse = fit(history, window)
+    end = history.first + history.rents.shape[1] - 1
+    return RentForecaster(codes, coef, end, {"window": window, "rmse": rmse, "trained_at": time.time()})
+
+
+def backtest(history, window=36, horizon=3):
+    """
+    backtest trains on all but the last horizon months and returns the
+    mean absolute percentage error of the model's and of a last-value
+    forecast on those months, over the cities with rents in all of them
+    """
+    n_months = history.rents.shape[1]
+    train_rents = history.rents[:, :n_months - horizon]
+    held_out = history.rents[:, n_months - horizon:].astype(np.float64)
+
+    past = rent_history.RentHistory(sorted(history.index, key=history.index.get), history.first, train_rents.copy())
+    model = train(past, window)
+    rows = np.array([history.index[code] for code in model.codes], dtype=np.intp)
+    actual = held_out[rows]
+    ok = ~np.isnan(actual).any(axis=1) & ~np.isnan(train_rents[rows, -1])
+
+    predicted = model.forecast_all(horizon)[ok]
+    naive = np.repeat(train_rents[rows, -1][ok, None].astype(np.float64), horizon, axis=1)
+    actual = actual[ok]
+    return {
+        "cities": int(ok.sum()),
+        "model_mape": float(np.mean(np.abs(predicted / actual - 1))),
+        "last_value_mape": float(np.mean(np.abs(naive / actual - 1))),
+    }
+
+
+# The forecaster served by /rent_forecast; None when no artifact is loaded
+_current = None
+
+
+def current():
+    """
+    current returns the RentForecaster being served or None
+    """
+    return _current
+
+
+def load_from_env():
+    """
+    load_from_env loads the artifact at RENT_FORECAST_MODEL (default
+    rent_forecast.npz) if it exists
+    """
+    global _current
+    load_dotenv()
+    path = os.getenv("RENT_FORECAST_MODEL", "rent_forecast.npz")
+    if not os.path.exists(path):
+        log.info("no rent forecast artifact at {path}; /rent_forecast is unavailable".format(path=path))
+        return
+    try:
+        _current = RentForecaster.load(path)
+    except (OSError, ValueError, KeyError) as error:
+        log.error("error loading the rent forecast artifact {path}: {err}".format(path=path, err=error))
+        return
+    log.info("loaded rent forecasts of {n} cities from {path}".format(n=len(_current), path=path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="rent_forecast.npz", help="artifact to write")
+    parser.add_argument("--window", type=int, default=36, help="months of history the trend is fitted to")
+    parser.add_argument("--backtest", type=int, default=3, help="months held out to report the error on (0: skip)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    db_sess = DBSession(minconn=1, maxconn=1)
+    db_conn_attempt = db_sess.connect()
+    if db_conn_attempt["error"] != None:
+        raise SystemExit("ERROR: error attempting to connect to the database: {err_str}".format(err_str=db_conn_attempt["error"]))
+    with db_sess.connection() as db_conn:
+        history = rent_history.load_history(db_conn)
+    db_sess.close_connection()
+    if len(history) == 0:
+        raise SystemExit("ERROR: cityspire_rent_history is empty; load it with `python -m app.ingest.rent`")
+
+    start = time.perf_counter()
+    model = train(history, args.window)
+    log.info("fitted {n} of {total} cities in {ms:.1f} ms, median in-window RMSE of log rent {rmse:.4f}".format(
+        n=len(model), total=len(history), ms=(time.perf_counter() - start) * 1000,
+        rmse=float(np.median(model.meta["rmse"])) if len(model) else float("nan")))
+
+    if args.backtest:
+        result = backtest(history, args.window, args.backtest)
+        log.info("backtest over the last {h} months of {n} cities: MAPE {model:.2%} (last value: {naive:.2%})".format(
+            h=args.backtest, n=result["cities"], model=result["model_mape"], naive=result["last_value_mape"]))
+
+    model.save(args.output)
+    log.info("wrote {path} ({kb:.1f} KB)".format(path=args.output, kb=os.path.getsize(args.output) / 1024))
+
+
+if __name__ == "__main__":
+    main()
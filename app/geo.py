@@ -0,0 +1,190 @@
+"""City geospatial index
+
+Answers radius and bounding box queries over the supported cities (active,
+one row per city code) with coordinates, from a grid of CELL_DEGREES x
+CELL_DEGREES cells: the cities are sorted by cell, so the cities of a
+run of cells along one row of the grid are one contiguous slice, found
+with a binary search. A query gathers the slices of the cells it
+overlaps and filters those candidates exactly, all in numpy.
+
+The index is rebuilt when a snapshot is swapped in. Coordinates come from
+cityspire_cities (see app.ingest.geo).
+"""
+
+import logging
+import time
+
+import numpy as np
+
+from app import snapshot
+
+log = logging.getLogger(__name__)
+
+# Side of a grid cell, in degrees
+CELL_DEGREES = 0.5
+
+# Mean earth radius (IUGG), in km
+EARTH_RADIUS_KM = 6371.0088
+
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180.0
+
+_LAT_CELLS = int(round(180 / CELL_DEGREES))
+_LON_CELLS = int(round(360 / CELL_DEGREES))
+
+
+def _lat_cell(lat):
+    return np.clip(np.floor((np.asarray(lat) + 90.0) / CELL_DEGREES), 0, _LAT_CELLS - 1).astype(np.int64)
+
+
+def _lon_cell(lon):
+    return np.clip(np.floor((np.asarray(lon) + 180.0) / CELL_DEGREES), 0, _LON_CELLS - 1).astype(np.int64)
+
+
+def _top(keys, rows, limit):
+    """
+    _top returns the positions of the (at most limit) smallest keys,
+    ascending, ties by row; only the candidates at or under the limit-th
+    key are sorted
+    """
+    if len(keys) > limit > 0:
+        cut = np.partition(keys, limit - 1)[limit - 1]
+        pos = np.flatnonzero(keys <= cut)
+    else:
+        pos = np.arange(len(keys))
+    return pos[np.lexsort((rows[pos], keys[pos]))][:limit]
+
+
+def haversine_km(lat, lon, lats, lons):
+    """
+    haversine_km returns the great-circle distances in km between the
+    point (lat, lon) and the points (lats, lons), in degrees
+    """
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GeoIndex:
+    """
+    GeoIndex is an immutable grid index of a snapshot's city coordinates
+
+      - snap: the CitySnapshot the index was built from
+      - rows: intp (m,), snapshot rows of the indexed cities, by cell
+      - keys: int64 (m,), grid cell of each city (lat cell * lon cells +
+              lon cell), ascending
+      - lats, lons: float64 (m,), coordinates of each city
+    """
+
+    def __init__(self, snap):
+        self.snap = snap
+        rows = snap.supported
+        rows = rows[~np.isnan(snap.coords[rows, 0])]
+
+        lats, lons = snap.coords[rows, 0], snap.coords[rows, 1]
+        keys = _lat_cell(lats) * _LON_CELLS + _lon_cell(lons)
+        order = np.argsort(keys, kind="stable")
+        self.rows = rows[order]
+        self.keys = keys[order]
+        self.lats = np.ascontiguousarray(lats[order])
+        self.lons = np.ascontiguousarray(lons[order])
+        for arr in (self.rows, self.keys, self.lats, self.lons):
+            arr.setflags(write=False)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _candidates(self, south, north, lon_ranges):
+        """
+        _candidates returns the positions of the cities in the grid cells
+        overlapping latitudes south-north and the (west, east) longitude
+        ranges
+        """
+        lat_cells = np.arange(_lat_cell(south), _lat_cell(north) + 1, dtype=np.int64)
+        starts, ends = [], []
+        for west, east in lon_ranges:
+            base = lat_cells * _LON_CELLS
+            starts.append(np.searchsorted(self.keys, base + _lon_cell(west), side="left"))
+            ends.append(np.searchsorted(self.keys, base + _lon_cell(east), side="right"))
+        starts, ends = np.concatenate(starts), np.concatenate(ends)
+
+        # concatenate the ranges starts[i]:ends[i] without a Python loop
+        lengths = ends - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.intp)
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        cand = offsets + np.arange(total)
+        # the two ranges of a query spanning the antimeridian may share a cell
+        return np.unique(cand) if len(lon_ranges) > 1 else cand
+
+    def near(self, lat, lon, radius_km, limit):
+        """
+        near returns the snapshot rows of the (at most limit) cities within
+        radius_km of (lat, lon), nearest first (ties by row), their
+        distances in km and the number of cities within the radius
+        """
+        dlat = radius_km / KM_PER_DEGREE
+        south, north = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+        # the widest longitude span of the circle is at its most polar latitude
+        cos_lat = np.cos(np.radians(max(abs(south), abs(north))))
+        dlon = 180.0 if cos_lat <= 0 or dlat / cos_lat >= 180.0 else dlat / cos_lat
+        west, east = lon - dlon, lon + dlon
+        if dlon >= 180.0:
+            lon_ranges = [(-180.0, 180.0)]
+        elif west < -180.0:
+            lon_ranges = [(west + 360.0, 180.0), (-180.0, east)]
+        elif east > 180.0:
+            lon_ranges = [(west, 180.0), (-180.0, east - 360.0)]
+        else:
+            lon_ranges = [(west, east)]
+
+        cand = self._candidates(south, north, lon_ranges)
+        dist = haversine_km(lat, lon, self.lats[cand], self.lons[cand])
+        inside = dist <= radius_km
+        cand, dist = cand[inside], dist[inside]
+
+        order = _top(dist, self.rows[cand], limit)
+        return self.rows[cand[order]], dist[order], len(cand)
+
+    def bbox(self, south, west, north, east, limit):
+        """
+        bbox returns the snapshot rows of the (at most limit) cities inside
+        the box, most populous first (ties by row), and the number of
+        cities inside it; a west greater than east spans the antimeridian
+        """
+        lon_ranges = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+        cand = self._candidates(south, north, lon_ranges)
+        lats, lons = self.lats[cand], self.lons[cand]
+        inside = (lats >= south) & (lats <= north)
+        if west <= east:
+            inside &= (lons >= west) & (lons <= east)
+        else:
+            inside &= (lons >= west) | (lons <= east)
+        rows = self.rows[cand[inside]]
+
+        population = self.snap.population[rows]
+        order = _top(-np.nan_to_num(population, nan=-1.0), rows, limit)
+        return rows[order], len(rows)
+
+
+# The index of the snapshot last swapped in; None until the first swap
+_current = None
+
+
+def current():
+    """
+    current returns the GeoIndex of the latest snapshot or None
+    """
+    return _current
+
+
+def _rebuild(snap):
+    global _current
+    start = time.perf_counter()
+    _current = GeoIndex(snap)
+    log.info("built the geospatial index of {n} cities in {ms:.1f} ms".format(
+        n=len(_current), ms=(time.perf_counter() - start) * 1000))
+
+
+snapshot.SWAP_HOOKS.append(_rebuild)
@@ -0,0 +1,44 @@
+"""Health check functions"""
+
+from fastapi import APIRouter, HTTPException
+
+from app import snapshot
+
+router = APIRouter()
+
+
+@router.get('/healthz')
+async def healthz():
+    """
+    healthz reports that the process is up and serving requests (liveness);
+    it does not touch the database
+
+    return values:
+      - "ok": always `True`
+    """
+    return {"ok": True}
+
+
+@router.get('/readyz')
+async def readyz():
+    """
+    readyz reports whether the city score snapshot has been loaded
+    (readiness); answers 503 while the worker is still warming up
+
+    return values:
+      - "ok":        `True` (data loaded); `False` (still loading)
+      - "version":   version of the snapshot being served
+      - "cities":    number of cities in the snapshot
+      - "loaded_at": unix time the snapshot was loaded
+    """
+    snap = snapshot.current()
+    ret_dict = {"ok": False, "version": None, "cities": None, "loaded_at": None}
+
+    if not snapshot.ready():
+        raise HTTPException(status_code=503, detail=ret_dict)
+
+    ret_dict["ok"]        = True
+    ret_dict["version"]   = snap.version
+    ret_dict["cities"]    = len(snap)
+    ret_dict["loaded_at"] = snap.loaded_at
+    return ret_dict
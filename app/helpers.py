@@ -1,10 +1,14 @@
 from dotenv import load_dotenv
+import numpy as np
 import psycopg2
 
 from fastapi import HTTPException
 
+from app import metrics, scoring
+
 # gen_crime_score fetches a scaled city crime rate from the
 #   database and translates that value to a 1-5 crime score
+@metrics.timed(metrics.QUERY_SECONDS)
 def gen_crime_score(db_conn, city):
     """
     gen_crime_score fetches a scaled city crime rate from the
@@ -30,27 +34,10 @@ def gen_crime_score(db_conn, city):
       ret_val["error"] = f"city: {city} not found"
       return ret_val
 
-    # Highest scaled crime score -> worst crime rating
-    if city_scl[0] >= 0.80:
-      ret_val["score"] = 1
-      return ret_val
-    
-    if city_scl[0] >= 0.60:
-      ret_val["score"] = 2
-      return ret_val
-
-    if city_scl[0] >= 0.40:
-      ret_val["score"] = 3
-      return ret_val
-
-    if city_scl[0] >= 0.20:
-      ret_val["score"] = 4
-      return ret_val
-
-    # Lowest scaled crime score -> best crime rating
-    ret_val["score"] = 5
+    ret_val["score"] = scoring.current().score_one("crime", city_scl[0])
     return ret_val
 
+@metrics.timed(metrics.QUERY_SECONDS)
 def gen_walk_score(db_conn, city):
     """
     gen_walk_score fetches a city walkability rating from the
@@ -76,29 +63,11 @@ def gen_walk_score(db_conn, city):
       ret_val["error"] = f"walkability score for city: {city} not found"
       return ret_val
 
-    # Highest walkability score -> best walking city
-    wlk_scr_1 = wlk_scr_100[0]/100.0
-    if wlk_scr_1 >= 0.80:
-      ret_val["score"] = 5
-      return ret_val
-    
-    if wlk_scr_1 >= 0.60:
-      ret_val["score"] = 4
-      return ret_val
-
-    if wlk_scr_1 >= 0.40:
-      ret_val["score"] = 3
-      return ret_val
-
-    if wlk_scr_1 >= 0.20:
-      ret_val["score"] = 2
-      return ret_val
-
-    # Lowest walkability score -> worst walking city
-    ret_val["score"] = 1
+    ret_val["score"] = scoring.current().score_one("walk", wlk_scr_100[0])
     return ret_val
 
 # generates a rent_score based on quantiles of all rent rates
+@metrics.timed(metrics.QUERY_SECONDS)
 def gen_rent_score(db_conn, city):
     '''
     gets rent data from the database about a city and returns 
@@ -126,21 +95,10 @@ def gen_rent_score(db_conn, city):
     ret_val['avg_rent'] = avg_rent    
     
     # generate the score
-    buckets = [ 742. , 1203.6, 1364. , 1535.6, 1721.2, 2993. ]
-    if buckets[0] <= avg_rent <= buckets[1]:
-        # best score/lowest rent
-        ret_val["score"] = 5
-    elif avg_rent <= buckets[2]:
-        ret_val["score"] = 4
-    elif avg_rent <= buckets[3]:
-        ret_val["score"] = 3
-    elif avg_rent <= buckets[4]:
-        ret_val["score"] = 2
-    elif avg_rent <= buckets[5]:
-        # worst score/highest rent
-        ret_val["score"] = 1
+    ret_val["score"] = scoring.current().score_one("rent", avg_rent)
     return ret_val    
 
+@metrics.timed(metrics.QUERY_SECONDS)
 def gen_aq_score(db_conn, city):
     '''
     gets air quality data from database for a city and generates a score
@@ -166,20 +124,10 @@ def gen_aq_score(db_conn, city):
       ret_val["error"] = f"air quality score for city: {city} not found"
       raise HTTPException(status_code=404, detail=ret_val)    
     
-    buckets = [ 7.08867508, 10.12566503, 10.89508254, 11.95768491, 12.90177913,
-                16.86715543]
-    if buckets[0] <= combined_aq <= buckets[1]:
-        ret_val["score"] = 5
-    elif combined_aq <= buckets[2]:
-        ret_val["score"] = 4
-    elif combined_aq <= buckets[3]:
-        ret_val["score"] = 3
-    elif combined_aq <= buckets[4]:
-        ret_val["score"] = 2
-    elif combined_aq <= buckets[5]:
-        ret_val["score"] = 1
+    ret_val["score"] = scoring.current().score_one("air", combined_aq)
     return ret_val
 
+@metrics.timed(metrics.CALL_SECONDS)
 def calc_wghtd_city_score(scores: dict, weights:dict):
   """
   calc_wghtd_city_score calculates a weighted average of 
@@ -199,7 +147,6 @@ def calc_wghtd_city_score(scores: dict, weights:dict):
                 float(weights["rent"])
 
   wgt_avg = numerator / denominator
-  print(f"calculated weighted average is {wgt_avg}")
 
   # check for extreme values
   if wgt_avg < 1.0:
@@ -211,3 +158,18 @@ def calc_wghtd_city_score(scores: dict, weights:dict):
   wgt_avg = round(wgt_avg, 1)
   return wgt_avg
   
+
+@metrics.timed(metrics.CALL_SECONDS)
+def calc_wghtd_city_scores(scores, weights: dict):
+  """
+  calc_wghtd_city_scores is the vectorized form of calc_wghtd_city_score;
+  it calculates the weighted average score of many cities at once
+
+    - scores:  array (n cities, 4) of crime, walkability, air quality
+               and rent scores in that column order
+    - weights: the user's weighting (0-10) per livability dimension
+
+  returns an array (n,) of weighted scores rounded to one decimal the
+  way calc_wghtd_city_score rounds them (see scoring.weighted_scores)
+  """
+  return scoring.weighted_scores(scores, weights)
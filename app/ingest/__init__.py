@@ -0,0 +1,6 @@
+"""Data ingestion pipelines
+
+Offline loaders that rebuild the cityspire_* tables from raw source files.
+Run them as modules, e.g. `python -m app.ingest.crime <ucr csv>`; they use
+pandas, which is a dev dependency (`pipenv install --dev`).
+"""
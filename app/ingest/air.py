@@ -0,0 +1,200 @@
+"""EPA air quality ingestion
+
+Rebuilds cityspire_air_quality from an EPA "Air Quality Statistics by
+Core Based Statistical Area" factbook (cbsafactbook<year>.xlsx, or the
+sheet saved as CSV), computing the "Combined Total" gen_aq_score reads
+the way notebooks/Air_Quality_Score.ipynb did:
+
+  1. each CBSA's PM2.5 (weighted annual mean) and O3 (8-hour) design values
+     are assigned to every cityspire_cities city the CBSA names (see
+     app.ingest.common.metro_cities), plus any listed in a crosswalk CSV
+     (`cbsa_code,city_code`); a city named by more than one CBSA takes the
+     most populous one
+  2. missing values (ND, IN) are imputed with the mean of the matched cities
+  3. both pollutants are scaled to unit standard deviation across the
+     matched cities (not centered, like the notebook's
+     StandardScaler(with_mean=False))
+  4. Combined Total = scaled PM2.5 + scaled O3
+
+The header row and pollutant columns are found by name, so a new annual
+factbook needs no changes. The table is replaced in one transaction; the
+API recomputes its air quality quantile edges from it on the next full
+snapshot reload. The new edges and the resulting 1-5 score counts are
+logged.
+
+Usage:
+    python -m app.ingest.air cbsafactbook2019.xlsx
+    python -m app.ingest.air cbsafactbook2020.xlsx --crosswalk cbsa_cities.csv
+    python -m app.ingest.air cbsafactbook2019.csv --output air_quality.csv   # no load
+"""
+
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+
+from app import scoring
+from app.ingest.common import city_lookup, connect, copy_replace, fetch_cities, match_cities, metro_cities
+
+log = logging.getLogger(__name__)
+
+TABLE = "cityspire_air_quality"
+
+# cityspire_air_quality columns written by the loader, in order
+TABLE_COLUMNS = ["City", "State", "city_code", "PM2.5", "O3", "PM2.5 Scaled", "O3 Scaled", "Combined Total"]
+
+# Factbook columns, by a pattern of their whitespace-collapsed header
+FACTBOOK_COLUMNS = {
+    "cbsa":       r"^Core Based Statistical Area",
+    "cbsa_code":  r"^CBSA Code$",
+    "population": r"^\d{4} Population$",
+    "PM2.5":      r"^PM2\.5 Wtd AM",
+    "O3":         r"^O3 8-hr",
+}
+
+# Factbook markers of a missing value: no data, incomplete data
+NA_VALUES = ["ND", "IN"]
+
+
+def read_factbook(path):
+    """
+    read_factbook returns the CBSA rows of the factbook at path as a
+    DataFrame with the FACTBOOK_COLUMNS, numeric but for cbsa; the title
+    rows above the header and the notes below the data are dropped
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, encoding="utf-8-sig") as f:
+            header = next((i for i, line in enumerate(f) if line.lstrip('"').startswith("Core Based")), None)
+        raw = pd.read_csv(path, header=None, skiprows=header or 0, dtype=object, encoding="utf-8-sig")
+    else:
+        raw = pd.read_excel(path, header=None, dtype=object)
+
+    is_header = raw.iloc[:, 0].astype(str).str.startswith("Core Based")
+    if not is_header.any():
+        raise ValueError("no 'Core Based Statistical Area (CBSA)' header row found")
+    header = int(np.argmax(is_header.to_numpy()))
+
+    names = pd.Series([" ".join(str(col).split()) for col in raw.iloc[header]])
+    columns = {}
+    for key, pattern in FACTBOOK_COLUMNS.items():
+        found = np.flatnonzero(names.str.contains(pattern, regex=True).to_numpy())
+        if len(found) == 0:
+            raise ValueError("no {key} column (/{pattern}/) found".format(key=key, pattern=pattern))
+        columns[key] = raw.iloc[header + 1:, found[0]]
+
+    df = pd.DataFrame(columns)
+    for col in ("cbsa_code", "population", "PM2.5", "O3"):
+        df[col] = pd.to_numeric(df[col].where(~df[col].isin(NA_VALUES)), errors="coerce")
+    return df[df["cbsa_code"].notna()].reset_index(drop=True)
+
+
+def cbsa_city_table(df, cities, crosswalk=None):
+    """
+    cbsa_city_table returns the (region, city_code) lookup table of factbook
+    rows to cityspire_cities cities, one row per city: the cities each CBSA
+    names, plus the crosswalk DataFrame's (cbsa_code, city_code) pairs,
+    with the most populous CBSA winning a city matched more than once
+    """
+    candidates = metro_cities(df["cbsa"])
+    matched = match_cities(candidates["name"], candidates["state"], city_lookup(cities))
+    table = pd.DataFrame({"region": candidates.index, "city_code": matched["city_code"].values})
+
+    if crosswalk is not None:
+        rows = pd.Series(df.index, index=df["cbsa_code"].astype(int))
+        extra = crosswalk[crosswalk["city_code"].isin(cities["city_code"])]
+        extra = pd.DataFrame({"region": rows.reindex(extra["cbsa_code"].astype(int)).values,
+                              "city_code": extra["city_code"].values})
+        table = pd.concat([table, extra], ignore_index=True)
+
+    table = table.dropna()
+    table = table.assign(population=df["population"].reindex(table["region"]).values)
+    table = table.sort_values("population", ascending=False, kind="stable").drop_duplicates("city_code")
+
+    unmatched = df.index.difference(table["region"])
+    log.info("{n} of {total} CBSAs name no city".format(n=len(unmatched), total=len(df)))
+    return table
+
+
+def combined_totals(values):
+    """
+    combined_totals returns the mean-imputed values, the values scaled to
+    unit (population) standard deviation and the Combined Total of a
+    float (n, 2) array of PM2.5 and O3 values
+    """
+    values = np.where(np.isnan(values), np.nanmean(values, axis=0), values)
+    std = values.std(axis=0)
+    scaled = values / np.where(std > 0, std, 1.0)
+    return values, scaled, scaled.sum(axis=1)
+
+
+def build_air_quality(df, cities, crosswalk=None):
+    """
+    build_air_quality returns the cityspire_air_quality rows of a
+    read_factbook DataFrame for the cities in the cityspire_cities DataFrame
+    cities
+    """
+    table = cbsa_city_table(df, cities, crosswalk)
+    if len(table) == 0:
+        return pd.DataFrame(columns=TABLE_COLUMNS)
+
+    info = cities.drop_duplicates("city_code").set_index("city_code").reindex(table["city_code"])
+    values, scaled, total = combined_totals(df.loc[table["region"], ["PM2.5", "O3"]].to_numpy(dtype=np.float64))
+    rows = pd.DataFrame({
+        "City":           info["city"].values,
+        "State":          info["state"].values,
+        "city_code":      table["city_code"].values,
+        "PM2.5":          values[:, 0],
+        "O3":             values[:, 1],
+        "PM2.5 Scaled":   scaled[:, 0],
+        "O3 Scaled":      scaled[:, 1],
+        "Combined Total": total,
+    })
+    return rows.sort_values("city_code", kind="stable").reset_index(drop=True)
+
+
+def quantile_edges(totals):
+    """
+    quantile_edges returns the air quality quantile edges the API computes
+    from a table of these Combined Totals (see scoring.QUANTILE_SQL)
+    """
+    totals = np.asarray(totals, dtype=np.float64)
+    return np.quantile(totals[totals != 0], scoring.QUANTILES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="EPA CBSA factbook (.xlsx, or the sheet saved as .csv)")
+    parser.add_argument("--crosswalk", help="CSV of extra cbsa_code,city_code pairs")
+    parser.add_argument("--output", help="write the table rows to this CSV instead of loading the database")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        df = read_factbook(args.path)
+    except ImportError as error:
+        raise SystemExit("ERROR: reading .xlsx files needs openpyxl ({err}); or save the sheet as CSV".format(err=error))
+    except ValueError as error:
+        raise SystemExit("ERROR: {path}: {err}".format(path=args.path, err=error))
+    crosswalk = pd.read_csv(args.crosswalk, dtype={"city_code": str}) if args.crosswalk else None
+
+    db_sess = connect()
+    with db_sess.connection() as db_conn:
+        rows = build_air_quality(df, fetch_cities(db_conn), crosswalk)
+        if len(rows) == 0:
+            raise SystemExit("ERROR: no CBSA of {path} matches a city; {table} left unchanged".format(path=args.path, table=TABLE))
+        log.info("matched {n} cities".format(n=len(rows)))
+        edges = quantile_edges(rows["Combined Total"])
+        counts = np.bincount(scoring.quantile_bucketing(edges).score(rows["Combined Total"]), minlength=6)[1:]
+        log.info("air quality quantile edges {edges}; cities scoring 1-5: {counts}".format(
+            edges=np.round(edges, 4).tolist(), counts=counts.tolist()))
+
+        if args.output:
+            rows.to_csv(args.output, index=False)
+        else:
+            copy_replace(db_conn, TABLE, rows)
+    db_sess.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""Shared ingestion helpers"""
+
+import io
+import logging
+
+import pandas as pd
+
+from app.cityindex import WORD_FORMS
+from app.dbsession import DBSession
+
+log = logging.getLogger(__name__)
+
+CITIES_SQL = "SELECT id, city, state, city_code FROM cityspire_cities"
+
+
+def normalize_names(names):
+    """
+    normalize_names is the vectorized form of app.cityindex.normalize for
+    a pandas Series of city names; trailing footnote markers such as the
+    "5," in the UCR's "Boston5," are dropped first
+    """
+    names = (names.fillna("").astype(str)
+             .str.replace(r"[\d,]+$", "", regex=True)
+             .str.normalize("NFKD")
+             .str.encode("ascii", "ignore").str.decode("ascii")
+             .str.lower()
+             .str.replace(r"[^a-z0-9]+", " ", regex=True)
+             .str.strip())
+    for word, form in WORD_FORMS.items():
+        names = names.str.replace(rf"\b{word}\b", form, regex=True)
+    return names
+
+
+def fetch_cities(db_conn):
+    """
+    fetch_cities returns cityspire_cities as a DataFrame
+    (id, city, state, city_code)
+    """
+    cursor = db_conn.cursor()
+    try:
+        cursor.execute(CITIES_SQL)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    return pd.DataFrame(rows, columns=["id", "city", "state", "city_code"])
+
+
+def city_lookup(cities):
+    """
+    city_lookup returns a DataFrame indexed by (normalized name, state)
+    with the id and city_code of every city; both a city's name and its
+    city code are indexed and the first city (by id) wins a shared key
+    """
+    cities = cities.sort_values("id")
+    by_name = pd.DataFrame({"key": normalize_names(cities["city"]), "state": cities["state"].str.upper(),
+                            "city_id": cities["id"], "city_code": cities["city_code"]})
+    by_code = pd.DataFrame({"key": normalize_names(cities["city_code"]), "state": cities["state"].str.upper(),
+                            "city_id": cities["id"], "city_code": cities["city_code"]})
+    lookup = pd.concat([by_name, by_code], ignore_index=True)
+    return lookup.drop_duplicates(["key", "state"]).set_index(["key", "state"])
+
+
+# Metro (Zillow region / EPA CBSA) name parts that differ from the
+# cityspire_cities name, by (normalized name, state) -> normalized
+# cityspire name
+METRO_NAMES = {
+    ("new york", "NY"):        "new york city",
+    ("urban honolulu", "HI"):  "honolulu",
+}
+
+
+def metro_cities(regions):
+    """
+    metro_cities returns one (name, state) row, indexed like the passed
+    Series of metro names ("Dallas-Fort Worth-Arlington, TX",
+    "Kansas City, MO-KS"), per city each metro may name: the whole name
+    and each of its "-" or "/" separated parts, in each of its states.
+    The names are normalized, with METRO_NAMES applied
+    """
+    region = regions.fillna("").astype(str).str.rsplit(",", n=1)
+    names  = region.str[0].str.strip()
+    states = region.str[1].fillna("").str.strip().str.upper().str.split("-").explode()
+
+    parts = names.str.split(r"\s*[-/]\s*").explode()
+    parts = parts[parts.values != names.reindex(parts.index).values]
+    candidates = pd.concat([names, parts]).rename("name").to_frame()
+    candidates = candidates.join(states.rename("state"), how="inner")
+
+    keys = normalize_names(candidates["name"])
+    candidates["name"] = [METRO_NAMES.get((key, state), key) for key, state in zip(keys, candidates["state"])]
+    return candidates
+
+
+def match_cities(names, states, lookup):
+    """
+    match_cities returns a DataFrame (city_id, city_code) aligned with the
+    passed name and state Series; unmatched rows hold NaN
+    """
+    keys = pd.MultiIndex.from_arrays([normalize_names(names), states.fillna("").str.upper()])
+    matched = lookup.reindex(keys)
+    matched.index = names.index
+    return matched
+
+
+def copy_replace(db_conn, table, df):
+    """
+    copy_replace replaces every row of table with the rows of df in a single
+    transaction: the old rows are deleted and the new rows bulk loaded with
+    COPY, so readers see either the old or the new table, never a mix
+    """
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+
+    columns = ", ".join(f'"{col}"' for col in df.columns)
+    cursor = db_conn.cursor()
+    try:
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", buf)
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    log.info("loaded {n} rows into {table}".format(n=len(df), table=table))
+
+
+def copy_upsert(db_conn, table, df, key, unique_index, dedupe=False):
+    """
+    copy_upsert inserts or updates the rows of df in table in a single
+    transaction: the rows are bulk loaded with COPY into a temporary staging
+    table and merged with one INSERT ... ON CONFLICT on the key columns.
+    Rows whose values are unchanged are not rewritten.
+
+    unique_index names the unique index on the key columns ON CONFLICT
+    needs; it is created if missing. Rows of table sharing a key prevent
+    that: they are logged and a ValueError is raised, unless dedupe is
+    True, which deletes all but the lowest id row of each duplicated key
+
+    Returns the number of rows inserted or updated
+    """
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+
+    columns  = ", ".join(f'"{col}"' for col in df.columns)
+    keys     = ", ".join(f'"{col}"' for col in key)
+    values   = [col for col in df.columns if col not in key]
+    updates  = ", ".join(f'"{col}" = EXCLUDED."{col}"' for col in values)
+    current  = ", ".join(f'{table}."{col}"' for col in values)
+    incoming = ", ".join(f'EXCLUDED."{col}"' for col in values)
+    key_eq   = " AND ".join(f'd."{col}" = k."{col}"' for col in key)
+
+    cursor = db_conn.cursor()
+    try:
+        cursor.execute("SELECT 1 FROM pg_indexes WHERE tablename = %s AND indexname = %s", (table, unique_index))
+        if cursor.fetchone() == None:
+            cursor.execute(f"SELECT d.id, {keys} FROM {table} d WHERE EXISTS "
+                           f"(SELECT 1 FROM {table} k WHERE {key_eq} AND d.id > k.id) ORDER BY {keys}, d.id")
+            duplicates = cursor.fetchall()
+            for row in duplicates:
+                log.warning("{table} row id={id} repeats the key {key} of a lower id row".format(table=table, id=row[0], key=row[1:]))
+            if duplicates and not dedupe:
+                raise ValueError("{n} rows of {table} repeat the ({keys}) key of a lower id row".format(
+                    n=len(duplicates), table=table, keys=keys))
+            if duplicates:
+                cursor.execute(f"DELETE FROM {table} d USING {table} k WHERE {key_eq} AND d.id > k.id")
+                log.info("deleted {n} duplicate rows of {table}".format(n=cursor.rowcount, table=table))
+            cursor.execute(f"CREATE UNIQUE INDEX {unique_index} ON {table} ({keys})")
+            log.info("created unique index {name} on {table} ({keys})".format(name=unique_index, table=table, keys=keys))
+
+        cursor.execute(f"CREATE TEMP TABLE ingest_stage ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA")
+        cursor.copy_expert(f"COPY ingest_stage ({columns}) FROM STDIN WITH (FORMAT csv)", buf)
+        cursor.execute(f"""
+            INSERT INTO {table} ({columns})
+            SELECT {columns} FROM ingest_stage
+            ON CONFLICT ({keys}) DO UPDATE SET {updates}
+            WHERE ({current}) IS DISTINCT FROM ({incoming})
+        """)
+        changed = cursor.rowcount
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    log.info("upserted {n} of {total} rows into {table}".format(n=changed, total=len(df), table=table))
+    return changed
+
+
+def copy_update(db_conn, table, df, key):
+    """
+    copy_update sets the non-key columns of df on the existing rows of
+    table matching df's key columns, in a single transaction: the rows are
+    bulk loaded with COPY into a temporary staging table and applied with
+    one UPDATE ... FROM. Rows whose values are unchanged are not rewritten
+    and rows of df matching no row of table are ignored
+
+    Returns the number of rows updated
+    """
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+
+    columns  = ", ".join(f'"{col}"' for col in df.columns)
+    values   = [col for col in df.columns if col not in key]
+    updates  = ", ".join(f'"{col}" = s."{col}"' for col in values)
+    current  = ", ".join(f't."{col}"' for col in values)
+    incoming = ", ".join(f's."{col}"' for col in values)
+    key_eq   = " AND ".join(f't."{col}" = s."{col}"' for col in key)
+
+    cursor = db_conn.cursor()
+    try:
+        cursor.execute(f"CREATE TEMP TABLE ingest_stage ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA")
+        cursor.copy_expert(f"COPY ingest_stage ({columns}) FROM STDIN WITH (FORMAT csv)", buf)
+        cursor.execute(f"""
+            UPDATE {table} t SET {updates}
+            FROM ingest_stage s
+            WHERE {key_eq} AND ({current}) IS DISTINCT FROM ({incoming})
+        """)
+        changed = cursor.rowcount
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    log.info("updated {n} of {total} rows of {table}".format(n=changed, total=len(df), table=table))
+    return changed
+
+
+def connect():
+    """
+    connect returns a DBSession with one open connection for a loader run
+    """
+    db_sess = DBSession(minconn=1, maxconn=1)
+    db_conn_attempt = db_sess.connect()
+    if db_conn_attempt["error"] != None:
+        raise SystemExit("ERROR: error attempting to connect to the database: {err_str}".format(err_str=db_conn_attempt["error"]))
+    return db_sess
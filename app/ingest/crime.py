@@ -0,0 +1,160 @@
+"""FBI UCR crime rate ingestion
+
+Rebuilds cityspire_crime from an FBI UCR "offenses known to law enforcement
+by city" CSV, computing the combined_scaled_rate gen_crime_score reads the
+way notebooks/CitySpire_CrimeAnalysisScore_01.ipynb did:
+
+  1. missing property crime counts are estimated from the city's violent
+     crime count and the property/violent crime ratio of its population decile
+  2. violent and property crime rates per 100,000 residents
+  3. combined rate = 0.8 * violent rate + 0.2 * property rate
+  4. combined_scaled_rate = combined rate min-max scaled to 0.0-1.0
+
+The CSV is streamed in chunks and only rows matching a cityspire_cities
+city are kept, so memory stays bounded by the city catalogue no matter
+how many agencies (or years, given a `year` column) the file holds.
+Scaling is across the matched cities.
+
+Usage:
+    python -m app.ingest.crime notebooks/data/ucr_fbi_gov_crime_city_2019.csv
+    python -m app.ingest.crime national_2015_2019.csv --output crime.csv   # no load
+"""
+
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+
+from app.ingest.common import city_lookup, connect, copy_replace, fetch_cities, match_cities, normalize_names
+
+log = logging.getLogger(__name__)
+
+COUNT_COLUMNS = [
+    "population",
+    "violent_crime",
+    "murder_nonnegligent_manslaughter",
+    "rape",
+    "robbery",
+    "aggravated_assault",
+    "property_crime",
+    "burglary",
+    "larceny_theft",
+    "motor_vehicle_theft",
+    "arson",
+]
+
+# cityspire_crime columns written by the loader, in order
+TABLE_COLUMNS = ["state", "city"] + COUNT_COLUMNS + ["state_abbr", "combined_scaled_rate", "city_code", "city_id"]
+
+# UCR agency names that differ from the cityspire_cities name, by
+# (normalized UCR name, state) -> normalized cityspire name
+UCR_NAMES = {
+    ("new york", "NY"):         "new york city",
+    ("louisville metro", "KY"): "louisville",
+}
+
+VIOLENT_WEIGHT  = 0.8
+PROPERTY_WEIGHT = 0.2
+
+
+def read_ucr(path, lookup, chunksize=50000):
+    """
+    read_ucr streams the UCR CSV at path and returns the rows matching a
+    city in lookup, with city_id and city_code columns added; when the file
+    has a `year` column only each city's most recent year is kept
+    """
+    kept = []
+    for chunk in pd.read_csv(path, chunksize=chunksize, encoding="utf-8-sig", thousands=","):
+        chunk.columns = [col.strip().lower() for col in chunk.columns]
+        names = normalize_names(chunk["city"])
+        states = chunk["state_abbr"].fillna("").str.upper()
+        for (name, state), target in UCR_NAMES.items():
+            names = names.mask((names == name) & (states == state), target)
+
+        matched = match_cities(names, states, lookup)
+        hits = matched["city_id"].notna()
+        if hits.any():
+            kept.append(chunk[hits].assign(city_id=matched.loc[hits, "city_id"].astype(int),
+                                           city_code=matched.loc[hits, "city_code"]))
+
+    if not kept:
+        return pd.DataFrame(columns=TABLE_COLUMNS)
+
+    df = pd.concat(kept, ignore_index=True)
+    if "year" in df.columns:
+        df = df.sort_values("year").drop_duplicates("city_id", keep="last")
+    else:
+        df = df.drop_duplicates("city_id", keep="first")
+
+    for col in COUNT_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+    return df.reset_index(drop=True)
+
+
+def impute_property_crime(df):
+    """
+    impute_property_crime returns the property crime counts with missing
+    values estimated as violent crime * the property/violent crime ratio of
+    the city's population decile (among the cities reporting both)
+    """
+    deciles = pd.qcut(df["population"], q=min(10, len(df)), labels=False, duplicates="drop")
+    reported = df["property_crime"].notna()
+    sums = df[reported].groupby(deciles[reported])[["property_crime", "violent_crime"]].sum()
+    ratio = (sums["property_crime"] / sums["violent_crime"]).reindex(deciles).to_numpy()
+    estimate = np.round(ratio * df["violent_crime"].to_numpy())
+    return df["property_crime"].fillna(pd.Series(estimate, index=df.index))
+
+
+def scaled_crime_rates(df):
+    """
+    scaled_crime_rates returns the combined crime rate of every city
+    min-max scaled to 0.0 (least crime) - 1.0 (most crime)
+    """
+    population = df["population"].where(df["population"] > 0)
+    violent_rate  = df["violent_crime"] / population * 100000
+    property_rate = impute_property_crime(df) / population * 100000
+    combined = (VIOLENT_WEIGHT * violent_rate + PROPERTY_WEIGHT * property_rate) / (VIOLENT_WEIGHT + PROPERTY_WEIGHT)
+
+    lo, hi = np.nanmin(combined), np.nanmax(combined)
+    if hi == lo:
+        return combined.where(combined.isna(), 0.0)
+    return (combined - lo) / (hi - lo)
+
+
+def build_crime_table(path, cities, chunksize=50000):
+    """
+    build_crime_table returns the cityspire_crime rows for the UCR CSV at path
+    """
+    df = read_ucr(path, city_lookup(cities), chunksize)
+    if len(df) == 0:
+        return df
+
+    df["combined_scaled_rate"] = scaled_crime_rates(df)
+    for col in COUNT_COLUMNS:
+        df[col] = df[col].round().astype("Int64")
+    return df[TABLE_COLUMNS]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="FBI UCR offenses by city CSV")
+    parser.add_argument("--chunksize", type=int, default=50000, help="CSV rows read at a time")
+    parser.add_argument("--output", help="write the rows to this CSV instead of loading the database")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    db_sess = connect()
+    with db_sess.connection() as db_conn:
+        df = build_crime_table(args.path, fetch_cities(db_conn), args.chunksize)
+        log.info("matched {n} cities".format(n=len(df)))
+
+        if args.output:
+            df.to_csv(args.output, index=False)
+        else:
+            copy_replace(db_conn, "cityspire_crime", df)
+    db_sess.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""City coordinate ingestion
+
+Adds lat and lon columns (WGS84 degrees) to cityspire_cities and fills
+them from an offline gazetteer of places (`name,state,lat,lon`), by
+default the bundled app/ingest/data/us_places.csv.gz (see its README).
+
+Every gazetteer place is matched against the cities' names and city
+codes (see app.ingest.common.city_lookup); a city matched by more than
+one place with its name takes the first. Unmatched cities keep their
+coordinates, NULL if they never had any, and are logged.
+
+The coordinates are merged in one transaction (COPY into a staging table,
+then UPDATE ... FROM), so the refresher's triggers reload only the cities
+whose coordinates changed. The API indexes them for /cities/near and
+/cities/bbox (see app.geo).
+
+Usage:
+    python -m app.ingest.geo
+    python -m app.ingest.geo --gazetteer places.csv --output coordinates.csv   # no load
+"""
+
+import argparse
+import logging
+import os
+
+import pandas as pd
+
+from app.ingest.common import city_lookup, connect, copy_update, fetch_cities, match_cities
+
+log = logging.getLogger(__name__)
+
+TABLE = "cityspire_cities"
+
+COLUMNS_SQL = f"""
+    ALTER TABLE {TABLE}
+      ADD COLUMN IF NOT EXISTS lat double precision,
+      ADD COLUMN IF NOT EXISTS lon double precision
+"""
+
+GAZETTEER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "us_places.csv.gz")
+
+# cityspire_cities columns written by the loader, in order
+TABLE_COLUMNS = ["id", "lat", "lon"]
+
+
+def read_gazetteer(path):
+    """
+    read_gazetteer returns the places of a gazetteer CSV (name, state,
+    lat, lon) with valid coordinates
+    """
+    places = pd.read_csv(path, dtype={"name": str, "state": str}, keep_default_na=False, na_values=[""])
+    missing = {"name", "state", "lat", "lon"} - set(places.columns)
+    if missing:
+        raise ValueError("missing columns {cols}".format(cols=sorted(missing)))
+
+    valid = places["lat"].between(-90, 90) & places["lon"].between(-180, 180)
+    if not valid.all():
+        log.warning("skipping {n} places with invalid coordinates".format(n=int((~valid).sum())))
+    return places[valid].reset_index(drop=True)
+
+
+def city_coordinates(places, cities):
+    """
+    city_coordinates returns the (id, lat, lon) rows of the cities in the
+    cityspire_cities DataFrame cities matched by a gazetteer place
+    """
+    matched = match_cities(places["name"], places["state"], city_lookup(cities))
+    hits = matched["city_id"].notna()
+    coords = pd.DataFrame({
+        "id":  matched.loc[hits, "city_id"].astype(int).values,
+        "lat": places.loc[hits, "lat"].values,
+        "lon": places.loc[hits, "lon"].values,
+    }).drop_duplicates("id")
+
+    unmatched = cities[~cities["id"].isin(coords["id"])]
+    if len(unmatched):
+        log.info("{n} of {total} cities match no place, e.g. {names}".format(
+            n=len(unmatched), total=len(cities),
+            names=[f"{c}, {s}" for c, s in zip(unmatched["city"][:5], unmatched["state"][:5])]))
+    return coords.sort_values("id").reset_index(drop=True)[TABLE_COLUMNS]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gazetteer", default=GAZETTEER, help="places CSV (name,state,lat,lon)")
+    parser.add_argument("--output", help="write the coordinates to this CSV instead of loading the database")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        places = read_gazetteer(args.gazetteer)
+    except ValueError as error:
+        raise SystemExit("ERROR: {path}: {err}".format(path=args.gazetteer, err=error))
+
+    db_sess = connect()
+    with db_sess.connection() as db_conn:
+        coords = city_coordinates(places, fetch_cities(db_conn))
+        log.info("matched {n} cities".format(n=len(coords)))
+
+        if args.output:
+            coords.to_csv(args.output, index=False)
+        else:
+            cursor = db_conn.cursor()
+            try:
+                cursor.execute(COLUMNS_SQL)
+                db_conn.commit()
+            finally:
+                cursor.close()
+            copy_update(db_conn, TABLE, coords, ["id"])
+    db_sess.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Zillow ZORI monthly rent ingestion
+
+Rebuilds cityspire_rent_history (city_code, month, rent) from a Zillow
+Observed Rent Index CSV, the wide file notebooks/Rent_Data.ipynb reads:
+one row per metro (`RegionName` like "Dallas-Fort Worth, TX") and one
+column per month (`2014-01`, or `2015-01-31` in newer files).
+
+The file is melted to one row per metro and month in a single vectorized
+step. Each metro's rents are assigned to every cityspire_cities city
+named in its RegionName (see app.ingest.common.metro_cities), as the
+notebook did by hand: "Dallas-Fort Worth, TX" feeds both Dallas and Fort
+Worth. A city named in more than one metro takes the largest (lowest
+SizeRank, else first) one.
+
+The table is replaced in one transaction; the API loads it into memory
+(see app.rent_history) on startup and /admin/refresh.
+
+Usage:
+    python -m app.ingest.rent Metro_ZORI_AllHomesPlusMultifamily_SSA.csv
+    python -m app.ingest.rent zori.csv --output rent_history.csv   # no load
+"""
+
+import argparse
+import logging
+
+import pandas as pd
+
+from app.ingest.common import city_lookup, connect, copy_replace, fetch_cities, match_cities, metro_cities
+
+log = logging.getLogger(__name__)
+
+TABLE = "cityspire_rent_history"
+
+TABLE_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {TABLE} (
+      city_code text NOT NULL,
+      month     date NOT NULL,
+      rent      real NOT NULL,
+      PRIMARY KEY (city_code, month)
+    )
+"""
+
+# cityspire_rent_history columns written by the loader, in order
+TABLE_COLUMNS = ["city_code", "month", "rent"]
+
+# Month columns: 2014-01 or 2015-01-31
+MONTH_COLUMN = r"^\d{4}-\d{2}(-\d{2})?$"
+
+def build_rent_history(df, cities):
+    """
+    build_rent_history returns the cityspire_rent_history rows of a wide
+    ZORI DataFrame for the cities in the cityspire_cities DataFrame cities
+    """
+    months = df.columns[df.columns.astype(str).str.match(MONTH_COLUMN)]
+    if len(months) == 0:
+        raise ValueError("no monthly columns (YYYY-MM or YYYY-MM-DD) found")
+    if "SizeRank" in df.columns:
+        df = df.sort_values("SizeRank", kind="stable")
+
+    candidates = metro_cities(df["RegionName"])
+    matched = match_cities(candidates["name"], candidates["state"], city_lookup(cities))
+    regions = pd.DataFrame({"region": candidates.index, "city_code": matched["city_code"].values}).dropna()
+    # the largest metro wins a city named by several; df is in that order
+    order = pd.Series(range(len(df)), index=df.index)
+    regions = regions.assign(rank=order.reindex(regions["region"]).values).sort_values("rank", kind="stable")
+    regions = regions.drop_duplicates("city_code")
+
+    unmatched = df.index.difference(regions["region"])
+    if len(unmatched):
+        log.info("{n} metros match no city, e.g. {names}".format(
+            n=len(unmatched), names=list(df.loc[unmatched[:5], "RegionName"])))
+
+    long = df.loc[regions["region"], months].set_axis(regions["city_code"].values).rename_axis("city_code")
+    long = long.reset_index().melt(id_vars="city_code", var_name="month", value_name="rent").dropna(subset=["rent"])
+    long["month"] = pd.to_datetime(long["month"].str[:7], format="%Y-%m").dt.date
+    long = long.sort_values(["city_code", "month"], kind="stable").reset_index(drop=True)
+
+    log.info("{n} monthly rents of {cities} cities from {first} to {last}".format(
+        n=len(long), cities=long["city_code"].nunique(), first=long["month"].min(), last=long["month"].max()))
+    return long[TABLE_COLUMNS]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="Zillow ZORI CSV (RegionName and one column per month)")
+    parser.add_argument("--output", help="write the table rows to this CSV instead of loading the database")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    df = pd.read_csv(args.path, encoding="utf-8-sig")
+    if "RegionName" not in df.columns:
+        raise SystemExit("ERROR: {path} has no RegionName column".format(path=args.path))
+
+    db_sess = connect()
+    with db_sess.connection() as db_conn:
+        rows = build_rent_history(df, fetch_cities(db_conn))
+
+        if args.output:
+            rows.to_csv(args.output, index=False)
+        else:
+            cursor = db_conn.cursor()
+            try:
+                cursor.execute(TABLE_SQL)
+            finally:
+                cursor.close()
+            copy_replace(db_conn, TABLE, rows)
+    db_sess.close_connection()
+
+
+if __name__ == "__main__":
+    main()
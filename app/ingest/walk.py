@@ -0,0 +1,118 @@
+"""Walk score ingestion
+
+Upserts walk scores into cityspire_wlk_scr from the CSV hand-off written
+by project/archive/sitescraping/main.go (`city_id,state,city_name,walk_score`).
+
+Rows are validated against cityspire_cities before anything is written:
+
+  - city_id must be a cityspire_cities id and state must be that city's state
+  - walk_score must be a whole number from 0 to 100
+  - a city listed more than once keeps its last row
+
+Rejected rows are logged and skipped. city_code is taken from
+cityspire_cities, so city_name only has to identify the same city.
+
+The accepted rows are merged in one transaction (COPY into a staging table,
+then INSERT ... ON CONFLICT (city_id)), so the API never reads a partially
+updated table. The first load creates the unique city_id index that needs;
+if cityspire_wlk_scr already holds more than one row for a city the load
+stops after logging them, and --dedupe deletes all but the lowest id row
+of each city instead.
+
+Usage:
+    python -m app.ingest.walk project/archive/sitescraping/import_me_db.csv
+    python -m app.ingest.walk import_me_db.csv --dry-run   # validate only
+    python -m app.ingest.walk import_me_db.csv --dedupe    # drop duplicate table rows
+"""
+
+import argparse
+import logging
+
+import pandas as pd
+
+from app.ingest.common import connect, copy_upsert, fetch_cities, normalize_names
+
+log = logging.getLogger(__name__)
+
+CSV_COLUMNS = ["city_id", "state", "city_name", "walk_score"]
+
+# cityspire_wlk_scr columns written by the loader, in order
+TABLE_COLUMNS = ["city_id", "state", "city_code", "walk_score"]
+
+UNIQUE_INDEX = "cityspire_wlk_scr_city_id_key"
+
+
+def validate_walk_scores(df, cities):
+    """
+    validate_walk_scores returns the cityspire_wlk_scr rows of the valid,
+    deduplicated rows of a scraper CSV DataFrame and the number of
+    rejected rows
+    """
+    city_id = pd.to_numeric(df["city_id"], errors="coerce")
+    score   = pd.to_numeric(df["walk_score"], errors="coerce")
+    state   = df["state"].fillna("").astype(str).str.strip().str.upper()
+
+    known = cities.set_index("id")
+    city_state = city_id.map(known["state"].str.upper())
+    city_code  = city_id.map(known["city_code"])
+    same_name  = (normalize_names(df["city_name"]) == normalize_names(city_code))
+    same_name |= (normalize_names(df["city_name"]) == normalize_names(city_id.map(known["city"])))
+
+    checks = {
+        "unknown city_id":   city_state.notna(),
+        "state mismatch":    state == city_state,
+        "city_name mismatch": same_name,
+        "invalid walk_score": score.between(0, 100) & (score == score.round()),
+    }
+    valid = pd.Series(True, index=df.index)
+    for reason, ok in checks.items():
+        failed = valid & ~ok
+        for line in df.index[failed][:10]:
+            log.warning("rejected line {line}: {reason}: {row}".format(
+                line=line + 2, reason=reason, row=df.loc[line].to_dict()))
+        if failed.sum() > 10:
+            log.warning("... {n} more rows rejected for {reason}".format(n=failed.sum() - 10, reason=reason))
+        valid &= ok
+
+    rows = pd.DataFrame({
+        "city_id":    city_id[valid].astype(int),
+        "state":      state[valid],
+        "city_code":  city_code[valid],
+        "walk_score": score[valid].astype(int),
+    })[TABLE_COLUMNS]
+
+    deduped = rows.drop_duplicates("city_id", keep="last")
+    if len(deduped) < len(rows):
+        log.info("dropped {n} duplicate rows".format(n=len(rows) - len(deduped)))
+    return deduped, int((~valid).sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="walk score CSV (city_id,state,city_name,walk_score)")
+    parser.add_argument("--dry-run", action="store_true", help="validate the CSV without loading the database")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="delete all but the lowest id row of each city repeated in cityspire_wlk_scr")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    df = pd.read_csv(args.path, dtype=str, encoding="utf-8-sig", skipinitialspace=True)
+    missing = [col for col in CSV_COLUMNS if col not in df.columns]
+    if missing:
+        raise SystemExit("ERROR: {path} is missing the columns {cols}".format(path=args.path, cols=missing))
+
+    db_sess = connect()
+    with db_sess.connection() as db_conn:
+        rows, rejected = validate_walk_scores(df, fetch_cities(db_conn))
+        log.info("{n} valid rows, {rejected} rejected".format(n=len(rows), rejected=rejected))
+
+        if not args.dry_run:
+            try:
+                copy_upsert(db_conn, "cityspire_wlk_scr", rows, ["city_id"], UNIQUE_INDEX, dedupe=args.dedupe)
+            except ValueError as error:
+                raise SystemExit("ERROR: {err}; rerun with --dedupe to delete them".format(err=error))
+    db_sess.close_connection()
+
+
+if __name__ == "__main__":
+    main()
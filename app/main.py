@@ -2,7 +2,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
-from app import db, ml, viz
+from app import cache, db, health, metrics, ml, refresher, shared, viz
 
 description = """
 Edit your app's title and description. See [https://fastapi.tiangolo.com/tutorial/metadata/](https://fastapi.tiangolo.com/tutorial/metadata/)
@@ -21,9 +21,28 @@ app = FastAPI(
     docs_url='/',
 )
 
+# Elect the worker that loads the shared snapshot, if one is shared
+app.add_event_handler('startup', shared.startup)
+# Load the city data in the background while the rest of startup runs
+app.add_event_handler('startup', ml.startup)
+app.add_event_handler('startup', db.startup)
+app.add_event_handler('startup', refresher.start)
+app.add_event_handler('startup', ml.wait_ready)
+app.add_event_handler('shutdown', db.shutdown)
+app.add_event_handler('shutdown', refresher.stop)
+app.add_event_handler('shutdown', shared.shutdown)
+
+app.include_router(health.router, tags=['Health'])
 app.include_router(db.router, tags=['Database'])
 app.include_router(ml.router, tags=['Machine Learning'])
 app.include_router(viz.router, tags=['Visualization'])
+app.include_router(metrics.router, tags=['Metrics'])
+
+app.add_middleware(cache.ResponseCacheMiddleware)
+
+# Outside the cache so cached responses are timed too
+if metrics.ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware, routes=app.routes)
 
 app.add_middleware(
     CORSMiddleware,
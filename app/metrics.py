@@ -0,0 +1,229 @@
+"""Latency and usage metrics
+
+Records request latency per route, database query and scoring call
+latency, response cache hits and misses and connection pool waits, and
+serves them on /metrics in the Prometheus text exposition format.
+
+Recording is a perf_counter pair, a bisect and a locked increment, so it
+can stay on for every request; set METRICS_ENABLED=false to turn it off.
+"""
+
+from bisect import bisect_left
+from functools import wraps
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from fastapi import APIRouter
+from fastapi.responses import Response
+from starlette.routing import Match
+
+load_dotenv()
+
+ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+router = APIRouter()
+
+
+def _labels(names, values):
+    return ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+
+
+class Histogram:
+    """
+    Histogram counts observed values per label set into cumulative
+    buckets, as a Prometheus histogram
+    """
+
+    def __init__(self, name, help, labelnames, buckets=LATENCY_BUCKETS):
+        self.name       = name
+        self.help       = help
+        self.labelnames = tuple(labelnames)
+        self.buckets    = tuple(buckets)
+        self.series     = {}     # label values -> [bucket counts..., +Inf count, sum]
+        self.lock       = threading.Lock()
+
+    def observe(self, labels, value):
+        """
+        observe records value for the tuple of label values labels
+        """
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series == None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted((labels, list(counts)) for labels, counts in self.series.items())
+        for labels, counts in series:
+            base = _labels(self.labelnames, labels)
+            sep = "," if base else ""
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {total}')
+            lines.append(f"{self.name}_sum{{{base}}} {counts[-1]}")
+            lines.append(f"{self.name}_count{{{base}}} {total}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    "cityspire_request_duration_seconds", "HTTP request latency by route, including serialization.",
+    ("method", "route", "status"))
+QUERY_SECONDS = Histogram(
+    "cityspire_query_duration_seconds", "Database query latency by query.", ("query",))
+CALL_SECONDS = Histogram(
+    "cityspire_call_duration_seconds", "Scoring function latency by function.", ("function",))
+POOL_WAIT_SECONDS = Histogram(
+    "cityspire_db_pool_wait_seconds", "Time spent waiting for a pooled database connection.", ("pool",))
+
+HISTOGRAMS = [REQUEST_SECONDS, QUERY_SECONDS, CALL_SECONDS, POOL_WAIT_SECONDS]
+
+# Callables returning extra exposition lines, e.g. counters kept elsewhere
+COLLECTORS = []
+
+
+def timed(histogram, name=None):
+    """
+    timed is a decorator recording the wall time of every call of a
+    function in histogram, labelled with name (default: the function's name)
+
+    Usage:
+      @metrics.timed(metrics.QUERY_SECONDS)
+      def gen_crime_score(db_conn, city):
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+        labels = (name or func.__name__,)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(labels, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class timer:
+    """
+    timer is a context manager recording the wall time of its block in
+    histogram, labelled with name
+
+    Usage:
+      with metrics.timer(metrics.QUERY_SECONDS, "snapshot"):
+          cursor.execute(SNAPSHOT_SQL)
+    """
+
+    def __init__(self, histogram, name):
+        self.histogram = histogram
+        self.labels    = (name,)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if ENABLED:
+            self.histogram.observe(self.labels, time.perf_counter() - self.start)
+        return False
+
+
+def render():
+    """
+    render returns every metric in the Prometheus text exposition format
+    """
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for collect in COLLECTORS:
+        lines.extend(collect())
+    return "\n".join(lines) + "\n"
+
+
+def counter(name, help, value, kind="counter"):
+    """
+    counter returns the exposition lines of a single unlabelled counter
+    or gauge; modules register callables returning such lines in COLLECTORS
+    """
+    return [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {value}"]
+
+
+class MetricsMiddleware:
+    """
+    MetricsMiddleware records the latency of every HTTP request in
+    REQUEST_SECONDS, labelled with the route's path template
+    (e.g. `/crime_scr/{city}`) so that cities do not multiply the series
+
+    Requests matching no route are labelled `unmatched`; a route matching
+    the path but not the method (a 405) labels the request only when no
+    route matches both, as routing itself does
+    """
+
+    def __init__(self, app, routes):
+        self.app    = app
+        self.routes = routes
+        self.paths  = {}     # (method, raw path) -> route template
+
+    def route_of(self, scope):
+        key = (scope["method"], scope["path"])
+        route = self.paths.get(key)
+        if route == None:
+            route = "unmatched"
+            partial = None
+            for candidate in self.routes:
+                match, _ = candidate.matches(scope)
+                if match == Match.FULL:
+                    route = candidate.path
+                    break
+                if match == Match.PARTIAL and partial == None:
+                    partial = candidate.path
+            else:
+                if partial != None:
+                    route = partial
+            if len(self.paths) >= 10000:
+                self.paths.clear()
+            self.paths[key] = route
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_SECONDS.observe((scope["method"], self.route_of(scope), status[0]),
+                                    time.perf_counter() - start)
+
+
+@router.get('/metrics')
+def get_metrics():
+    """
+    get_metrics returns request, query and scoring call latency
+    histograms, response cache hits and misses and connection pool
+    waits in the Prometheus text exposition format
+    """
+    return Response(content=render(), media_type=CONTENT_TYPE)
@@ -1,46 +1,141 @@
 """Machine learning functions"""
 
-from fastapi import APIRouter, HTTPException
-from sqlalchemy.sql import text
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from typing import List
+from urllib.parse import urlencode
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+import numpy as np
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from random import randint
 
-from app.db import get_db
+from app import forecast, geo, metrics, rent_history, scoring, shared, similarity, snapshot, snapshot_file
 from app.dbsession import DBSession
-from app.helpers import gen_crime_score, gen_rent_score, gen_aq_score, gen_walk_score
-from app.helpers import calc_wghtd_city_score
+from app.helpers import calc_wghtd_city_score, calc_wghtd_city_scores
+
+log = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Create a database session object
+# Create a database session (connection pool) object; its connections are
+# opened by warm_up() once the application starts, not at import
 db_sess = DBSession()
-# Connect to the database
-db_conn_attempt = db_sess.connect()
 
-# Determine if any connection errors occurred
-if db_conn_attempt["error"] == None:
-    # no errors connecting, assign the connection object for use
-    db_conn = db_conn_attempt["value"]
+def warm_up():
+    """
+    warm_up connects the pool to the database and loads the supported
+    cities with their metrics and scores into memory, retrying with
+    exponential backoff until both succeed; app.refresher keeps the
+    data up to date from then on
 
-    # fetch set of officially supported cities and save in memory
-    sql = "SELECT id, city, state, city_code FROM cityspire_cities WHERE active = 'yes'"
-    try:
-      dict_cur      = db_conn.cursor(cursor_factory=RealDictCursor)
-      dict_cur.execute(sql)                 # execute the sql query
-      store_cities  = dict_cur.fetchall()   # fetch the query results
-      dict_cur.close()
+    Runs in a background thread started by startup(), so the server
+    answers /healthz while the data loads and /readyz once it has
+
+    With SNAPSHOT_FILE set, it maps that snapshot file (see
+    app.snapshot_file) instead and never connects to the database
+    """
+    snapshot_path = os.getenv("SNAPSHOT_FILE")
+    if snapshot_path:
+      try:
+        _, snap = snapshot_file.read_snapshot(snapshot_path)
+      except (OSError, ValueError) as error:
+        log.error("error reading the snapshot file {path}: {err}".format(path=snapshot_path, err=error))
+        return
+      snapshot.swap(snap)
+      log.info("serving snapshot {ver} of {path} without a database".format(ver=snap.version, path=snapshot_path))
+      if scoring.weight_grid != None:
+        scoring.weight_grid.warm()
+      return
+
+    # Materialize the weight grid, if enabled, while the data loads
+    if scoring.weight_grid != None:
+      scoring.weight_grid.warm()
+
+    if not db_sess.valEnvVarsFlg:
+      log.error("invalid database environment variables; serving without city data")
+      return
+
+    delay = db_sess.backoff
+    while not snapshot.ready():
+      if shared.following():
+        # another worker loads the snapshot and app.shared attaches it here;
+        # load it ourselves if this worker becomes the leader first
+        snapshot.wait_ready(1.0)
+        continue
+
+      db_conn_attempt = db_sess.connect()
+      if db_conn_attempt["error"] == None:
+        with db_sess.connection() as db_conn:
+          snap_attempt = snapshot.refresh(db_conn)
+          if snap_attempt["error"] == None:
+            rent_history.refresh(db_conn)
+        if snap_attempt["error"] == None:
+          return
+        log.error("error loading the city score snapshot; retrying in {delay}s".format(delay=delay))
+      else:
+        log.error("error attempting to connect to the database; retrying in {delay}s".format(delay=delay))
 
+      time.sleep(delay)
+      delay = min(delay * 2, 30)
+
+    # Followers attach the shared snapshot; the monthly rents are not part
+    # of it, so they load those themselves
+    if db_sess.connect()["error"] == None:
+      with db_sess.connection() as db_conn:
+        rent_history.refresh(db_conn)
+
+def startup():
+    """
+    startup starts warm_up() in the background, then loads the rent
+    forecast artifact; register it before the other startup handlers so
+    they run while the data loads
+    """
+    threading.Thread(target=warm_up, name="snapshot-warm-up", daemon=True).start()
+    # A small file; no database needed
+    forecast.load_from_env()
+
+def wait_ready():
+    """
+    wait_ready holds application startup until warm_up() is done or
+    STARTUP_READY_TIMEOUT seconds (default 0, don't wait) have passed;
+    for deployments that route traffic as soon as the port is bound
+    instead of asking /readyz
+    """
+    timeout = float(os.getenv("STARTUP_READY_TIMEOUT", 0))
+    if timeout > 0 and not snapshot.wait_ready(timeout):
+      log.error("city score snapshot not loaded after {timeout}s; starting anyway".format(timeout=timeout))
+
+def get_db_conn():
+    """
+    get_db_conn checks a connection out of the pool for the duration
+    of a request and returns it to the pool afterwards
+
+    psycopg2 calls block, so endpoints using the connection are declared
+    with a plain `def`; FastAPI runs those (and this dependency) in its
+    bounded thread pool instead of on the event loop
+
+    Usage:
+      def endpoint(db_conn=Depends(get_db_conn)):
+    """
+    try:
+      with metrics.timer(metrics.POOL_WAIT_SECONDS, "dbsession"):
+        db_conn = db_sess.getconn()
     except (Exception, psycopg2.Error) as error:
-      store_cities = []
-      print("ERROR: error fetching array of supported cities; see: {err_str}".format(err_str=db_conn_attempt["error"]))
+      raise HTTPException(status_code=503, detail={"error": f"database unavailable - {error}"})
 
-else:
-    # a connection error has occurred
-    print("ERROR: error attempting to connect to the database: {err_str}".format(err_str=db_conn_attempt["error"]))
+    try:
+      yield db_conn
+    finally:
+      db_sess.putconn(db_conn)
 
 @router.get('/db_test')
-async def db_test():
+def db_test():
     """
     db_test tests the db session object's connection 
     to the Postgres database and returns connection 
@@ -48,10 +143,136 @@ async def db_test():
     """
     return db_sess.test_connection()
 
+def require_admin(authorization: str=Header(None)):
+    """
+    require_admin rejects requests without an `Authorization: Bearer
+    <token>` header matching the ADMIN_TOKEN environment variable; the
+    admin endpoints are disabled while ADMIN_TOKEN is not set
+
+    Usage:
+      def endpoint(_=Depends(require_admin)):
+    """
+    token = os.getenv("ADMIN_TOKEN")
+    if not token:
+      raise HTTPException(status_code=403, detail={"error": "admin endpoints are disabled; set ADMIN_TOKEN to enable them"})
+    scheme, _, credentials = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(credentials.strip().encode(), token.encode()):
+      raise HTTPException(status_code=401, detail={"error": "invalid admin token"},
+                          headers={"WWW-Authenticate": "Bearer"})
+
+# Held while /admin/refresh reloads the data; concurrent calls are rejected
+_admin_refresh_lock = threading.Lock()
+
+def admin_refresh_slot():
+    """
+    admin_refresh_slot lets one /admin/refresh run at a time, rejecting
+    calls made while one is in progress before they check out a
+    database connection
+    """
+    if not _admin_refresh_lock.acquire(blocking=False):
+      raise HTTPException(status_code=409, detail={"error": "a refresh is already in progress"})
+    try:
+      yield
+    finally:
+      _admin_refresh_lock.release()
+
+@router.post('/admin/refresh')
+def refresh_snapshot(_admin=Depends(require_admin), _slot=Depends(admin_refresh_slot), db_conn=Depends(get_db_conn)):
+    """
+    refresh_snapshot reloads every city's metrics, scores and monthly
+    rents from the database and atomically swaps them in for the score
+    endpoints; requests in flight keep reading the previous snapshot
+
+    Needs an `Authorization: Bearer <ADMIN_TOKEN>` header; a call made
+    while another refresh is in progress gets a 409
+
+    return values:
+      - "ok":        `True` (no errors found); `False` (errors found)
+      - "error":     error message
+      - "version":   version of the snapshot being served
+      - "cities":    number of cities in the snapshot
+      - "quantile_edges": air quality and rent score quantile edges
+    """
+    ret_dict = {"ok": False, "error": None, "version": None, "cities": None, "quantile_edges": None}
+
+    snap_attempt = snapshot.refresh(db_conn)
+    if snap_attempt["error"] != None:
+      ret_dict["error"] = snap_attempt["error"]
+      ret_dict["version"] = snapshot.current().version
+      raise HTTPException(status_code=500, detail=ret_dict)
+
+    # Monthly rents are served as they were if they fail to reload
+    rent_history.refresh(db_conn)
+
+    ret_dict["ok"]      = True
+    ret_dict["version"] = snap_attempt["value"].version
+    ret_dict["cities"]  = len(snap_attempt["value"])
+    ret_dict["quantile_edges"] = snap_attempt["value"].engine.quantile_edges
+    return ret_dict
+
+# Fields /cities can project, and the ones it returns by default
+CITY_FIELDS = ("id", "city", "state", "city_code", "population", "lat", "lon")
+DEFAULT_CITY_FIELDS = ("id", "city", "state", "city_code")
+
+# Cities serialized per chunk of a streamed /cities dump
+CITIES_CHUNK = 1000
+
+def city_fields(snap, rows, fields):
+    """
+    city_fields returns the passed fields (CITY_FIELDS) of the cities at
+    the snapshot rows, one dict per city, converting each array once
+    """
+    rows = np.asarray(rows, dtype=np.intp)
+    cities = [snap.cities[row] for row in rows.tolist()]
+    columns = []
+    for field in fields:
+      if field == "population":
+        columns.append([None if pop != pop else int(pop) for pop in snap.population[rows].tolist()])
+      elif field in ("lat", "lon"):
+        columns.append([None if val != val else val for val in snap.coords[rows, int(field == "lon")].tolist()])
+      else:
+        columns.append([city[field] for city in cities])
+    return [dict(zip(fields, values)) for values in zip(*columns)]
+
+def stream_cities(snap, rows, fields):
+    """
+    stream_cities yields the JSON array of the cities at the snapshot rows
+    CITIES_CHUNK cities at a time, so a full dump is never held as one
+    list of dicts; the bytes are those JSONResponse would send
+    """
+    yield b"["
+    for lo in range(0, len(rows), CITIES_CHUNK):
+      chunk = json.dumps(city_fields(snap, rows[lo:lo + CITIES_CHUNK], fields),
+                         ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+      yield (("," if lo else "") + chunk[1:-1]).encode("utf-8")
+    yield b"]"
+
 @router.get('/cities')
-async def cities():
+async def cities(response: Response, q: str=None, limit: int=Query(10, ge=1), fields: str=None,
+                 cursor: str=None, page_size: int=Query(None, ge=1, le=1000)):
     """
-    cities returns a json array of supported cities (active = 'yes')
+    cities returns a json array of supported cities (active = 'yes'),
+    in id order
+
+    Querystring parameters
+      - q: optional city name prefix; returns up to `limit` supported
+        cities whose name or city code starts with it, for autocomplete
+        (e.g. `/cities?q=st lo`, `/cities?q=saint`)
+      - limit: maximum number of autocomplete results (default value = 10)
+      - fields: optional comma separated fields to return, of id, city,
+        state, city_code, population, lat and lon (default value =
+        id,city,state,city_code)
+      - page_size: optional number of cities per page, 1-1000; returns
+        one page, with a `Link: <...>; rel="next"` header to the next
+        page unless it is the last one
+      - cursor: where the page starts, from the previous page's Link
+        header (page_size defaults to 100 when only cursor is passed)
+
+    Without q, page_size or cursor every supported city is returned,
+    streamed in chunks
+
+    examples:
+      - GET `/cities?page_size=500&fields=city_code,lat,lon`
 
     Example Response:
     ```
@@ -77,13 +298,163 @@ async def cities():
     ]
     ```
     """
+    snap = snapshot.current()
+    rows, ids = snap.active_rows()
+
     # Do we have a list of supported cities?
-    if len(store_cities) == 0:
+    if len(rows) == 0:
       # list of supported cities is 0 - an error has occurred
       ret_dict = {"msg": "no supported cities found"}
       raise HTTPException(status_code=500, detail=ret_dict)
 
-    return store_cities
+    if fields == None:
+      fields = DEFAULT_CITY_FIELDS
+    else:
+      fields = tuple(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+      if len(fields) == 0 or any(field not in CITY_FIELDS for field in fields):
+        ret_dict = {"msg": "fields must be a comma separated list of {known}".format(known=", ".join(CITY_FIELDS))}
+        raise HTTPException(status_code=400, detail=ret_dict)
+
+    if q != None:
+      # autocomplete the passed prefix from the in-memory name index
+      return city_fields(snap, snap.names.complete(q, limit), fields)
+
+    if cursor == None and page_size == None:
+      return StreamingResponse(stream_cities(snap, rows, fields), media_type="application/json")
+
+    # The cursor is the id of the previous page's last city, so pages stay
+    # consistent when the snapshot is reloaded between them
+    start = 0
+    if cursor != None:
+      try:
+        start = int(np.searchsorted(ids, int(cursor), side="right"))
+      except ValueError:
+        ret_dict = {"msg": "invalid cursor {cursor}".format(cursor=cursor)}
+        raise HTTPException(status_code=400, detail=ret_dict)
+    if page_size == None:
+      page_size = 100
+
+    end = start + page_size
+    if end < len(rows):
+      params = {"cursor": int(ids[end - 1]), "page_size": page_size}
+      if fields != DEFAULT_CITY_FIELDS:
+        params["fields"] = ",".join(fields)
+      response.headers["Link"] = '</cities?{query}>; rel="next"'.format(query=urlencode(params, safe=","))
+    return city_fields(snap, rows[start:end], fields)
+
+def city_summaries(snap, rows):
+    """
+    city_summaries returns the id, names, coordinates, population and 1-5
+    scores (None where missing) of the cities at the snapshot rows
+    """
+    rows = np.asarray(rows, dtype=np.intp)
+    summaries = city_fields(snap, rows, ("id", "city", "state", "city_code", "lat", "lon", "population"))
+    for summary, city_scores in zip(summaries, snap.scores[rows].tolist()):
+      summary["scores"] = {dim: None if score == 0 else int(score) for dim, score in zip(snapshot.DIMENSIONS, city_scores)}
+    return summaries
+
+@router.get('/cities/near')
+async def cities_near(lat: float=Query(..., ge=-90, le=90), lon: float=Query(..., ge=-180, le=180),
+                      radius_km: float=Query(50, gt=0, le=2000), limit: int=Query(25, ge=1, le=1000)):
+    """
+    cities_near returns the supported cities within a radius of a point,
+    nearest first, with their scores
+
+    request:
+      - GET `/cities/near`
+      - Querystring parameters
+        -  lat, lon: the point, in degrees
+        -  radius_km: radius in km, up to 2000 (default value = 50)
+        -  limit: maximum number of cities to return, 1-1000 (default value = 25)
+
+    examples:
+      - GET `/cities/near?lat=38.627&lon=-90.199`
+      - GET `/cities/near?lat=39.74&lon=-104.99&radius_km=200&limit=10`
+
+    return values:
+      - "ok":     `True` (no errors found); `False` (errors found)
+      - "error":  error message
+      - "count":  number of supported cities within the radius
+      - "cities": array of the nearest of them, nearest first
+        - "id", "city", "state", "city_code", "lat", "lon", "population"
+        - "distance_km": distance from the point
+        - "scores": "crime", "walk", "air" and "rent" 1-5 scores or null
+    """
+    # Define a response object
+    ret_dict            = {}
+    ret_dict["ok"]      = False
+    ret_dict["msg"]     = ""
+    ret_dict["error"]   = None
+    ret_dict["count"]   = 0
+    ret_dict["cities"]  = []
+
+    index = geo.current()
+    if index == None:
+      ret_dict["error"] = "the city data is not loaded yet"
+      raise HTTPException(status_code=503, detail=ret_dict)
+
+    rows, distances, count = index.near(lat, lon, radius_km, limit)
+    ret_dict["cities"] = city_summaries(index.snap, rows)
+    for city_dict, distance in zip(ret_dict["cities"], np.round(distances, 2).tolist()):
+      city_dict["distance_km"] = distance
+
+    # Return results
+    ret_dict["ok"]      = True
+    ret_dict["count"]   = count
+    ret_dict["msg"]     = f"{count} cities within {radius_km:g} km"
+    return ret_dict
+
+@router.get('/cities/bbox')
+async def cities_bbox(south: float=Query(..., ge=-90, le=90), west: float=Query(..., ge=-180, le=180),
+                      north: float=Query(..., ge=-90, le=90), east: float=Query(..., ge=-180, le=180),
+                      limit: int=Query(100, ge=1, le=1000)):
+    """
+    cities_bbox returns the supported cities inside a bounding box, most
+    populous first, with their scores
+
+    request:
+      - GET `/cities/bbox`
+      - Querystring parameters
+        -  south, west, north, east: the box edges, in degrees; a west
+           greater than east spans the antimeridian
+        -  limit: maximum number of cities to return, 1-1000 (default value = 100)
+
+    examples:
+      - GET `/cities/bbox?south=36&west=-95&north=41&east=-89`
+
+    return values:
+      - "ok":     `True` (no errors found); `False` (errors found)
+      - "error":  error message
+      - "count":  number of supported cities inside the box
+      - "cities": array of the most populous of them, most populous first
+        - "id", "city", "state", "city_code", "lat", "lon", "population"
+        - "scores": "crime", "walk", "air" and "rent" 1-5 scores or null
+    """
+    # Define a response object
+    ret_dict            = {}
+    ret_dict["ok"]      = False
+    ret_dict["msg"]     = ""
+    ret_dict["error"]   = None
+    ret_dict["count"]   = 0
+    ret_dict["cities"]  = []
+
+    if south > north:
+      ret_dict["error"] = "south must not be greater than north"
+      raise HTTPException(status_code=400, detail=ret_dict)
+
+    index = geo.current()
+    if index == None:
+      ret_dict["error"] = "the city data is not loaded yet"
+      raise HTTPException(status_code=503, detail=ret_dict)
+
+    rows, count = index.bbox(south, west, north, east, limit)
+    ret_dict["cities"] = city_summaries(index.snap, rows)
+
+    # Return results
+    ret_dict["ok"]      = True
+    ret_dict["count"]   = count
+    ret_dict["msg"]     = f"{count} cities in the box"
+    return ret_dict
 
 @router.get('/crime_scr/{city}')
 async def get_crime_score(city: str):
@@ -119,19 +490,22 @@ async def get_crime_score(city: str):
       ret_dict["error"] = "missing city parameter"
       raise HTTPException(status_code=400, detail=ret_dict)
 
-    # Generate the crime score
-    crime_score = gen_crime_score(db_conn, city)
+    # Look up the crime score
+    snap = snapshot.current()
+    row = snap.find(city)
+    crime_score = None if row == None else snap.get_score(row, "crime")
 
-    # Any errors generating a crime score?
-    if crime_score["score"] == None:
-      ret_dict["error"] = crime_score["error"]
+    # Any errors looking up a crime score?
+    if crime_score == None:
+      ret_dict["error"] = f"city: {city} not found"
+      ret_dict["suggestions"] = snap.names.suggest(city) if row == None else []
       raise HTTPException(status_code=400, detail=ret_dict)
 
     # Return results
     ret_dict["ok"]      = True
     ret_dict["error"]   = None
     ret_dict["msg"]     = f"{city} crime score"
-    ret_dict["score"]   = crime_score["score"]
+    ret_dict["score"]   = crime_score
     return ret_dict
 
 @router.get('/rent_rate/{city}')
@@ -166,21 +540,185 @@ async def get_rent_rate(city: str):
       # raise error if city is missing
       raise HTTPException(status_code=400, detail="missing city parameter")
   
-  # Generate the rent score
-  rent_score = gen_rent_score(db_conn, city)
+  # Look up the rent score
+  snap = snapshot.current()
+  row = snap.find(city)
+  avg_rent = None if row == None else snap.get_metric(row, "rent")
 
-  # Any errors generating a score?
-  if rent_score["score"] == None:
-    ret_dict["error"] = rent_score["error"]
+  # Any errors looking up a score?
+  if avg_rent == None:
+    ret_dict["error"] = f"{city} average rent not found"
+    ret_dict["suggestions"] = snap.names.suggest(city) if row == None else []
     raise HTTPException(status_code=400, detail=ret_dict)
 
-  ret_dict['avg_rent'] = rent_score['avg_rent']
-  ret_dict['score'] = rent_score['score']
+  rent_score = snap.get_score(row, "rent")
+  if rent_score == None:
+    ret_dict["error"] = "no score available"
+    raise HTTPException(status_code=400, detail=ret_dict)
+
+  ret_dict['avg_rent'] = avg_rent
+  ret_dict['score'] = rent_score
   
   return ret_dict
 
+@router.get('/rent_rate/{city}/history')
+async def get_rent_history(city: str, start: str=Query(None, alias="from"), end: str=Query(None, alias="to")):
+  '''
+  Takes in a city and returns its monthly average rents (Zillow ZORI)
+  and their year-over-year change, answered from memory:
+  rents: the raw average rent of each month
+  yoy:   change from the same month a year earlier (0.05 = +5%),
+         null where either month has no rent
+
+  request:
+    - GET `/rent_rate/<normalized city code>/history`
+    - Querystring parameters
+      - from: first month, YYYY-MM (default: the first month with a rent)
+      - to:   last month, YYYY-MM (default: the latest month)
+
+  examples:
+    - GET `/rent_rate/St_Louis/history`
+    - GET `/rent_rate/Houston/history?from=2019-01&to=2020-12`
+  returns
+  {
+    - msg: '{City} Monthly Rent',
+    - city_code: the city's code
+    - months: ["YYYY-MM", ...] with a rent in range, oldest first
+    - rents: the raw average rent of each month
+    - yoy: the year-over-year change of each month
+    - latest_yoy: the year-over-year change of the last month
+  }
+  '''
+  # set up the return dictionary
+  ret_dict = {}
+  ret_dict['msg'] = f'{city} Monthly Rent'
+  ret_dict['error'] = None
+  ret_dict['city_code'] = None
+  ret_dict['months'] = []
+  ret_dict['rents'] = []
+  ret_dict['yoy'] = []
+  ret_dict['latest_yoy'] = None
+
+  # Validate the month range
+  first = None if start == None else rent_history.parse_month(start)
+  last = None if end == None else rent_history.parse_month(end)
+  if (start != None and first == None) or (end != None and last == None):
+    ret_dict["error"] = "from and to must be months formatted YYYY-MM"
+    raise HTTPException(status_code=400, detail=ret_dict)
+  if first != None and last != None and first > last:
+    ret_dict["error"] = "from must not be after to"
+    raise HTTPException(status_code=400, detail=ret_dict)
+
+  # Look up the city's rents
+  snap = snapshot.current()
+  row = snap.find(city)
+  series = None if row == None else rent_history.current().series(snap.cities[row]["city_code"], first, last)
+
+  if series == None:
+    ret_dict["error"] = f"{city} monthly rent not found"
+    ret_dict["suggestions"] = snap.names.suggest(city) if row == None else []
+    raise HTTPException(status_code=404, detail=ret_dict)
+
+  months, rents, yoy = series
+  ret_dict['city_code'] = snap.cities[row]["city_code"]
+  ret_dict['months'] = months
+  ret_dict['rents'] = [None if r != r else r for r in np.round(rents.astype(np.float64), 2).tolist()]
+  ret_dict['yoy'] = [None if y != y else y for y in np.round(yoy.astype(np.float64), 4).tolist()]
+  ret_dict['latest_yoy'] = ret_dict['yoy'][-1]
+
+  return ret_dict
+
+@router.get('/rent_forecast/{city}')
+async def get_rent_forecast(city: str, months: int=Query(3, ge=1, le=forecast.MAX_HORIZON)):
+  '''
+  Takes in a city and returns its forecast average rent for each of
+  the next months after the last month of Zillow ZORI data; see
+  app/forecast.py for the model (`python -m app.forecast` trains it)
+
+  request:
+    - GET `/rent_forecast/<normalized city code>`
+    - Querystring parameters
+      - months: months to forecast, 1-24 (default value = 3)
+
+  examples:
+    - GET `/rent_forecast/St_Louis`
+    - GET `/rent_forecast/Houston?months=12`
+  returns
+  {
+    - msg: '{City} Rent Forecast',
+    - city_code: the city's code
+    - months: ["YYYY-MM", ...] forecast
+    - forecast: the forecast average rent of each month
+  }
+  '''
+  # set up the return dictionary
+  ret_dict = {}
+  ret_dict['msg'] = f'{city} Rent Forecast'
+  ret_dict['error'] = None
+  ret_dict['city_code'] = None
+  ret_dict['months'] = []
+  ret_dict['forecast'] = []
+
+  model = forecast.current()
+  if model == None:
+    ret_dict["error"] = "no rent forecast model loaded"
+    raise HTTPException(status_code=503, detail=ret_dict)
+
+  # Look up the city's model
+  snap = snapshot.current()
+  row = snap.find(city)
+  rents = None if row == None else model.forecast(snap.cities[row]["city_code"], months)
+
+  if rents is None:
+    ret_dict["error"] = f"{city} rent forecast not found"
+    ret_dict["suggestions"] = snap.names.suggest(city) if row == None else []
+    raise HTTPException(status_code=404, detail=ret_dict)
+
+  ret_dict['city_code'] = snap.cities[row]["city_code"]
+  ret_dict['months'] = model.labels[:months]
+  ret_dict['forecast'] = np.round(rents, 2).tolist()
+
+  return ret_dict
+
+@router.get('/rent_forecast')
+async def get_rent_forecasts(months: int=Query(3, ge=1, le=forecast.MAX_HORIZON)):
+  '''
+  Returns the forecast average rent of every city with a model for each
+  of the next months, computed in one matrix product
+
+  request:
+    - GET `/rent_forecast`
+    - Querystring parameters
+      - months: months to forecast, 1-24 (default value = 3)
+
+  examples:
+    - GET `/rent_forecast?months=6`
+  returns
+  {
+    - msg: 'Rent Forecasts',
+    - months: ["YYYY-MM", ...] forecast
+    - forecasts: {city_code: [forecast average rent of each month], ...}
+  }
+  '''
+  # set up the return dictionary
+  ret_dict = {}
+  ret_dict['msg'] = 'Rent Forecasts'
+  ret_dict['error'] = None
+  ret_dict['months'] = []
+  ret_dict['forecasts'] = {}
+
+  model = forecast.current()
+  if model == None:
+    ret_dict["error"] = "no rent forecast model loaded"
+    raise HTTPException(status_code=503, detail=ret_dict)
+
+  ret_dict['months'] = model.labels[:months]
+  ret_dict['forecasts'] = dict(zip(model.codes, np.round(model.forecast_all(months), 2).tolist()))
+
+  return ret_dict
+
 @router.get('/population_data/{city}')
-async def get_population_data(city: str):
+async def get_population_data(city: str, response: Response):
   '''
   Returns population data for the city passed in
   e.g.
@@ -198,24 +736,20 @@ async def get_population_data(city: str):
   ret_dict['msg'] = f'{city} Population'
   ret_dict['population'] = None
 
-  # query the database
-  try:
-    cursor = db_conn.cursor()
-    sql = 'SELECT "population" FROM cityspire_cities WHERE "city_code" = %s;'
-    cursor.execute(sql, (city,))
-    population = cursor.fetchone()
-  except (Exception, psycopg2.Error) as error:
-    ret_dict['Error'] = f"error fetching population data for city: {city} - {error}"
-    return ret_dict
+  # look up the population
+  snap = snapshot.current()
+  row = snap.find(city)
 
   # return error if there was no data found
-  if population == None:
+  if row == None:
     ret_dict['Error'] = f'{city} population data not found'
+    ret_dict['suggestions'] = snap.names.suggest(city)
+    # an error, even though it is a 200: don't cache it
+    response.headers['Cache-Control'] = 'no-store'
     return ret_dict
   else:
-    ret_dict['population'] = population[0]
-  
-  cursor.close()
+    ret_dict['population'] = snap.get_population(row)
+
   return ret_dict
 
 @router.get('/walk_scr/{city}')
@@ -252,19 +786,22 @@ async def get_walk_scr(city: str):
       ret_dict["msg"] = "missing city parameter"
       raise HTTPException(status_code=400, detail=ret_dict)
 
-    # Generate the walkablity score
-    walk_score = gen_walk_score(db_conn, city)
+    # Look up the walkablity score
+    snap = snapshot.current()
+    row = snap.find(city)
+    walk_score = None if row == None else snap.get_score(row, "walk")
 
-    # Any errors generating a walk score?
-    if walk_score["score"] == None:
-      ret_dict["error"] = walk_score["error"]
+    # Any errors looking up a walk score?
+    if walk_score == None:
+      ret_dict["error"] = f"walkability score for city: {city} not found"
+      ret_dict["suggestions"] = snap.names.suggest(city) if row == None else []
       raise HTTPException(status_code=400, detail=ret_dict)
     
     # Return results
     ret_dict["ok"]      = True
     ret_dict["error"]   = None
     ret_dict["msg"]     = f"{city} walkability score"
-    ret_dict["score"]   = walk_score["score"]
+    ret_dict["score"]   = walk_score
 
     return ret_dict
 
@@ -313,56 +850,17 @@ async def get_city_scr(city: str, crime: int=5, walk: int=5, air: int=5, rent: i
       ret_dict["error"] = "missing city parameter"
       raise HTTPException(status_code=400, detail=ret_dict)
 
-    # Query the database for the passed city code
-    sql = "SELECT COUNT(*) FROM cityspire_cities WHERE city_code = %s"
-    try:
-        cursor      = db_conn.cursor()      # construct a database cursor
-        cursor.execute(sql, (city,))        # execute the sql query
-        city_val    = cursor.fetchone()     # fetch the query results
-        cursor.close()
-
-    except (Exception, psycopg2.Error) as error:
-        ret_dict["error"] = f"error fetching the overall quality of life score for city: {city} - {error}"
-        raise HTTPException(status_code=500, detail=ret_dict)
+    # Look up the passed city code
+    snap = snapshot.current()
+    row = snap.find(city)
 
     # Was the city found?
-    if city_val[0] == 0:
-        # no results returned from the query - quality of life crime score not found
+    if row == None:
+        # city not in the snapshot - quality of life crime score not found
         ret_dict["error"] = f"quality of life score for city: {city} not found"
+        ret_dict["suggestions"] = snap.names.suggest(city)
         raise HTTPException(status_code=404, detail=ret_dict)
-    
-    # Calculate the individual component city scores
-    intrm_crime = gen_crime_score(db_conn, city)
-    if intrm_crime["score"] == None:
-      # error calculating the crime score
-      ret_dict["error"] = intrm_crime["error"]
-      raise HTTPException(status_code=500, detail=ret_dict)
-
-    intrm_walk = gen_walk_score(db_conn, city)
-    if intrm_walk["score"] == None:
-      # error calculating the walkability score
-      ret_dict["error"] = intrm_walk["error"]
-      raise HTTPException(status_code=500, detail=ret_dict)
-
-    intrm_air = gen_aq_score(db_conn, city)
-    if intrm_air["score"] == None:
-      # error calculating the air quality score
-      ret_dict["error"] = intrm_air["error"]
-      raise HTTPException(status_code=500, detail=ret_dict)
-
-    intrm_rent = gen_rent_score(db_conn, city)
-    if intrm_rent["score"] == None:
-      # error calculating the rent score
-      ret_dict["error"] = intrm_rent["error"]
-      raise HTTPException(status_code=500, detail=ret_dict)
 
-    # Construct a city score dict/map
-    score_dict = {
-      "crime": intrm_crime["score"],
-      "walk": intrm_walk["score"],
-      "air": intrm_air["score"],
-      "rent": intrm_rent["score"]
-    }
     # Construct a user weighting dict/map
     usr_weight_dict = {
       "crime": crime,
@@ -371,8 +869,23 @@ async def get_city_scr(city: str, crime: int=5, walk: int=5, air: int=5, rent: i
       "rent": rent
     }
 
-    # Calculate the user's weighted average of the underlying city scores
-    wght_score = calc_wghtd_city_score(score_dict, usr_weight_dict)
+    # Look up the precomputed weighted score if the weight grid is enabled
+    wght_score = None
+    if scoring.weight_grid != None:
+      wght_score = scoring.weight_grid.lookup(snap.profiles[row], usr_weight_dict)
+
+    if wght_score == None:
+      # Look up the individual component city scores
+      score_dict = {}
+      for dim in snapshot.DIMENSIONS:
+        score_dict[dim] = snap.get_score(row, dim)
+        if score_dict[dim] == None:
+          # error looking up a component score
+          ret_dict["error"] = f"{dim} score for city: {city} not found"
+          raise HTTPException(status_code=500, detail=ret_dict)
+
+      # Calculate the user's weighted average of the underlying city scores
+      wght_score = calc_wghtd_city_score(score_dict, usr_weight_dict)
 
     # Return results
     ret_dict["ok"]      = True
@@ -381,6 +894,334 @@ async def get_city_scr(city: str, crime: int=5, walk: int=5, air: int=5, rent: i
     ret_dict["score"]   = wght_score
     return ret_dict
 
+# Raw metric reported for each livability dimension in a city profile
+PROFILE_METRICS = {
+  "crime": "combined_scaled_rate",
+  "walk":  "walk_score",
+  "air":   "combined_total",
+  "rent":  "avg_rent",
+}
+
+@router.get('/city/{city}')
+async def get_city_profile(city: str, crime: int=Query(5, ge=0, le=10), walk: int=Query(5, ge=0, le=10),
+                           air: int=Query(5, ge=0, le=10), rent: int=Query(5, ge=0, le=10)):
+    """
+    get_city_profile returns everything known about a city in one response:
+    population, the raw value and 1-5 score of every livability dimension
+    and the overall weighted quality of life score
+
+    Missing data is reported per field: a dimension without data has a
+    `null` value and score and its own error message, and the weighted
+    score is only calculated when every dimension has a score
+
+    request:
+      - GET `/city/<normalized city code>`
+      - Querystring parameters (as for `/city_scr`)
+        -  crime, walk, air, rent: integer 0-10 (default value = 5)
+
+    examples:
+      - GET `/city/St_Louis`
+      - GET `/city/Houston?crime=4&walk=2&air=5&rent=9`
+
+    return values:
+      - "ok":         `True` (city found); `False` (errors found)
+      - "error":      error message
+      - "city":       id, city, state and city_code of the city
+      - "population": city population or `null`
+      - "coordinates": "lat" and "lon" of the city in degrees or `null`
+      - "crime", "walk", "air", "rent": per dimension
+        - raw value (`combined_scaled_rate`, `walk_score`,
+          `combined_total` or `avg_rent`)
+        - "score": `5` (best) to `1` (worst) score or `null`
+        - "error": error message or `null`
+      - "score":       `5.0` (best) to `1.0` (worst) weighted score or `null`
+      - "score_error": error message or `null`
+    """
+    # Define a response object
+    ret_dict            = {}
+    ret_dict["ok"]      = False
+    ret_dict["msg"]     = ""
+    ret_dict["error"]   = None
+
+    # Look up the passed city code
+    snap = snapshot.current()
+    row = snap.find(city)
+    if row == None:
+      ret_dict["error"] = f"city: {city} not found"
+      ret_dict["suggestions"] = snap.names.suggest(city)
+      raise HTTPException(status_code=404, detail=ret_dict)
+
+    city_rec = snap.cities[row]
+    ret_dict["city"] = {k: city_rec[k] for k in ("id", "city", "state", "city_code")}
+    ret_dict["population"] = snap.get_population(row)
+    coords = snap.get_coords(row)
+    ret_dict["coordinates"] = {"lat": coords[0], "lon": coords[1]} if coords != None else None
+
+    # Report every dimension, noting missing data per field
+    score_dict = {}
+    for dim in snapshot.DIMENSIONS:
+      score_dict[dim] = snap.get_score(row, dim)
+      ret_dict[dim] = {
+        PROFILE_METRICS[dim]: snap.get_metric(row, dim),
+        "score": score_dict[dim],
+        "error": None if score_dict[dim] != None else f"{dim} data for city: {city} not found",
+      }
+
+    # Calculate the weighted score when every dimension has a score
+    ret_dict["score"] = None
+    ret_dict["score_error"] = None
+    missing = [dim for dim in snapshot.DIMENSIONS if score_dict[dim] == None]
+    usr_weight_dict = {"crime": crime, "walk": walk, "air": air, "rent": rent}
+    if missing:
+      ret_dict["score_error"] = f"{', '.join(missing)} score for city: {city} not found"
+    elif sum(usr_weight_dict.values()) == 0:
+      ret_dict["score_error"] = "at least one weight must be greater than 0"
+    else:
+      # the /city_scr helper, so both endpoints give the same score
+      ret_dict["score"] = calc_wghtd_city_score(score_dict, usr_weight_dict)
+
+    # Return results
+    ret_dict["ok"]      = True
+    ret_dict["msg"]     = f"{city_rec['city_code']} city profile"
+    return ret_dict
+
+class ScoreWeights(BaseModel):
+    """
+    ScoreWeights is a user's weighting (0-10) of each livability dimension
+    """
+    crime: int = Field(5, ge=0, le=10)
+    walk:  int = Field(5, ge=0, le=10)
+    air:   int = Field(5, ge=0, le=10)
+    rent:  int = Field(5, ge=0, le=10)
+
+class CityScoreBatch(BaseModel):
+    """
+    CityScoreBatch is a request for the city scores of many cities
+    under one set of user weights
+    """
+    city_codes: List[str]
+    weights:    ScoreWeights = ScoreWeights()
+
+@router.post('/city_scr/batch')
+async def get_city_scr_batch(batch: CityScoreBatch):
+    """
+    get_city_scr_batch returns the overall city quality of life score
+    (1.0-5.0) of every passed city under one set of user weights; the
+    same score `/city_scr/<city>` returns for each city
+
+    request:
+      - POST `/city_scr/batch`
+      - JSON body
+        - city_codes: array of normalized city codes
+        - weights: object with integer 0-10 weights (default value = 5)
+          for crime, walk, air and rent
+
+    example:
+    ```
+    {
+      "city_codes": ["St_Louis", "New_York_City", "Houston"],
+      "weights": {"crime": 8, "walk": 4, "air": 4, "rent": 9}
+    }
+    ```
+
+    return values:
+      - "ok":     `True` (no errors found); `False` (errors found)
+      - "error":  error message
+      - "scores": array in request order of
+        - "city_code": the requested city code
+        - "ok":        `True` if the city was scored
+        - "error":     error message for the city
+        - "score":     `5.0` (best) to `1.0` (worst) score
+    """
+    # Define a response object
+    ret_dict            = {}
+    ret_dict["ok"]      = False
+    ret_dict["msg"]     = ""
+    ret_dict["error"]   = None
+    ret_dict["scores"]  = []
+
+    weights = batch.weights.dict()
+    if sum(weights.values()) == 0:
+      # error: a weighted average needs at least one non-zero weight
+      ret_dict["error"] = "at least one weight must be greater than 0"
+      raise HTTPException(status_code=400, detail=ret_dict)
+
+    # Look up every passed city code in one snapshot
+    snap = snapshot.current()
+    rows = [snap.find(city) for city in batch.city_codes]
+    found = [row for row in rows if row != None]
+
+    # Score every city with all component scores in one vectorized call
+    city_scores = snap.scores[found]
+    complete = (city_scores > 0).all(axis=1)
+    wght_scores = np.full(len(found), np.nan)
+    wght_scores[complete] = calc_wghtd_city_scores(city_scores[complete], weights)
+
+    found_iter = iter(zip(found, complete, wght_scores))
+    for city, row in zip(batch.city_codes, rows):
+      city_dict = {"city_code": city, "ok": False, "error": None, "score": None}
+      if row == None:
+        city_dict["error"] = f"quality of life score for city: {city} not found"
+        city_dict["suggestions"] = snap.names.suggest(city)
+      else:
+        _, is_complete, wght_score = next(found_iter)
+        if not is_complete:
+          missing = [dim for dim in snapshot.DIMENSIONS if snap.get_score(row, dim) == None]
+          city_dict["error"] = f"{', '.join(missing)} score for city: {city} not found"
+        else:
+          city_dict["ok"]    = True
+          city_dict["score"] = float(wght_score)
+      ret_dict["scores"].append(city_dict)
+
+    # Return results
+    ret_dict["ok"]      = True
+    ret_dict["msg"]     = f"quality of life scores for {len(batch.city_codes)} cities"
+    return ret_dict
+
+@router.get('/rankings')
+async def get_rankings(crime: int=Query(5, ge=0, le=10), walk: int=Query(5, ge=0, le=10),
+                       air: int=Query(5, ge=0, le=10), rent: int=Query(5, ge=0, le=10),
+                       limit: int=Query(10, ge=1, le=1000), state: str=None):
+    """
+    get_rankings returns the supported cities with the best overall
+    quality of life score (1.0-5.0) for the passed user weights
+
+    request:
+      - GET `/rankings`
+      - Querystring parameters
+        -  crime: integer 0-10 (default value = 5)
+        -  walk: integer 0-10 (default value = 5)
+        -  air: integer 0-10 (default value = 5)
+        -  rent: integer 0-10 (default value = 5)
+        -  limit: number of cities to return, 1-1000 (default value = 10)
+        -  state: optional two letter state code, e.g. `MO`
+
+    examples:
+      - GET `/rankings?crime=8&walk=4&air=4&rent=9`
+      - GET `/rankings?crime=2&walk=10&air=5&rent=5&limit=5&state=CA`
+
+    return values:
+      - "ok":     `True` (no errors found); `False` (errors found)
+      - "error":  error message
+      - "cities": array of the best cities, best first
+        - "rank", "id", "city", "state", "city_code"
+        - "score": `5.0` (best) to `1.0` (worst) score
+    """
+    # Define a response object
+    ret_dict            = {}
+    ret_dict["ok"]      = False
+    ret_dict["msg"]     = ""
+    ret_dict["error"]   = None
+    ret_dict["cities"]  = []
+
+    usr_weight_dict = {"crime": crime, "walk": walk, "air": air, "rent": rent}
+    if sum(usr_weight_dict.values()) == 0:
+      # error: a weighted average needs at least one non-zero weight
+      ret_dict["error"] = "at least one weight must be greater than 0"
+      raise HTTPException(status_code=400, detail=ret_dict)
+
+    if state != None:
+      state = state.upper()
+
+    # Rank every supported city, then round the scores like /city_scr
+    snap = snapshot.current()
+    rows, _ = snap.top_cities(usr_weight_dict, limit, state)
+    wght_scores = calc_wghtd_city_scores(snap.scores[rows], usr_weight_dict)
+
+    for rank, (row, wght_score) in enumerate(zip(rows, wght_scores), start=1):
+      city = snap.cities[row]
+      ret_dict["cities"].append({
+        "rank": rank,
+        "id": city["id"],
+        "city": city["city"],
+        "state": city["state"],
+        "city_code": city["city_code"],
+        "score": float(wght_score),
+      })
+
+    # Return results
+    ret_dict["ok"]      = True
+    ret_dict["msg"]     = "top cities" if state == None else f"top cities in {state}"
+    return ret_dict
+
+@router.get('/similar/{city}')
+async def get_similar_cities(city: str, k: int=Query(10, ge=1, le=100),
+                             crime: int=Query(5, ge=0, le=10), walk: int=Query(5, ge=0, le=10),
+                             air: int=Query(5, ge=0, le=10), rent: int=Query(5, ge=0, le=10),
+                             population: int=Query(5, ge=0, le=10)):
+    """
+    get_similar_cities returns the supported cities most like the passed
+    city in crime rate, walk score, air quality, rent and population
+    (see app/similarity.py), most similar first
+
+    request:
+      - GET `/similar/<normalized city code or city name>`
+      - Querystring parameters
+        -  k: number of cities to return, 1-100 (default value = 10)
+        -  crime: integer 0-10, weight of the crime rate (default value = 5)
+        -  walk: integer 0-10, weight of the walk score (default value = 5)
+        -  air: integer 0-10, weight of the air quality (default value = 5)
+        -  rent: integer 0-10, weight of the rent (default value = 5)
+        -  population: integer 0-10, weight of the population (default value = 5)
+
+    examples:
+      - GET `/similar/Denver`
+      - GET `/similar/St_Louis?k=5&rent=10&population=0`
+
+    return values:
+      - "ok":      `True` (no errors found); `False` (errors found)
+      - "error":   error message
+      - "city":    the city compared against ("id", "city", "state", "city_code")
+      - "similar": array of the most similar cities, most similar first
+        - "rank", "id", "city", "state", "city_code"
+        - "distance": `0.0` (identical) and up, in standard deviations
+    """
+    # Define a response object
+    ret_dict            = {}
+    ret_dict["ok"]      = False
+    ret_dict["msg"]     = ""
+    ret_dict["error"]   = None
+    ret_dict["city"]    = None
+    ret_dict["similar"] = []
+
+    usr_weight_dict = {"crime": crime, "walk": walk, "air": air, "rent": rent, "population": population}
+    if sum(usr_weight_dict.values()) == 0:
+      # error: a weighted distance needs at least one non-zero weight
+      ret_dict["error"] = "at least one weight must be greater than 0"
+      raise HTTPException(status_code=400, detail=ret_dict)
+
+    index = similarity.current()
+    if index == None:
+      ret_dict["error"] = "the city data is not loaded yet"
+      raise HTTPException(status_code=503, detail=ret_dict)
+
+    # Look the city up in the snapshot the index was built from
+    snap = index.snap
+    row = snap.find(city)
+    if row == None:
+      ret_dict["error"] = f"{city} not found"
+      ret_dict["suggestions"] = snap.names.suggest(city)
+      raise HTTPException(status_code=404, detail=ret_dict)
+
+    rows, distances = index.query(row, usr_weight_dict, k)
+
+    ret_dict["city"] = {key: snap.cities[row][key] for key in ("id", "city", "state", "city_code")}
+    for rank, (similar_row, distance) in enumerate(zip(rows.tolist(), np.round(distances, 4).tolist()), start=1):
+      similar_city = snap.cities[similar_row]
+      ret_dict["similar"].append({
+        "rank": rank,
+        "id": similar_city["id"],
+        "city": similar_city["city"],
+        "state": similar_city["state"],
+        "city_code": similar_city["city_code"],
+        "distance": distance,
+      })
+
+    # Return results
+    ret_dict["ok"]      = True
+    ret_dict["msg"]     = f"cities similar to {ret_dict['city']['city']}"
+    return ret_dict
+
 @router.get('/air_qual_scr/{city}')
 async def get_air_qual_scr(city: str):
     """
@@ -414,16 +1255,24 @@ async def get_air_qual_scr(city: str):
     if len(city) == 0:
       ret_dict['error']: 'missing city parameter'
 
-    # Generate the rent score
-    aq_score = gen_aq_score(db_conn, city)
+    # Look up the air quality score
+    snap = snapshot.current()
+    row = snap.find(city)
+    if row == None or snap.get_metric(row, "air") == None:
+      # no air quality data for the city
+      detail = {"score": None, "error": f"air quality score for city: {city} not found"}
+      detail["suggestions"] = snap.names.suggest(city) if row == None else []
+      raise HTTPException(status_code=404, detail=detail)
+
+    aq_score = snap.get_score(row, "air")
 
     # Any errors generating a score?
-    if aq_score["score"] == None:
-      ret_dict["error"] = aq_score["error"]
+    if aq_score == None:
+      ret_dict["error"] = "no score available"
       raise HTTPException(status_code=400, detail=ret_dict)    
     # Return results
     ret_dict["ok"]      = True
     ret_dict["error"]   = None
     ret_dict["msg"]     = f"{city} air quality score"
-    ret_dict["score"]   = aq_score['score']
+    ret_dict["score"]   = aq_score
     return ret_dict
@@ -0,0 +1,357 @@
+"""Background city score snapshot refresher
+
+Keeps the in-memory snapshot in step with the database without restarts:
+
+  - triggers on the cityspire_* tables NOTIFY the changed rows' city codes
+    on the `cityspire_changes` channel and stamp them with updated_at
+  - a background thread LISTENs on the channel and reloads only the changed
+    cities into a patched copy of the snapshot (see snapshot.refresh_cities)
+  - every SNAPSHOT_POLL_INTERVAL seconds it also looks for rows updated
+    since the last seen max(updated_at), catching changes whose
+    notification was lost; deletes are only seen through notifications,
+    so every (re)connect starts with a full reload unless the tables'
+    latest updated_at and row count are still those of the snapshot
+    being served (see snapshot.read_db_state)
+
+Install the triggers, and the city_code indexes the reloads rely on, once
+per database:
+    python -m app.refresher --install
+    python -m app.refresher --indexes     # the indexes only
+"""
+
+import argparse
+from datetime import datetime, timezone
+import logging
+import os
+import select
+import threading
+import time
+
+from dotenv import load_dotenv
+import psycopg2
+import psycopg2.errors
+
+from app import shared, snapshot
+from app.dbsession import DBSession
+
+log = logging.getLogger(__name__)
+
+CHANNEL = "cityspire_changes"
+
+# Tables feeding the snapshot; every one of them has a city_code column
+TABLES = snapshot.TABLES
+
+# Reload the whole snapshot instead when more than this share of it changed
+FULL_REFRESH_RATIO = 0.5
+
+TRIGGER_FUNCTIONS_SQL = f"""
+    CREATE OR REPLACE FUNCTION cityspire_touch() RETURNS trigger AS $$
+    BEGIN
+      NEW.updated_at := now();
+      RETURN NEW;
+    END $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION cityspire_notify() RETURNS trigger AS $$
+    BEGIN
+      -- identical notifications are sent once per transaction
+      IF TG_OP <> 'INSERT' THEN
+        PERFORM pg_notify('{CHANNEL}', coalesce(OLD.city_code, ''));
+      END IF;
+      IF TG_OP <> 'DELETE' THEN
+        PERFORM pg_notify('{CHANNEL}', coalesce(NEW.city_code, ''));
+      END IF;
+      RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+"""
+
+TABLE_TRIGGERS_SQL = """
+    ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+    CREATE INDEX IF NOT EXISTS {table}_updated_at_idx ON {table} (updated_at);
+
+    DROP TRIGGER IF EXISTS {table}_touch ON {table};
+    CREATE TRIGGER {table}_touch BEFORE INSERT OR UPDATE ON {table}
+      FOR EACH ROW EXECUTE PROCEDURE cityspire_touch();
+
+    DROP TRIGGER IF EXISTS {table}_notify ON {table};
+    CREATE TRIGGER {table}_notify AFTER INSERT OR UPDATE OR DELETE ON {table}
+      FOR EACH ROW EXECUTE PROCEDURE cityspire_notify();
+"""
+
+# Latest updated_at over every table; each max is an index lookup
+WATERMARK_SQL = "SELECT max(updated_at) FROM ({tables}) m".format(
+    tables=" UNION ALL ".join(f"SELECT max(updated_at) AS updated_at FROM {t}" for t in TABLES))
+
+# City codes of the rows updated after %(since)s
+CHANGED_SINCE_SQL = " UNION ALL ".join(
+    f"SELECT city_code, updated_at FROM {t} WHERE updated_at > %(since)s" for t in TABLES)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def install(db_conn):
+    """
+    install adds the updated_at columns, indexes and change triggers
+    the refresher relies on, and the city_code indexes (see
+    snapshot.install_indexes); safe to run more than once
+    """
+    cursor = db_conn.cursor()
+    try:
+        cursor.execute(TRIGGER_FUNCTIONS_SQL)
+        for table in TABLES:
+            cursor.execute(TABLE_TRIGGERS_SQL.format(table=table))
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    snapshot.install_indexes(db_conn)
+
+
+class SnapshotRefresher:
+    """
+    SnapshotRefresher runs a daemon thread that applies database changes
+    to the snapshot being served, using one dedicated connection
+
+      - poll_interval: seconds between updated_at watermark checks
+      - debounce:      seconds to wait after a notification for more of
+                       the same burst, so a bulk load is applied at once
+      - backoff:       seconds to wait before reconnecting after a failure,
+                       doubled after every failure in a row
+      - max_backoff:   the most seconds to wait before reconnecting
+    """
+
+    def __init__(self, db_sess, poll_interval=30.0, debounce=0.2, backoff=1.0, max_backoff=60.0):
+        self.db_sess       = db_sess
+        self.poll_interval = poll_interval
+        self.debounce      = debounce
+        self.backoff       = backoff
+        self.max_backoff   = max_backoff
+        self.delay         = backoff   # seconds until the next reconnect
+        self.watermark     = None      # latest updated_at applied; None until known
+        self.polling       = True      # False when the tables lack updated_at
+        self.stopped       = threading.Event()
+        self.thread        = None
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name="snapshot-refresher", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5.0):
+        self.stopped.set()
+        if self.thread != None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def _run(self):
+        self.delay = self.backoff
+        while not self.stopped.is_set():
+            try:
+                conn = self.db_sess.getconn()
+            except (Exception, psycopg2.Error) as error:
+                log.error("snapshot refresher cannot connect to the database: {err}; retrying in {d:g}s".format(
+                    err=error, d=self.delay))
+                self._wait_to_reconnect()
+                continue
+
+            try:
+                self._listen(conn)
+            except (Exception, psycopg2.Error) as error:
+                log.error("snapshot refresher lost its database connection: {err}; reconnecting in {d:g}s".format(
+                    err=error, d=self.delay))
+                conn.close()
+            finally:
+                self.db_sess.putconn(conn)
+            self._wait_to_reconnect()
+
+    def _wait_to_reconnect(self):
+        """
+        _wait_to_reconnect waits out the current delay, or until stopped,
+        and doubles the delay for the next failure, up to max_backoff
+        """
+        self.stopped.wait(self.delay)
+        self.delay = min(self.delay * 2, self.max_backoff)
+
+    def _listen(self, conn):
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute(f"LISTEN {CHANNEL}")
+        cursor.close()
+
+        # changes may have been missed while not listening
+        self._catch_up(conn)
+        # connected and caught up: the next failure starts a new backoff
+        self.delay = self.backoff
+
+        next_poll = time.monotonic() + self.poll_interval
+        while not self.stopped.is_set():
+            timeout = max(0.0, min(next_poll - time.monotonic(), 1.0))
+            if select.select([conn], [], [], timeout) != ([], [], []):
+                conn.poll()
+                time.sleep(self.debounce)
+                conn.poll()
+                codes = set(n.payload for n in conn.notifies)
+                conn.notifies.clear()
+                if codes:
+                    self._apply(conn, None if "" in codes else codes)
+            elif time.monotonic() >= next_poll:
+                next_poll = time.monotonic() + self.poll_interval
+                if self.polling:
+                    codes = self._changed_since(conn)
+                    if codes:
+                        log.info("found {n} changed city codes without a notification".format(n=len(codes)))
+                        self._apply(conn, codes)
+
+    def _catch_up(self, conn):
+        """
+        _catch_up reloads the whole snapshot unless the one being served
+        was loaded from the tables as they are now, e.g. by the warm-up
+        load the refresher waits for on startup
+        """
+        # wait out a load already in progress instead of loading twice
+        deadline = time.monotonic() + self.poll_interval
+        while not snapshot.ready() and not self.stopped.is_set() and time.monotonic() < deadline:
+            snapshot.wait_ready(0.5)
+
+        loaded = snapshot.current().db_state if snapshot.ready() else None
+        if loaded != None:
+            cursor = conn.cursor()
+            try:
+                db_state = snapshot.read_db_state(cursor)
+            finally:
+                cursor.close()
+            if db_state == loaded:
+                self.watermark = db_state[0]
+                self.polling = True
+                log.info("snapshot {ver} is up to date; skipping the reload".format(ver=snapshot.current().version))
+                return
+        self._apply(conn, None)
+
+    def _read_watermark(self, conn):
+        """
+        _read_watermark returns the latest updated_at over every table or
+        None, turning polling off if the triggers are not installed
+        """
+        cursor = conn.cursor()
+        try:
+            cursor.execute(WATERMARK_SQL)
+            self.polling = True
+            return cursor.fetchone()[0]
+        except psycopg2.errors.UndefinedColumn:
+            log.warning("cityspire_* tables have no updated_at column; run `python -m app.refresher --install`")
+            self.polling = False
+            return None
+        finally:
+            cursor.close()
+
+    def _changed_since(self, conn):
+        """
+        _changed_since returns the city codes of rows updated after the
+        watermark and advances the watermark past them
+        """
+        cursor = conn.cursor()
+        try:
+            cursor.execute(CHANGED_SINCE_SQL, {"since": self.watermark or EPOCH})
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+
+        if rows:
+            self.watermark = max(updated_at for _, updated_at in rows)
+        return set(code for code, _ in rows if code != None)
+
+    def _apply(self, conn, codes):
+        """
+        _apply reloads the passed city codes into the snapshot, along with
+        any other rows updated since the watermark, or the whole snapshot
+        if codes is None or covers most of it
+        """
+        if codes == None:
+            self.watermark = self._read_watermark(conn)
+        elif self.polling:
+            codes = codes | self._changed_since(conn)
+
+        if codes == None or len(codes) > FULL_REFRESH_RATIO * max(len(snapshot.current()), 1):
+            attempt = snapshot.refresh(conn)
+        else:
+            attempt = snapshot.refresh_cities(conn, codes)
+        if attempt["error"] != None:
+            raise RuntimeError(attempt["error"])
+
+
+# The refresher of this worker process, started on application startup
+_refresher = None
+
+
+def start():
+    """
+    start runs the snapshot refresher in the background
+
+    Uses these environment variables if they exist:
+      - SNAPSHOT_REFRESH:        "false" disables the refresher (default "true")
+      - SNAPSHOT_POLL_INTERVAL:  seconds between watermark checks (default 30)
+      - SNAPSHOT_MAX_BACKOFF:    the most seconds to wait between reconnects
+                                 (default 60)
+    """
+    global _refresher
+    load_dotenv()
+    if os.getenv("SNAPSHOT_REFRESH", "true").lower() not in ("1", "true", "yes") or not os.getenv("DATABASE_URL"):
+        return
+    if os.getenv("SNAPSHOT_FILE"):
+        # serving a snapshot file without the database
+        return
+    if _refresher != None or shared.following():
+        # already running, or the leader worker refreshes the shared snapshot
+        return
+
+    _refresher = SnapshotRefresher(
+        DBSession(minconn=0, maxconn=1),
+        poll_interval=float(os.getenv("SNAPSHOT_POLL_INTERVAL", 30)),
+        max_backoff=float(os.getenv("SNAPSHOT_MAX_BACKOFF", 60)),
+    )
+    _refresher.start()
+
+
+# A follower promoted to leader takes over refreshing the shared snapshot
+shared.ON_LEAD.append(start)
+
+
+def stop():
+    """
+    stop stops the snapshot refresher
+    """
+    global _refresher
+    if _refresher != None:
+        _refresher.stop()
+        _refresher = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--install", action="store_true", help="install the change triggers and indexes")
+    parser.add_argument("--indexes", action="store_true", help="only create the city_code indexes")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if not args.install and not args.indexes:
+        parser.print_help()
+        return
+
+    db_sess = DBSession(minconn=1, maxconn=1)
+    db_conn_attempt = db_sess.connect()
+    if db_conn_attempt["error"] != None:
+        raise SystemExit("ERROR: error attempting to connect to the database: {err_str}".format(err_str=db_conn_attempt["error"]))
+    with db_sess.connection() as db_conn:
+        if args.install:
+            install(db_conn)
+        else:
+            snapshot.install_indexes(db_conn)
+    db_sess.close_connection()
+    if args.install:
+        log.info("installed the change triggers on {tables}".format(tables=", ".join(TABLES)))
+    log.info("created the city_code indexes on {tables}".format(tables=", ".join(snapshot.CITY_CODE_INDEXES)))
+
+
+if __name__ == "__main__":
+    main()
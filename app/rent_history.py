@@ -0,0 +1,178 @@
+"""In-memory monthly rent time series"""
+
+import logging
+import threading
+
+import numpy as np
+import psycopg2
+import psycopg2.errors
+
+from app import metrics
+
+log = logging.getLogger(__name__)
+
+# Every city's monthly rents, loaded by app.ingest.rent
+HISTORY_SQL = "SELECT city_code, month, rent FROM cityspire_rent_history"
+
+# Months a year-over-year change looks back
+YOY_MONTHS = 12
+
+
+def month_number(year, month):
+    """
+    month_number returns the number of months since January of year 0
+    """
+    return year * 12 + month - 1
+
+
+def month_label(number):
+    """
+    month_label returns the YYYY-MM label of a month_number
+    """
+    return "{y:04d}-{m:02d}".format(y=number // 12, m=number % 12 + 1)
+
+
+def parse_month(text):
+    """
+    parse_month returns the month_number of a YYYY-MM (or YYYY-MM-DD)
+    string, or None if it is not one
+    """
+    try:
+        year, month = int(text[0:4]), int(text[5:7])
+    except (TypeError, ValueError):
+        return None
+    if len(text) < 7 or text[4] != "-" or not 1 <= month <= 12:
+        return None
+    return month_number(year, month)
+
+
+class RentHistory:
+    """
+    RentHistory is an immutable store of every city's monthly rents on
+    one shared month axis
+
+      - first:  month_number of the first column
+      - rents:  float32 (n, m), one contiguous row per city, NaN where
+                there is no rent for the month
+      - yoy:    float32 (n, m), change from the same month a year earlier
+                (0.05 = +5%), NaN where either month has no rent
+      - labels: YYYY-MM label of every column
+      - index:  city_code -> row
+
+    A city's series for a month range is a slice of its rows, so lookups
+    never scan
+    """
+
+    def __init__(self, codes, first, rents):
+        self.index  = {code: row for row, code in enumerate(codes)}
+        self.first  = first
+        self.rents  = rents
+        self.labels = [month_label(first + i) for i in range(rents.shape[1])]
+        self.yoy    = np.full(rents.shape, np.nan, dtype=np.float32)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.yoy[:, YOY_MONTHS:] = rents[:, YOY_MONTHS:] / rents[:, :-YOY_MONTHS] - 1
+        self.rents.setflags(write=False)
+        self.yoy.setflags(write=False)
+
+    def __len__(self):
+        return len(self.index)
+
+    def series(self, city_code, start=None, end=None):
+        """
+        series returns the YYYY-MM labels, rents and year-over-year changes
+        of a city's months from month_number start to end (inclusive;
+        default: all), trimmed to the months with a rent, or None if the
+        city has no rents in that range
+        """
+        row = self.index.get(city_code)
+        if row == None:
+            return None
+        # clamp to the stored months; a range ending before the first
+        # (or starting after the last) is empty, not sliced from the back
+        m = self.rents.shape[1]
+        lo = 0 if start == None else min(max(start - self.first, 0), m)
+        hi = m if end == None else max(min(end - self.first + 1, m), 0)
+
+        rents = self.rents[row, lo:hi]
+        known = np.flatnonzero(~np.isnan(rents))
+        if len(known) == 0:
+            return None
+        lo, hi = lo + known[0], lo + known[-1] + 1
+        return self.labels[lo:hi], self.rents[row, lo:hi], self.yoy[row, lo:hi]
+
+
+def build_history(rows):
+    """
+    build_history builds a RentHistory from HISTORY_SQL shaped rows
+    """
+    if not rows:
+        return RentHistory([], 0, np.empty((0, 0), dtype=np.float32))
+
+    codes, city_rows = np.unique(np.array([r[0] for r in rows], dtype=object), return_inverse=True)
+    months = np.array([month_number(r[1].year, r[1].month) for r in rows], dtype=np.int64)
+    first = int(months.min())
+
+    rents = np.full((len(codes), int(months.max()) - first + 1), np.nan, dtype=np.float32)
+    rents[city_rows, months - first] = np.array([r[2] for r in rows], dtype=np.float32)
+    return RentHistory(codes.tolist(), first, rents)
+
+
+def load_history(db_conn):
+    """
+    load_history fetches every city's monthly rents and returns a new
+    RentHistory; an empty one if app.ingest.rent has not created the
+    table yet
+    """
+    cursor = db_conn.cursor()
+    try:
+        with metrics.timer(metrics.QUERY_SECONDS, "rent_history"):
+            cursor.execute(HISTORY_SQL)
+            rows = cursor.fetchall()
+    except psycopg2.errors.UndefinedTable:
+        db_conn.rollback()
+        log.warning("cityspire_rent_history does not exist; run `python -m app.ingest.rent` to load it")
+        rows = []
+    finally:
+        cursor.close()
+    return build_history(rows)
+
+
+# The rent history currently being served; replaced as a whole, never mutated
+_current = build_history([])
+_refresh_lock = threading.Lock()
+
+
+def current():
+    """
+    current returns the rent history currently being served
+    """
+    return _current
+
+
+def refresh(db_conn):
+    """
+    refresh loads a new rent history from the database and swaps it in
+
+    Returns a dictionary
+      - "error": None if no error has occurred or an error message
+      - "value": the new RentHistory or None if an error has occurred
+    """
+    global _current
+    ret_dict = {"error": None, "value": None}
+
+    with _refresh_lock:
+        try:
+            history = load_history(db_conn)
+        except (Exception, psycopg2.Error) as error:
+            try:
+                db_conn.rollback()
+            except psycopg2.Error:
+                pass
+            log.error("error loading the rent history: {err}".format(err=error))
+            ret_dict["error"] = "error loading the rent history: " + str(error)
+            return ret_dict
+        _current = history
+
+    ret_dict["value"] = history
+    log.info("loaded the rent history of {n} cities".format(n=len(history)))
+    return ret_dict
@@ -0,0 +1,346 @@
+"""Livability score engine"""
+
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+import itertools
+import logging
+import os
+import threading
+
+import numpy as np
+
+from app import metrics
+
+log = logging.getLogger(__name__)
+
+# Livability dimensions in column order of metric and score arrays
+DIMENSIONS = ("crime", "walk", "air", "rent")
+
+# Quantiles splitting a dimension's values into five equally sized buckets
+QUANTILES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+# Quantile edges of all cities' "Dec Avg Rent" and "Combined Total" values
+# from the original notebook run; used until edges are loaded from the data
+NOTEBOOK_RENT_EDGES = (742., 1203.6, 1364., 1535.6, 1721.2, 2993.)
+NOTEBOOK_AQ_EDGES   = (7.08867508, 10.12566503, 10.89508254, 11.95768491, 12.90177913,
+                       16.86715543)
+
+# Compute the quantile edges of the rent and air quality tables in one query;
+# percentile_cont interpolates linearly like numpy.quantile
+QUANTILE_SQL = """
+    SELECT
+      (SELECT percentile_cont(%(q)s::float8[]) WITHIN GROUP (ORDER BY "Dec Avg Rent")
+       FROM cityspire_rent WHERE "Dec Avg Rent" IS NOT NULL),
+      (SELECT percentile_cont(%(q)s::float8[]) WITHIN GROUP (ORDER BY "Combined Total")
+       FROM cityspire_air_quality WHERE "Combined Total" <> 0)
+"""
+
+
+class Bucketing:
+    """
+    Bucketing translates raw metric values to 1-5 scores using four
+    ascending cutoffs between the five score buckets
+
+      - higher_is_better: True if the highest values earn a 5
+      - upper_inclusive:  True if a value equal to a cutoff falls into the
+                          bucket above it (`>=` cutoffs), False if it falls
+                          into the bucket below it (`<=` cutoffs)
+
+    Values beyond the outer cutoffs fall into the outermost buckets
+    """
+
+    def __init__(self, cutoffs, higher_is_better, upper_inclusive):
+        self.cutoffs          = tuple(float(c) for c in cutoffs)
+        self.higher_is_better = higher_is_better
+        self.upper_inclusive  = upper_inclusive
+        self._np_cutoffs      = np.array(self.cutoffs, dtype=np.float64)
+        self._side            = "right" if upper_inclusive else "left"
+        self._bisect          = bisect_right if upper_inclusive else bisect_left
+
+    def _to_score(self, bucket):
+        return 1 + bucket if self.higher_is_better else 5 - bucket
+
+    def score_one(self, value):
+        """
+        score_one returns the 1-5 score of a single value or None
+        """
+        if value == None:
+            return None
+        return self._to_score(self._bisect(self.cutoffs, float(value)))
+
+    def score(self, values):
+        """
+        score returns an int8 array of the 1-5 scores of an array of
+        values; NaN values score 0
+        """
+        values = np.asarray(values, dtype=np.float64)
+        scores = self._to_score(np.searchsorted(self._np_cutoffs, values, side=self._side)).astype(np.int8)
+        scores[np.isnan(values)] = 0
+        return scores
+
+
+def quantile_bucketing(edges):
+    """
+    quantile_bucketing builds a lowest-is-best Bucketing from the six
+    quantile edges (min, 20%, 40%, 60%, 80%, max) of a dimension's values
+    """
+    return Bucketing(edges[1:-1], higher_is_better=False, upper_inclusive=False)
+
+
+class ScoreEngine:
+    """
+    ScoreEngine holds the Bucketing of every livability dimension
+
+      - crime: fixed cutoffs of the 0.0-1.0 scaled crime rate; lowest is best
+      - walk:  fixed cutoffs of the 0-100 walk score; highest is best
+      - air:   quantile cutoffs of all cities' combined air quality totals
+      - rent:  quantile cutoffs of all cities' average rents
+
+    quantile_edges keeps the full quantile edges the air and rent
+    cutoffs were taken from
+    """
+
+    def __init__(self, rent_edges=NOTEBOOK_RENT_EDGES, aq_edges=NOTEBOOK_AQ_EDGES):
+        self.quantile_edges = {
+            "air":  tuple(float(e) for e in aq_edges),
+            "rent": tuple(float(e) for e in rent_edges),
+        }
+        self.buckets = {
+            "crime": Bucketing((0.20, 0.40, 0.60, 0.80), higher_is_better=False, upper_inclusive=True),
+            "walk":  Bucketing((20, 40, 60, 80), higher_is_better=True, upper_inclusive=True),
+            "air":   quantile_bucketing(aq_edges),
+            "rent":  quantile_bucketing(rent_edges),
+        }
+
+    def score_one(self, dim, value):
+        """
+        score_one returns the 1-5 score of a single value of a dimension or None
+        """
+        return self.buckets[dim].score_one(value)
+
+    def score(self, metrics):
+        """
+        score returns the int8 (n, 4) scores of a float (n, 4) array of raw
+        metric values in DIMENSIONS order; NaN values score 0
+        """
+        metrics = np.asarray(metrics, dtype=np.float64).reshape(-1, len(DIMENSIONS))
+        return np.column_stack([
+            self.buckets[dim].score(metrics[:, j]) for j, dim in enumerate(DIMENSIONS)
+        ]).astype(np.int8).reshape(-1, len(DIMENSIONS))
+
+
+def load_engine(db_conn):
+    """
+    load_engine computes the rent and air quality quantile edges from the
+    database and returns a new ScoreEngine; a dimension without any data
+    keeps the notebook edges
+    """
+    cursor = db_conn.cursor()
+    try:
+        with metrics.timer(metrics.QUERY_SECONDS, "quantile_edges"):
+            cursor.execute(QUANTILE_SQL, {"q": list(QUANTILES)})
+            rent_edges, aq_edges = cursor.fetchone()
+    finally:
+        cursor.close()
+
+    if rent_edges == None:
+        log.error("no rent data found; using the notebook rent quantile edges")
+        rent_edges = NOTEBOOK_RENT_EDGES
+    if aq_edges == None:
+        log.error("no air quality data found; using the notebook air quality quantile edges")
+        aq_edges = NOTEBOOK_AQ_EDGES
+
+    return ScoreEngine(rent_edges, aq_edges)
+
+
+# /city_scr weights are integers 0-10 per dimension and scores integers 1-5,
+# so a weighted score is fully determined by one of 11^4 weight vectors and
+# one of 5^4 score profiles
+WEIGHT_LEVELS = 11
+N_WEIGHTS     = WEIGHT_LEVELS ** len(DIMENSIONS)
+N_PROFILES    = 5 ** len(DIMENSIONS)
+
+# The 1-5 scores of every profile, in DIMENSIONS order
+PROFILE_SCORES = np.array(list(itertools.product(range(1, 6), repeat=len(DIMENSIONS))), dtype=np.int16)
+PROFILE_SCORES.setflags(write=False)
+
+
+def _weighted_tenths():
+    # Weighted averages are num / den with integer num <= 200 and den <= 40;
+    # tenths of round(clip(num / den, 1, 5), 1), the Python rounding of
+    # calc_wghtd_city_score; den 0 (all weights 0) stays 0
+    tenths = np.zeros((5 * (WEIGHT_LEVELS - 1) * len(DIMENSIONS) + 1, (WEIGHT_LEVELS - 1) * len(DIMENSIONS) + 1), dtype=np.uint8)
+    for num in range(tenths.shape[0]):
+        for den in range(1, tenths.shape[1]):
+            tenths[num, den] = round(round(min(max(num / den, 1.0), 5.0), 1) * 10)
+    tenths.setflags(write=False)
+    return tenths
+
+
+WEIGHTED_TENTHS = _weighted_tenths()
+
+
+def weighted_scores(scores, weights):
+    """
+    weighted_scores returns the float64 (n,) weighted scores of an (n, 4)
+    array of 1-5 scores under a weights dict, rounded exactly like
+    calc_wghtd_city_score rounds one city's (Python round, not numpy's
+    round half to even); the weights must not all be 0
+
+    Integer 0-10 weights are looked up in WEIGHTED_TENTHS; other weights
+    are rounded one city at a time
+    """
+    scores = np.asarray(scores).reshape(-1, len(DIMENSIONS))
+    wght_vec = np.array([weights[dim] for dim in DIMENSIONS], dtype=np.float64)
+    if weight_index(weights) != None:
+        wght_int = wght_vec.astype(np.int64)
+        return WEIGHTED_TENTHS[scores.astype(np.int64) @ wght_int, wght_int.sum()] / 10
+
+    wgt_avg = np.clip(scores.astype(np.float64) @ wght_vec / wght_vec.sum(), 1.0, 5.0)
+    return np.array([round(val, 1) for val in wgt_avg.tolist()], dtype=np.float64)
+
+
+def profile_index(scores):
+    """
+    profile_index returns the int16 score profile (0 to N_PROFILES - 1) of
+    every row of an int8 (n, 4) score array; -1 where a score is missing
+    """
+    scores = np.asarray(scores, dtype=np.int16).reshape(-1, len(DIMENSIONS))
+    profiles = np.zeros(len(scores), dtype=np.int16)
+    for j in range(len(DIMENSIONS)):
+        profiles = profiles * 5 + (scores[:, j] - 1)
+    profiles[(scores == 0).any(axis=1)] = -1
+    return profiles
+
+
+def weight_index(weights):
+    """
+    weight_index returns the index (0 to N_WEIGHTS - 1) of a weights dict,
+    or None if a weight is not an integer from 0 to 10
+    """
+    index = 0
+    for dim in DIMENSIONS:
+        w = weights[dim]
+        if type(w) is not int or not 0 <= w < WEIGHT_LEVELS:
+            return None
+        index = index * WEIGHT_LEVELS + w
+    return index
+
+
+class WeightGrid:
+    """
+    WeightGrid serves the rounded weighted score of a score profile under
+    a weight vector as one array lookup; values are uint8 tenths
+    (10-50) and equal calc_wghtd_city_score's results exactly
+
+      - full: materializes every profile under every weight vector,
+              N_PROFILES x N_WEIGHTS bytes (9.2 MB) however many cities
+              there are; built on first use
+      - lru:  memoizes the N_PROFILES byte column of each weight vector
+              actually requested, keeping the lru_size most recent
+
+    Every result comes from WEIGHTED_TENTHS, so it matches the float
+    arithmetic of calc_wghtd_city_score
+    """
+
+    def __init__(self, mode="full", lru_size=4096):
+        self.mode     = mode
+        self.lru_size = lru_size
+        self.lock     = threading.Lock()
+        self.grid     = None
+        self.columns  = OrderedDict()    # weight index -> uint8 (N_PROFILES,)
+
+        self.profile_scores = PROFILE_SCORES
+        self.tenths = WEIGHTED_TENTHS
+
+    def _column(self, weights):
+        weights = np.array([weights[dim] for dim in DIMENSIONS], dtype=np.int16)
+        return self.tenths[self.profile_scores @ weights, weights.sum()]
+
+    def _build(self):
+        weights = np.array(list(itertools.product(range(WEIGHT_LEVELS), repeat=len(DIMENSIONS))), dtype=np.int16)
+        grid = self.tenths[self.profile_scores @ weights.T, weights.sum(axis=1)]
+        log.info("built the weight grid: {mb:.1f} MB".format(mb=grid.nbytes / 1e6))
+        return grid
+
+    def warm(self):
+        """
+        warm builds the full grid ahead of the first lookup
+        """
+        if self.mode == "full" and self.grid is None:
+            with self.lock:
+                if self.grid is None:
+                    self.grid = self._build()
+
+    def lookup(self, profile, weights):
+        """
+        lookup returns the weighted score of a score profile under a
+        weights dict, or None if the grid cannot answer (missing scores,
+        weights outside 0-10 or all weights 0)
+        """
+        widx = weight_index(weights)
+        if widx == None or profile < 0:
+            return None
+
+        if self.mode == "full":
+            self.warm()
+            tenths = self.grid[profile, widx]
+        else:
+            with self.lock:
+                column = self.columns.get(widx)
+                if column is not None:
+                    self.columns.move_to_end(widx)
+            if column is None:
+                column = self._column(weights)
+                with self.lock:
+                    self.columns[widx] = column
+                    while len(self.columns) > self.lru_size:
+                        self.columns.popitem(last=False)
+            tenths = column[profile]
+
+        return None if tenths == 0 else int(tenths) / 10
+
+    def nbytes(self):
+        """
+        nbytes returns the memory held by the grid's lookup tables
+        """
+        with self.lock:
+            held = self.grid.nbytes if self.grid is not None else sum(c.nbytes for c in self.columns.values())
+        return held + self.tenths.nbytes
+
+
+def weight_grid_from_env():
+    """
+    weight_grid_from_env returns the WeightGrid configured by these
+    environment variables, or None when disabled
+      - WEIGHT_GRID:          off (default), full or lru
+      - WEIGHT_GRID_LRU_SIZE: weight vectors kept in lru mode (default 4096,
+                              N_PROFILES = 625 bytes each)
+    """
+    mode = os.getenv("WEIGHT_GRID", "off").lower()
+    if mode not in ("full", "lru"):
+        return None
+    return WeightGrid(mode, int(os.getenv("WEIGHT_GRID_LRU_SIZE", 4096)))
+
+
+weight_grid = weight_grid_from_env()
+
+
+# The engine currently in use; replaced as a whole alongside the snapshot
+_current = ScoreEngine()
+
+
+def current():
+    """
+    current returns the score engine currently in use
+    """
+    return _current
+
+
+def swap(engine):
+    """
+    swap replaces the score engine currently in use
+    """
+    global _current
+    _current = engine
+    return engine
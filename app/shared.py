@@ -0,0 +1,241 @@
+"""Snapshot store shared by the worker processes of one host
+
+With SNAPSHOT_SHARED_DIR set, the workers of `uvicorn --workers N` (or
+gunicorn) serve one snapshot instead of loading and refreshing N:
+
+  - the worker holding an exclusive flock on `leader.lock` is the leader;
+    it alone loads the snapshot from the database, runs the refresher and
+    publishes every snapshot it swaps in as a generation file
+  - the other workers (followers) memory-map the latest generation file
+    and serve its arrays zero-copy from the page cache; they check the
+    generation counter every SNAPSHOT_SHARED_POLL seconds and remap
+    when it has moved on
+  - if the leader exits, its lock is released and the next follower to
+    take it becomes the leader
+
+Only the snapshot's arrays are shared: every follower still builds its
+own name index (CityIndex) and city dicts from the file's city table, and
+these take most of a follower's memory (see scripts/README.md).
+
+Generation files are snapshot files (see app.snapshot_file) named
+`snapshot-<generation>.bin`; the `generation` file holding the latest
+generation is replaced only after its snapshot file is in place, so
+readers never see a partial file.
+"""
+
+import fcntl
+import logging
+import os
+import threading
+
+from dotenv import load_dotenv
+
+from app import metrics, snapshot
+from app.snapshot_file import read_snapshot, write_snapshot
+
+log = logging.getLogger(__name__)
+
+# Generation files kept besides the current one, for followers still mapping them
+KEEP_GENERATIONS = 2
+
+# Callables run when this worker becomes the leader, e.g. refresher.start
+ON_LEAD = []
+
+
+class SharedStore:
+    """
+    SharedStore publishes and attaches the snapshots of one directory
+
+      - directory: where leader.lock, generation and the snapshot-<n>.bin
+                   generation files live
+      - poll:      seconds between generation checks (and leadership
+                   attempts) of a follower
+    """
+
+    def __init__(self, directory, poll=1.0):
+        self.directory  = directory
+        self.poll       = poll
+        self.leader     = False
+        self.generation = 0        # generation published or attached by this worker
+        self.lock_file  = None
+        self.stopped    = threading.Event()
+        self.thread     = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def latest(self):
+        """
+        latest returns the generation last published, 0 if none
+        """
+        try:
+            with open(self._path("generation")) as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def try_lead(self):
+        """
+        try_lead takes the leader lock if no other worker holds it and
+        returns whether this worker is the leader
+        """
+        if self.leader:
+            return True
+        if self.lock_file == None:
+            self.lock_file = open(self._path("leader.lock"), "a")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        self.leader = True
+        return True
+
+    def publish(self, snap):
+        """
+        publish writes snap as the next generation; leader only
+        """
+        if not self.leader:
+            return
+        generation = max(self.latest(), self.generation) + 1
+        write_snapshot(self._path(f"snapshot-{generation}.bin"), snap, generation)
+
+        tmp = self._path("generation.tmp")
+        with open(tmp, "w") as f:
+            f.write(str(generation))
+        os.replace(tmp, self._path("generation"))
+        self.generation = generation
+
+        # followers keep the pages of a removed file they still map
+        for name in os.listdir(self.directory):
+            if name.startswith("snapshot-") and name.endswith(".bin"):
+                old = int(name[len("snapshot-"):-len(".bin")])
+                if old < generation - KEEP_GENERATIONS:
+                    os.remove(self._path(name))
+        log.info("published snapshot {ver} as generation {gen}".format(ver=snap.version, gen=generation))
+
+    def attach(self):
+        """
+        attach swaps in the latest published generation if it is newer
+        than the one being served; returns whether it did
+        """
+        generation = self.latest()
+        if generation <= self.generation:
+            return False
+        try:
+            generation, snap = read_snapshot(self._path(f"snapshot-{generation}.bin"))
+        except (OSError, ValueError) as error:
+            log.error("error attaching snapshot generation {gen}: {err}".format(gen=generation, err=error))
+            return False
+        self.generation = generation
+        snapshot.swap(snap)
+        log.info("attached snapshot {ver}, generation {gen}".format(ver=snap.version, gen=generation))
+        return True
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if not self.try_lead():
+            self.attach()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name="shared-snapshot", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5.0):
+        self.stopped.set()
+        if self.thread != None:
+            self.thread.join(timeout)
+            self.thread = None
+        if self.lock_file != None:
+            self.lock_file.close()
+            self.lock_file = None
+            self.leader = False
+
+    def _run(self):
+        while not self.stopped.wait(self.poll):
+            if self.leader:
+                continue
+            try:
+                self.attach()
+                if self.try_lead():
+                    log.info("became the snapshot leader")
+                    for lead in ON_LEAD:
+                        lead()
+            except Exception as error:
+                log.error("shared snapshot watcher error: {err}".format(err=error))
+
+
+def store_from_env():
+    """
+    store_from_env returns the SharedStore configured by these environment
+    variables, or None when the snapshot is not shared
+      - SNAPSHOT_SHARED_DIR:  directory of the shared snapshot (default unset,
+                              every worker loads its own); must be local to
+                              the host, e.g. /dev/shm/cityspire
+      - SNAPSHOT_SHARED_POLL: seconds between follower generation checks (default 1)
+    """
+    load_dotenv()
+    directory = os.getenv("SNAPSHOT_SHARED_DIR")
+    if not directory or os.getenv("SNAPSHOT_FILE"):
+        # every worker maps a SNAPSHOT_FILE itself
+        return None
+    return SharedStore(directory, float(os.getenv("SNAPSHOT_SHARED_POLL", 1.0)))
+
+
+# The store of this worker process, started on application startup
+_store = None
+
+
+def _publish(snap):
+    if _store == None:
+        return
+    try:
+        _store.publish(snap)
+    except OSError as error:
+        # this worker keeps serving the snapshot; followers keep the previous one
+        log.error("error publishing the shared snapshot: {err}".format(err=error))
+
+
+snapshot.SWAP_HOOKS.append(_publish)
+
+
+def following():
+    """
+    following returns True if another worker loads and refreshes the
+    snapshot for this one
+    """
+    return _store != None and not _store.leader
+
+
+def shared_metrics():
+    """
+    shared_metrics returns this worker's shared snapshot generation and
+    role as /metrics gauges
+    """
+    if _store == None:
+        return []
+    return (metrics.counter("cityspire_snapshot_generation", "Shared snapshot generation served by this worker.", _store.generation, "gauge")
+            + metrics.counter("cityspire_snapshot_leader", "1 if this worker loads and publishes the shared snapshot.", int(_store.leader), "gauge"))
+
+
+metrics.COLLECTORS.append(shared_metrics)
+
+
+def startup():
+    """
+    startup elects the snapshot leader and, on followers, attaches the
+    latest published snapshot; register it before the other startup
+    handlers so they know this worker's role
+    """
+    global _store
+    _store = store_from_env()
+    if _store != None:
+        _store.start()
+
+
+def shutdown():
+    """
+    shutdown stops watching the shared snapshot and releases leadership
+    """
+    global _store
+    if _store != None:
+        _store.stop()
+        _store = None
@@ -0,0 +1,276 @@
+"""City similarity search
+
+Answers "which cities are most like this one?" from a standardized city x
+feature matrix of the snapshot's raw metrics:
+
+    crime rate, walk score, air quality combined total, rent, log10 population
+
+Every feature is centered and scaled to unit standard deviation over the
+supported cities (active, one row per city code); a missing value is the
+mean (0). The distance between two cities is the weighted root mean
+square of their feature differences, so equal weights of any size give
+the same distances.
+
+A query is one vectorized pass over the supported cities. With equal
+weights, the nearest SIMILAR_NEIGHBORS neighbours of every supported city
+are precomputed, so the default query is a row lookup; catalogues above
+SIMILAR_TABLE_MAX_CITIES skip the table. The table takes time quadratic
+in the catalogue size, so it is built in a background thread on the
+first equal-weight query, which takes the full pass meanwhile.
+
+The index is rebuilt when a snapshot is swapped in, reusing the previous
+index (features and table) when the supported cities and their metrics
+are unchanged, e.g. after a patch of names only.
+"""
+
+import logging
+import os
+import threading
+import time
+import warnings
+
+from dotenv import load_dotenv
+import numpy as np
+
+from app import snapshot
+from app.scoring import DIMENSIONS
+
+log = logging.getLogger(__name__)
+
+# Features in column order of the matrix
+FEATURES = DIMENSIONS + ("population",)
+
+# Rows of the neighbour table computed at a time
+TABLE_BLOCK = 1024
+
+# Extra candidates re-ranked with exact distances when building the table
+TABLE_MARGIN = 8
+
+
+def _distances2(columns, point, weights):
+    """
+    _distances2 returns the weighted mean squared differences between the
+    feature columns (one array per feature) and a point (one value or
+    array per feature), one contiguous pass per weighted feature; the
+    table and the queries share it so both give bit-identical distances
+    """
+    d2 = None
+    for j, weight in enumerate(weights):
+        if weight == 0:
+            continue
+        diff = columns[j] - point[j]
+        term = diff * diff * weight
+        d2 = term if d2 is None else d2 + term
+    return d2
+
+
+def raw_features(snap):
+    """
+    raw_features returns the float64 (n, 5) raw features of every snapshot
+    row in FEATURES order, NaN where missing
+    """
+    population = snap.population
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_population = np.where(population > 0, np.log10(population), np.nan)
+    return np.column_stack([snap.metrics, log_population])
+
+
+class NeighborTable:
+    """
+    NeighborTable holds every supported city's k nearest neighbours under
+    equal weights, built once, in a background thread on first use (see
+    get), and shared by the indexes reusing the features it came from
+
+      - columns:    float64 (5, m), standardized features, feature major
+      - k:          neighbours per city
+      - neighbors:  int32 (m, k), positions of each city's nearest
+                    neighbours, nearest first; None until built
+      - distances:  float64 (m, k), their distances
+    """
+
+    def __init__(self, columns, k):
+        self.columns   = columns
+        self.k         = k
+        self.neighbors = None
+        self.distances = None
+        self.lock      = threading.Lock()
+        self.building  = False
+
+    def get(self):
+        """
+        get returns (neighbors, distances), or None while the table is not
+        built, starting the build in a background thread the first time
+        """
+        table = self.neighbors, self.distances
+        if table[0] is not None:
+            return table
+        with self.lock:
+            if not self.building:
+                self.building = True
+                threading.Thread(target=self.build, name="similarity-table", daemon=True).start()
+        return None
+
+    def build(self):
+        """
+        build computes the table TABLE_BLOCK cities at a time: the
+        candidates are picked with one matrix product per block, then
+        re-ranked with exact distances
+        """
+        start = time.perf_counter()
+        k = self.k
+        Z = self.columns.T
+        m, dims = Z.shape
+        weights = np.full(dims, 1.0 / dims)
+        sq = (Z * Z).sum(axis=1)
+        pick = min(k + TABLE_MARGIN, m - 1)
+
+        neighbors = np.empty((m, k), dtype=np.int32)
+        distances = np.empty((m, k), dtype=np.float64)
+        for lo in range(0, m, TABLE_BLOCK):
+            hi = min(lo + TABLE_BLOCK, m)
+            approx = sq[lo:hi, None] + sq[None, :] - 2.0 * (Z[lo:hi] @ Z.T)
+            approx[np.arange(hi - lo), np.arange(lo, hi)] = np.inf
+            cand = np.argpartition(approx, pick - 1, axis=1)[:, :pick]
+
+            exact = _distances2([column[cand] for column in self.columns],
+                                [column[lo:hi, None] for column in self.columns], weights)
+            order = np.lexsort((cand, exact), axis=1)[:, :k]
+            neighbors[lo:hi] = np.take_along_axis(cand, order, axis=1)
+            distances[lo:hi] = np.sqrt(np.take_along_axis(exact, order, axis=1))
+
+        neighbors.setflags(write=False)
+        distances.setflags(write=False)
+        with self.lock:
+            # distances first: get tests neighbors
+            self.distances = distances
+            self.neighbors = neighbors
+        log.info("built the similarity table of {n} cities in {ms:.1f} ms".format(
+            n=m, ms=(time.perf_counter() - start) * 1000))
+
+
+class SimilarityIndex:
+    """
+    SimilarityIndex is an immutable nearest-neighbour index of a snapshot
+
+      - snap:       the CitySnapshot the index was built from
+      - rows:       intp (m,), snapshot row of each supported city
+      - position:   intp (n,), position of each snapshot row in rows, -1 if
+                    the row is not a supported city
+      - Z:          float64 (n, 5), standardized features of every row
+      - columns:    float64 (5, m), Z of the supported cities, feature major
+      - table:      the NeighborTable of the equal-weight queries, None
+                    when the catalogue has more than table_max supported
+                    cities or neighbors is 0
+      - reused:     True if the features came from `previous`
+
+    `previous` may pass the index of an earlier snapshot; its features and
+    table are reused if the supported cities and their metrics are the same
+    """
+
+    def __init__(self, snap, neighbors=25, table_max=20000, previous=None):
+        self.snap = snap
+        self.rows = snap.supported
+        k = min(neighbors, len(self.rows) - 1) if 0 < neighbors and 1 < len(self.rows) <= table_max else 0
+
+        self.reused = previous != None and previous.unchanged(snap, self.rows)
+        if self.reused:
+            self.position, self.Z, self.columns = previous.position, previous.Z, previous.columns
+            same_k = previous.table != None and previous.table.k == k
+            self.table = previous.table if same_k else (NeighborTable(self.columns, k) if k else None)
+            return
+
+        self.position = np.full(len(snap), -1, dtype=np.intp)
+        self.position[self.rows] = np.arange(len(self.rows))
+
+        raw = raw_features(snap)
+        candidates = raw[self.rows]
+        with warnings.catch_warnings():
+            # a feature no supported city has is all 0
+            warnings.simplefilter("ignore", RuntimeWarning)
+            mean = np.nan_to_num(np.nanmean(candidates, axis=0))
+            std = np.nanstd(candidates, axis=0)
+        std = np.where(np.isnan(std) | (std == 0), 1.0, std)
+        self.Z = np.nan_to_num((raw - mean) / std)
+        self.columns = np.ascontiguousarray(self.Z[self.rows].T)
+
+        for arr in (self.position, self.Z, self.columns):
+            arr.setflags(write=False)
+        self.table = NeighborTable(self.columns, k) if k else None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def unchanged(self, snap, rows):
+        """
+        unchanged returns True if the snapshot snap, with supported cities
+        at rows, has the features this index was built from
+        """
+        return (len(snap) == len(self.snap) and np.array_equal(rows, self.rows)
+                and np.array_equal(snap.metrics, self.snap.metrics, equal_nan=True)
+                and np.array_equal(snap.population, self.snap.population, equal_nan=True))
+
+    def query(self, row, weights, k):
+        """
+        query returns the snapshot rows of the k supported cities nearest
+        the city at snapshot row `row` under the passed feature weights
+        (FEATURES -> weight, not all 0), nearest first (ties by row), and
+        their distances; the city itself is left out
+        """
+        wght_vec = np.array([weights[feature] for feature in FEATURES], dtype=np.float64)
+        wght_vec /= wght_vec.sum()
+        pos = self.position[row]
+
+        if self.table != None and pos >= 0 and k <= self.table.k and (wght_vec == wght_vec[0]).all():
+            table = self.table.get()
+            if table != None:
+                neighbors, distances = table
+                return self.rows[neighbors[pos, :k]], distances[pos, :k]
+
+        d2 = _distances2(self.columns, self.Z[row], wght_vec)
+        if pos >= 0:
+            d2[pos] = np.inf
+        k = min(k, len(self.rows) - (pos >= 0))
+        if k <= 0:
+            return self.rows[:0], d2[:0]
+
+        # select the k nearest without sorting every city, then order those k
+        top = np.argpartition(d2, k - 1)[:k]
+        top = top[np.lexsort((top, d2[top]))]
+        return self.rows[top], np.sqrt(d2[top])
+
+
+def index_from_env(snap, previous=None):
+    """
+    index_from_env builds the SimilarityIndex of a snapshot (see
+    SimilarityIndex for previous) configured by these environment variables
+      - SIMILAR_NEIGHBORS:        neighbours precomputed per city (default 25,
+                                  0 disables the table)
+      - SIMILAR_TABLE_MAX_CITIES: largest catalogue the table is built for
+                                  (default 20000)
+    """
+    load_dotenv()
+    return SimilarityIndex(snap, int(os.getenv("SIMILAR_NEIGHBORS", 25)),
+                           int(os.getenv("SIMILAR_TABLE_MAX_CITIES", 20000)), previous)
+
+
+# The index of the snapshot last swapped in; None until the first swap
+_current = None
+
+
+def current():
+    """
+    current returns the SimilarityIndex of the latest snapshot or None
+    """
+    return _current
+
+
+def _rebuild(snap):
+    global _current
+    start = time.perf_counter()
+    _current = index_from_env(snap, _current)
+    log.info("{how} the similarity index of {n} cities in {ms:.1f} ms{table}".format(
+        how="reused" if _current.reused else "built", n=len(_current), ms=(time.perf_counter() - start) * 1000,
+        table="" if _current.table != None else " (no neighbour table)"))
+
+
+snapshot.SWAP_HOOKS.append(_rebuild)
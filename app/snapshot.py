@@ -0,0 +1,655 @@
+"""In-memory city score snapshot"""
+
+import hashlib
+import logging
+import threading
+import time
+
+import numpy as np
+import psycopg2
+import psycopg2.errors
+
+from app import metrics, scoring
+from app.cityindex import CityIndex
+from app.scoring import DIMENSIONS
+
+log = logging.getLogger(__name__)
+
+# Fetch every city with its raw livability metrics in one set-based query;
+# metric tables may hold several rows per city_code (e.g. "Springfield"), so
+# each is reduced to its row with the lowest id: the first one loaded (see
+# ROW_ID_TABLES)
+_SNAPSHOT_SQL = """
+    SELECT c.id, c.city, c.state, c.city_code, c.population, c.active,
+           cr.combined_scaled_rate, w.walk_score, aq."Combined Total", r."Dec Avg Rent",
+           {coords}
+    FROM cityspire_cities c
+    LEFT JOIN (SELECT DISTINCT ON (city_code) city_code, combined_scaled_rate
+               FROM cityspire_crime {where} ORDER BY city_code, id) cr
+           ON cr.city_code = c.city_code
+    LEFT JOIN (SELECT DISTINCT ON (city_code) city_code, walk_score
+               FROM cityspire_wlk_scr {where} ORDER BY city_code, id) w
+           ON w.city_code = c.city_code
+    LEFT JOIN (SELECT DISTINCT ON (city_code) city_code, "Combined Total"
+               FROM cityspire_air_quality {where} ORDER BY city_code, id) aq
+           ON aq.city_code = c.city_code
+    LEFT JOIN (SELECT DISTINCT ON (city_code) city_code, "Dec Avg Rent"
+               FROM cityspire_rent {where} ORDER BY city_code, id) r
+           ON r.city_code = c.city_code
+    {city_where}
+    ORDER BY c.id
+"""
+
+# City coordinates, by whether cityspire_cities has the lat and lon columns
+# app.ingest.geo adds; NULL (unknown) in a database without them
+_COORDS = {True: "c.lat, c.lon", False: "NULL::float8, NULL::float8"}
+
+SNAPSHOT_SQL = {has: _SNAPSHOT_SQL.format(where="", city_where="", coords=coords)
+                for has, coords in _COORDS.items()}
+
+# The same rows for the cities with the city codes in %(codes)s only
+CHANGED_SQL = {has: _SNAPSHOT_SQL.format(where="WHERE city_code = ANY(%(codes)s)",
+                                         city_where="WHERE c.city_code = ANY(%(codes)s)", coords=coords)
+               for has, coords in _COORDS.items()}
+
+# Tables feeding the snapshot; every one of them has a city_code column
+TABLES = (
+    "cityspire_cities",
+    "cityspire_crime",
+    "cityspire_wlk_scr",
+    "cityspire_air_quality",
+    "cityspire_rent",
+)
+
+# Metric tables created without a serial id column; install_indexes adds
+# one. Existing rows are numbered in their current physical order, so a
+# city keeps the row it was served before, and rows loaded later (e.g. by
+# app.ingest.air) get higher ids in load order.
+ROW_ID_TABLES = ("cityspire_air_quality", "cityspire_rent")
+
+ROW_ID_SQL = "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS id bigserial"
+
+# Indexes on the city_code key of every table feeding the snapshot: the
+# snapshot's DISTINCT ON subqueries read the metric rows in
+# (city_code, id) order, and CHANGED_SQL and the gen_*_score helpers look
+# cities up by city_code (cityspire_rent_history's primary key starts
+# with city_code). Without them both are sequential scans of every table.
+CITY_CODE_INDEXES = {
+    "cityspire_cities":      "city_code",
+    "cityspire_crime":       "city_code, id",
+    "cityspire_wlk_scr":     "city_code, id",
+    "cityspire_air_quality": "city_code, id",
+    "cityspire_rent":        "city_code, id",
+}
+
+# Named after their columns, so (city_code, id) is created on databases that
+# already have the city_code index older `refresher --install` runs made
+INDEX_SQL = "CREATE INDEX IF NOT EXISTS {table}_{name}_idx ON {table} ({columns})"
+
+COORD_COLUMNS_SQL = """
+    SELECT count(*) = 2 FROM information_schema.columns
+    WHERE table_name = 'cityspire_cities' AND column_name IN ('lat', 'lon')
+      AND table_schema = ANY(current_schemas(false))
+"""
+
+UPDATED_AT_COLUMNS_SQL = """
+    SELECT count(*) = %(n)s FROM information_schema.columns
+    WHERE table_name = ANY(%(tables)s) AND column_name = 'updated_at'
+      AND table_schema = ANY(current_schemas(false))
+"""
+
+# Latest updated_at and row count over every table: updates and inserts
+# move the first (see app.refresher), deletes the second
+DB_STATE_SQL = "SELECT max(updated_at), sum(n) FROM ({tables}) m".format(
+    tables=" UNION ALL ".join(f"SELECT max(updated_at) AS updated_at, count(*) AS n FROM {t}" for t in TABLES))
+
+
+class CitySnapshot:
+    """
+    CitySnapshot is an immutable, array-backed copy of every city's raw
+    livability metrics and their 1-5 scores
+
+    Rows are in id order and addressed through `index` (city_code -> row);
+    the arrays are read-only so a snapshot can be shared by any number of
+    requests
+      - population: float64 (n,), NaN where unknown
+      - metrics:    float64 (n, 4), raw values in DIMENSIONS order, NaN where missing
+      - scores:     int8 (n, 4), 1-5 scores in DIMENSIONS order, 0 where missing
+      - profiles:   int16 (n,), score profile of each row for the weight
+                    grid (see scoring.WeightGrid), -1 where a score is missing
+      - coords:     float64 (n, 2), latitude and longitude in degrees, NaN
+                    where unknown
+      - ids:        int64 (n,), city ids
+      - city_names: str (n,), city names
+      - codes:      str (n,), city codes
+      - states:     str (n,), states
+      - active:     bool (n,), active = 'yes'
+      - supported:  intp, rows of the supported cities (active, first row
+                    of their city code), ascending
+
+    db_state is the read_db_state of the tables a snapshot was loaded
+    from, set by load_snapshot; None for patched or file snapshots
+
+    `names` may pass the CityIndex of a snapshot with identical cities
+    (ids, names, states, codes and active flags in the same order);
+    `columns` the _city_columns of the cities, which patch_snapshot
+    gathers from the previous snapshot instead of reading every city
+
+    Rankings are served from the active cities that have every score,
+    grouped by score profile (see top_cities)
+      - rank_rows:      intp (m,), snapshot row of each ranked city
+      - rank_states:    str (m,), state of the ranked cities
+      - by_profile:     intp (m,), positions in rank_rows by (profile, row);
+                        the cities of profile p are at
+                        by_profile[profile_starts[p]:profile_starts[p + 1]]
+      - by_state:       the same by (state, profile, row), with one
+                        N_PROFILES + 1 block of state_starts per state
+                        (state_blocks: state -> block)
+    """
+
+    def __init__(self, cities, population, metrics, scores, engine, names=None, coords=None, columns=None):
+        self.cities     = tuple(cities)
+        if columns == None:
+            columns = _city_columns(self.cities)
+        self.ids        = columns["ids"]
+        self.city_names = columns["city_names"]
+        self.codes      = columns["codes"]
+        self.states     = columns["states"]
+        self.active     = columns["active"]
+        self.index      = columns["index"]
+        self.population = population
+        self.metrics    = metrics
+        self.scores     = scores
+        self.profiles   = scoring.profile_index(scores)
+        self.coords     = coords if coords is not None else np.full((len(self.cities), 2), np.nan)
+        self.engine     = engine
+        # reuse the name index of a snapshot holding the same cities
+        self.names      = names if names != None else CityIndex(self.cities)
+
+        canonical = np.zeros(len(self.cities), dtype=bool)
+        canonical[np.fromiter(self.index.values(), dtype=np.intp, count=len(self.index))] = True
+        self.supported   = np.flatnonzero(self.active & canonical)
+        self.rank_rows   = self.supported[(scores[self.supported] > 0).all(axis=1)]
+        self.rank_states = self.states[self.rank_rows]
+
+        profiles = self.profiles[self.rank_rows].astype(np.intp)
+        states, state_ids = np.unique(self.rank_states, return_inverse=True)
+        self.by_profile     = np.argsort(profiles, kind="stable")
+        self.profile_starts = np.searchsorted(profiles[self.by_profile], np.arange(scoring.N_PROFILES + 1))
+        keys = state_ids.reshape(-1) * scoring.N_PROFILES + profiles
+        self.by_state       = np.argsort(keys, kind="stable")
+        self.state_starts   = np.searchsorted(keys[self.by_state], np.arange(len(states) * scoring.N_PROFILES + 1))
+        self.state_blocks   = {state: block for block, state in enumerate(states.tolist())}
+
+        for arr in (self.population, self.metrics, self.scores, self.profiles, self.coords,
+                    self.ids, self.city_names, self.codes, self.states, self.active, self.supported,
+                    self.rank_rows, self.rank_states,
+                    self.by_profile, self.profile_starts, self.by_state, self.state_starts):
+            arr.setflags(write=False)
+        self.version    = self._digest()
+        self.loaded_at  = time.time()
+        self.db_state   = None
+        self._active    = None
+
+    def _digest(self):
+        """
+        _digest returns a short content hash identifying the snapshot's data
+        """
+        sha = hashlib.sha1()
+        for arr in (self.ids, self.city_names, self.codes, self.states, self.active,
+                    self.population, self.metrics, self.scores, self.coords):
+            sha.update(arr.tobytes())
+        return sha.hexdigest()[:16]
+
+    def __len__(self):
+        return len(self.cities)
+
+    def row(self, city):
+        """
+        row returns the array row of the passed city code or None
+        """
+        return self.index.get(city)
+
+    def find(self, city):
+        """
+        find returns the array row of the passed city code or user-typed
+        city name (e.g. "saint louis, mo") or None
+        """
+        row = self.index.get(city)
+        if row == None:
+            code = self.names.resolve(city)
+            if code != None:
+                row = self.index.get(code)
+        return row
+
+    def active_rows(self):
+        """
+        active_rows returns the rows of the supported cities (active =
+        'yes') and their ids, both ascending like every snapshot's rows;
+        the arrays are built once per snapshot
+        """
+        if self._active == None:
+            rows = np.flatnonzero(self.active)
+            ids = self.ids[rows]
+            rows.setflags(write=False)
+            ids.setflags(write=False)
+            self._active = (rows, ids)
+        return self._active
+
+    def get_population(self, row):
+        """
+        get_population returns the population of the city at row or None
+        """
+        val = self.population[row]
+        return None if np.isnan(val) else int(val)
+
+    def get_coords(self, row):
+        """
+        get_coords returns the (lat, lon) of the city at row or None
+        """
+        lat, lon = self.coords[row]
+        return None if np.isnan(lat) else (float(lat), float(lon))
+
+    def get_metric(self, row, dim):
+        """
+        get_metric returns the raw metric value of a dimension
+        for the city at row or None
+        """
+        val = self.metrics[row, DIMENSIONS.index(dim)]
+        return None if np.isnan(val) else float(val)
+
+    def top_cities(self, weights, limit, state=None):
+        """
+        top_cities ranks the active cities by their weighted score under
+        the passed weights and returns the `limit` best as a tuple of
+          - snapshot rows, best first
+          - unrounded weighted scores of those rows
+
+        state optionally restricts the ranking to one state's cities
+
+        Every city of a score profile has the same weighted score, so
+        when there are more cities than N_PROFILES the profiles are ranked
+        instead of the cities, and only the cities of the best profiles,
+        enough to fill `limit` with every tie of the last score, are
+        ordered by score (best first) and snapshot row for ties
+        """
+        wght_vec = np.array([weights[dim] for dim in DIMENSIONS], dtype=np.float64)
+        if state == None:
+            order, starts = self.by_profile, self.profile_starts
+        else:
+            block = self.state_blocks.get(state)
+            if block == None:
+                return self.rank_rows[:0], np.empty(0)
+            order = self.by_state
+            starts = self.state_starts[block * scoring.N_PROFILES:(block + 1) * scoring.N_PROFILES + 1]
+
+        n = int(starts[-1] - starts[0])
+        k = min(limit, n)
+        if k == 0:
+            return self.rank_rows[:0], np.empty(0)
+
+        if n <= scoring.N_PROFILES:
+            # fewer cities than profiles: order them all
+            rows = self.rank_rows[order[starts[0]:starts[-1]]]
+            wgt_avg = self.scores[rows] @ wght_vec
+        else:
+            # sums of small integers, so bit-identical to any city's scores @ wght_vec
+            profile_avg = scoring.PROFILE_SCORES @ wght_vec
+            counts = np.diff(starts)
+            by_score = np.argsort(-profile_avg)
+            cut = profile_avg[by_score[np.searchsorted(np.cumsum(counts[by_score]), k)]]
+            chosen = np.flatnonzero((profile_avg >= cut) & (counts > 0))
+
+            positions = np.concatenate([order[starts[p]:starts[p + 1]] for p in chosen.tolist()])
+            wgt_avg = np.repeat(profile_avg[chosen], counts[chosen])
+            rows = self.rank_rows[positions]
+        wgt_avg /= wght_vec.sum()
+
+        top = np.lexsort((rows, -wgt_avg))[:k]
+        return rows[top], wgt_avg[top]
+
+    def get_score(self, row, dim):
+        """
+        get_score returns the 1-5 score of a dimension
+        for the city at row or None
+        """
+        val = self.scores[row, DIMENSIONS.index(dim)]
+        return None if val == 0 else int(val)
+
+
+def _city_arrays(rows, engine):
+    """
+    _city_arrays returns the city dicts, population, metric, score and
+    coordinate arrays of SNAPSHOT_SQL shaped rows, scored with the passed
+    ScoreEngine
+    """
+    n = len(rows)
+    dims = len(DIMENSIONS)
+    cities     = []
+    population = np.full(n, np.nan, dtype=np.float64)
+    metrics    = np.full((n, dims), np.nan, dtype=np.float64)
+    coords     = np.full((n, 2), np.nan, dtype=np.float64)
+
+    for i, rec in enumerate(rows):
+        city_id, city, state, city_code, pop, active = rec[:6]
+        cities.append({
+            "id": city_id,
+            "city": city,
+            "state": state,
+            "city_code": city_code,
+            "active": active,
+        })
+        if pop is not None:
+            population[i] = pop
+
+        lat, lon = rec[6 + dims:8 + dims]
+        if lat is not None and lon is not None:
+            coords[i] = (lat, lon)
+
+        for j, raw in enumerate(rec[6:6 + dims]):
+            if raw is None:
+                continue
+            if DIMENSIONS[j] == "air" and raw == 0:
+                # a zero combined total means no air quality data
+                continue
+            metrics[i, j] = raw
+
+    # score every city in one vectorized call
+    scores = engine.score(metrics)
+
+    return cities, population, metrics, scores, coords
+
+
+@metrics.timed(metrics.CALL_SECONDS)
+def build_snapshot(rows, engine, previous=None):
+    """
+    build_snapshot builds a CitySnapshot from SNAPSHOT_SQL shaped rows,
+    scoring every city's metrics with the passed ScoreEngine; the name
+    index of a previous snapshot holding the same cities is reused
+    """
+    cities, population, metrics, scores, coords = _city_arrays(rows, engine)
+    names = None
+    if previous != None and len(previous.cities) == len(cities) \
+            and all(_city_key(a) == _city_key(b) for a, b in zip(previous.cities, cities)):
+        names = previous.names
+    return CitySnapshot(cities, population, metrics, scores, engine, names=names, coords=coords)
+
+
+def _city_columns(cities):
+    """
+    _city_columns returns the per-row arrays (ids, city_names, codes,
+    states, active) and the code index (city_code -> first row) of a sequence of city dicts
+    """
+    index = {}
+    for row, city in enumerate(cities):
+        # keep the first row if a city code appears more than once
+        index.setdefault(city["city_code"], row)
+    return {
+        "ids":        np.array([c["id"] for c in cities], dtype=np.int64),
+        "city_names": np.array([c["city"] for c in cities], dtype=str),
+        "codes":      np.array([c["city_code"] for c in cities], dtype=str),
+        "states":     np.array([c["state"] for c in cities], dtype=str),
+        "active":     np.array([c["active"] == "yes" for c in cities], dtype=bool),
+        "index":      index,
+    }
+
+
+def _city_key(city):
+    return (city["id"], city["city"], city["state"], city["city_code"], city["active"])
+
+
+@metrics.timed(metrics.CALL_SECONDS)
+def patch_snapshot(snapshot, codes, rows):
+    """
+    patch_snapshot returns a copy of snapshot in which every city with
+    one of the passed city codes is replaced by the CHANGED_SQL shaped
+    rows fetched for those codes; cities missing from rows are dropped
+    and new ones are added in id order
+
+    Only the fetched rows are scored, with the snapshot's ScoreEngine;
+    the other cities' arrays and columns are gathered as they are, so the
+    passed snapshot stays untouched for requests still reading it, and
+    no per-city Python work is done beyond copying the city dicts
+    """
+    codes = set(codes)
+    cities, population, metrics, scores, coords = _city_arrays(rows, snapshot.engine)
+    fetched = _city_columns(cities)
+
+    changed = np.isin(snapshot.codes, list(codes))
+    kept = np.flatnonzero(~changed)
+    dropped = [_city_key(snapshot.cities[row]) for row in np.flatnonzero(changed).tolist()]
+
+    all_cities = [snapshot.cities[row] for row in kept.tolist()] + cities
+    order = np.argsort(np.concatenate([snapshot.ids[kept], fetched["ids"]]), kind="stable")
+    columns = {key: np.concatenate([getattr(snapshot, key)[kept], fetched[key]])[order]
+               for key in ("ids", "city_names", "codes", "states", "active")}
+
+    # rows keep their codes unless cities were added or removed
+    if np.array_equal(columns["codes"], snapshot.codes):
+        columns["index"] = snapshot.index
+    else:
+        columns["index"] = {}
+        for row, code in enumerate(columns["codes"].tolist()):
+            columns["index"].setdefault(code, row)
+
+    # the name index only depends on the cities' names, codes and order
+    names = None
+    if sorted(dropped) == sorted(_city_key(c) for c in cities):
+        names = snapshot.names
+
+    return CitySnapshot(
+        [all_cities[row] for row in order.tolist()],
+        np.concatenate([snapshot.population[kept], population])[order],
+        np.concatenate([snapshot.metrics[kept], metrics])[order],
+        np.concatenate([snapshot.scores[kept], scores])[order],
+        snapshot.engine,
+        names=names,
+        coords=np.concatenate([snapshot.coords[kept], coords])[order],
+        columns=columns,
+    )
+
+
+def install_indexes(db_conn):
+    """
+    install_indexes adds the ROW_ID_TABLES id columns and creates the
+    CITY_CODE_INDEXES missing from the database, and refreshes the planner
+    statistics of their tables; safe to run more than once
+    """
+    cursor = db_conn.cursor()
+    try:
+        for table in ROW_ID_TABLES:
+            cursor.execute(ROW_ID_SQL.format(table=table))
+        for table, columns in CITY_CODE_INDEXES.items():
+            cursor.execute(INDEX_SQL.format(table=table, name=columns.replace(", ", "_"), columns=columns))
+            cursor.execute(f"ANALYZE {table}")
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def has_coordinates(cursor):
+    """
+    has_coordinates returns True if cityspire_cities has the lat and lon
+    columns (see app.ingest.geo)
+    """
+    cursor.execute(COORD_COLUMNS_SQL)
+    return cursor.fetchone()[0]
+
+
+def read_db_state(cursor):
+    """
+    read_db_state returns the (latest updated_at, row count) of the tables
+    feeding the snapshot, or None if they have no updated_at columns (see
+    `python -m app.refresher --install`)
+    """
+    cursor.execute(UPDATED_AT_COLUMNS_SQL, {"n": len(TABLES), "tables": list(TABLES)})
+    if not cursor.fetchone()[0]:
+        return None
+    cursor.execute(DB_STATE_SQL)
+    return tuple(cursor.fetchone())
+
+
+def load_snapshot(db_conn, previous=None):
+    """
+    load_snapshot fetches every city's metrics and the score quantile
+    edges from the database and returns a new CitySnapshot (see
+    build_snapshot for previous)
+    """
+    engine = scoring.load_engine(db_conn)
+
+    cursor = db_conn.cursor()
+    try:
+        # read before the rows, so the snapshot holds every change up to it
+        db_state = read_db_state(cursor)
+        sql = SNAPSHOT_SQL[has_coordinates(cursor)]
+        with metrics.timer(metrics.QUERY_SECONDS, "snapshot"):
+            try:
+                cursor.execute(sql)
+            except psycopg2.errors.UndefinedColumn as error:
+                raise RuntimeError("{err}; run `python -m app.refresher --indexes` to add the id columns of {tables}".format(
+                    err=str(error).splitlines()[0], tables=", ".join(ROW_ID_TABLES))) from error
+            rows = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    snapshot = build_snapshot(rows, engine, previous)
+    snapshot.db_state = db_state
+    return snapshot
+
+
+# The snapshot currently being served; replaced as a whole, never mutated
+_current = build_snapshot([], scoring.current())
+_refresh_lock = threading.Lock()
+# Set once a snapshot has been loaded
+_ready = threading.Event()
+# Callables passed every snapshot swapped in, e.g. app.shared publishing it
+SWAP_HOOKS = []
+
+
+def weight_grid_metrics():
+    """
+    weight_grid_metrics returns the memory held by the weight grid, in
+    total and per city of the current snapshot, as /metrics gauges
+    """
+    grid = scoring.weight_grid
+    if grid == None:
+        return []
+    snapshot = _current
+    held = grid.nbytes() + snapshot.profiles.nbytes
+    return (metrics.counter("cityspire_weight_grid_bytes", "Memory held by the weight grid and the snapshot's score profiles.", held, "gauge")
+            + metrics.counter("cityspire_weight_grid_bytes_per_city", "Weight grid memory per city of the current snapshot.",
+                              round(held / max(len(snapshot), 1), 1), "gauge"))
+
+
+metrics.COLLECTORS.append(weight_grid_metrics)
+
+
+def current():
+    """
+    current returns the snapshot currently being served
+
+    Callers should fetch the snapshot once per request and read
+    everything from that reference to get a consistent view
+    """
+    return _current
+
+
+def swap(snapshot):
+    """
+    swap atomically replaces the snapshot being served, along with the
+    score engine used by the database-backed score helpers
+    """
+    global _current
+    scoring.swap(snapshot.engine)
+    _current = snapshot
+    # the indexes built from the snapshot are ready along with it
+    for hook in SWAP_HOOKS:
+        hook(snapshot)
+    _ready.set()
+    return snapshot
+
+
+def ready():
+    """
+    ready returns True once a snapshot has been loaded
+    """
+    return _ready.is_set()
+
+
+def wait_ready(timeout=None):
+    """
+    wait_ready waits up to timeout seconds for a snapshot to be loaded
+    and returns ready()
+    """
+    return _ready.wait(timeout)
+
+
+def refresh(db_conn):
+    """
+    refresh loads a new snapshot from the database and swaps it in
+
+    Returns a dictionary
+      - "error": None if no error has occurred or an error message
+      - "value": the new snapshot or None if an error has occurred
+    """
+    ret_dict = {"error": None, "value": None}
+
+    # Serialize refreshes; readers keep using the old snapshot meanwhile
+    with _refresh_lock:
+        try:
+            snapshot = load_snapshot(db_conn, _current)
+        except (Exception, psycopg2.Error) as error:
+            try:
+                db_conn.rollback()
+            except psycopg2.Error:
+                pass
+            log.error("error loading the city score snapshot: {err}".format(err=error))
+            ret_dict["error"] = "error loading the city score snapshot: " + str(error)
+            return ret_dict
+
+        ret_dict["value"] = swap(snapshot)
+
+    log.info("loaded city score snapshot {ver} with {n} cities".format(ver=snapshot.version, n=len(snapshot)))
+    return ret_dict
+
+
+def refresh_cities(db_conn, codes):
+    """
+    refresh_cities reloads the cities with the passed city codes from
+    the database and swaps in a patched copy of the current snapshot;
+    the cost scales with the number of changed cities, and the score
+    quantile edges are kept until the next full refresh
+
+    Returns a dictionary
+      - "error": None if no error has occurred or an error message
+      - "value": the new snapshot or None if an error has occurred
+    """
+    ret_dict = {"error": None, "value": None}
+
+    with _refresh_lock:
+        try:
+            cursor = db_conn.cursor()
+            try:
+                sql = CHANGED_SQL[has_coordinates(cursor)]
+                with metrics.timer(metrics.QUERY_SECONDS, "snapshot_changed"):
+                    cursor.execute(sql, {"codes": list(codes)})
+                    rows = cursor.fetchall()
+            finally:
+                cursor.close()
+            snapshot = patch_snapshot(_current, codes, rows)
+        except (Exception, psycopg2.Error) as error:
+            try:
+                db_conn.rollback()
+            except psycopg2.Error:
+                pass
+            log.error("error reloading cities {codes}: {err}".format(codes=sorted(codes), err=error))
+            ret_dict["error"] = "error reloading cities: " + str(error)
+            return ret_dict
+
+        ret_dict["value"] = swap(snapshot)
+
+    log.info("patched city score snapshot {ver} with {n} changed city codes".format(ver=snapshot.version, n=len(codes)))
+    return ret_dict
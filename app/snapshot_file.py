@@ -0,0 +1,134 @@
+"""City score snapshot file
+
+One file holds everything the scoring endpoints read, so the API can
+serve without Postgres (SNAPSHOT_FILE, see ml.warm_up) and the workers of
+a host can share one snapshot (see app.shared).
+
+Layout (little endian); arrays start 8-byte aligned and are memory-mapped
+read-only, not copied:
+
+    header     64 bytes: magic, layout, dims, n, generation, loaded_at,
+                         cities offset, cities length
+    population float64 (n,)
+    coords     float64 (n, 2), latitude and longitude, NaN where unknown
+    metrics    float64 (n, dims), raw metrics in DIMENSIONS order
+    scores     int8    (n, dims), padded to 8 bytes
+    cities     UTF-8 JSON string table: the cityspire_cities rows (id,
+               city, state, city_code, active) and the score engine's
+               quantile edges
+
+The metrics are the values the snapshot reduces every metric table to
+(one row per city_code), so a file answers exactly as the database did
+when it was exported.
+
+Export the database to a file:
+    python -m app.snapshot_file cityspire.snap
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from app import scoring, snapshot
+from app.dbsession import DBSession
+from app.scoring import DIMENSIONS
+
+log = logging.getLogger(__name__)
+
+MAGIC  = b"CSPSNAP\0"
+LAYOUT = 2
+HEADER = struct.Struct("<8sIIQQdQQ8x")
+
+CITY_FIELDS = ("id", "city", "state", "city_code", "active")
+
+
+def _aligned(offset):
+    return (offset + 7) // 8 * 8
+
+
+def write_snapshot(path, snap, generation=0):
+    """
+    write_snapshot writes snap to path in the snapshot file layout; the
+    file is written under a temporary name and renamed into place, so
+    readers never see a partial file
+    """
+    n, dims = len(snap), len(DIMENSIONS)
+    cities = json.dumps({
+        "cities": [[c[field] for field in CITY_FIELDS] for c in snap.cities],
+        "quantile_edges": snap.engine.quantile_edges,
+    }, separators=(",", ":")).encode("utf-8")
+    cities_offset = _aligned(HEADER.size + n * 8 + n * 2 * 8 + n * dims * 8 + n * dims)
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, LAYOUT, dims, n, generation, snap.loaded_at, cities_offset, len(cities)))
+        f.write(np.ascontiguousarray(snap.population, dtype="<f8").tobytes())
+        f.write(np.ascontiguousarray(snap.coords, dtype="<f8").tobytes())
+        f.write(np.ascontiguousarray(snap.metrics, dtype="<f8").tobytes())
+        f.write(np.ascontiguousarray(snap.scores, dtype=np.int8).tobytes())
+        f.write(b"\0" * (cities_offset - f.tell()))
+        f.write(cities)
+    os.replace(tmp, path)
+
+
+def read_snapshot(path):
+    """
+    read_snapshot maps a snapshot file and returns its generation and a
+    CitySnapshot whose arrays are read-only views of the mapping
+
+    Raises ValueError if path is not a snapshot file of this layout
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(mapped) < HEADER.size:
+        raise ValueError(f"{path} is not a snapshot file")
+    magic, layout, dims, n, generation, loaded_at, cities_offset, cities_len = HEADER.unpack_from(mapped)
+    if magic != MAGIC or layout != LAYOUT or dims != len(DIMENSIONS):
+        raise ValueError(f"{path} is not a layout {LAYOUT} snapshot file")
+
+    offset = HEADER.size
+    population = np.frombuffer(mapped, dtype="<f8", count=n, offset=offset)
+    offset += n * 8
+    coords = np.frombuffer(mapped, dtype="<f8", count=n * 2, offset=offset).reshape(n, 2)
+    offset += n * 2 * 8
+    metrics = np.frombuffer(mapped, dtype="<f8", count=n * dims, offset=offset).reshape(n, dims)
+    offset += n * dims * 8
+    scores = np.frombuffer(mapped, dtype=np.int8, count=n * dims, offset=offset).reshape(n, dims)
+
+    doc = json.loads(mapped[cities_offset:cities_offset + cities_len].decode("utf-8"))
+    cities = [dict(zip(CITY_FIELDS, c)) for c in doc["cities"]]
+    edges = doc["quantile_edges"]
+    engine = scoring.ScoreEngine(rent_edges=edges["rent"], aq_edges=edges["air"])
+
+    snap = snapshot.CitySnapshot(cities, population, metrics, scores, engine, coords=coords)
+    snap.loaded_at = loaded_at
+    return generation, snap
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="snapshot file to write")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    db_sess = DBSession(minconn=1, maxconn=1)
+    db_conn_attempt = db_sess.connect()
+    if db_conn_attempt["error"] != None:
+        raise SystemExit("ERROR: error attempting to connect to the database: {err_str}".format(err_str=db_conn_attempt["error"]))
+    with db_sess.connection() as db_conn:
+        snap = snapshot.load_snapshot(db_conn)
+    db_sess.close_connection()
+
+    write_snapshot(args.path, snap)
+    log.info("exported snapshot {ver} of {n} cities to {path} ({kb:.0f} KB)".format(
+        ver=snap.version, n=len(snap), path=args.path, kb=os.path.getsize(args.path) / 1024))
+
+
+if __name__ == "__main__":
+    main()
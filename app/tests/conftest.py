@@ -0,0 +1,58 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import scoring, snapshot, snapshot_file
+
+# SNAPSHOT_SQL shaped rows: id, city, state, city_code, population, active,
+# crime rate, walk score, air quality total, rent, lat, lon
+CITY_ROWS = [
+    (1,  "New York City", "NY", "New_York_City",  8336817, "yes", 0.55, 89,   11.5, 2900., 40.7128,  -74.0060),
+    (2,  "Los Angeles",   "CA", "Los_Angeles",    3979576, "yes", 0.45, 69,   16.0, 2600., 34.0522, -118.2437),
+    (3,  "Chicago",       "IL", "Chicago",        2693976, "yes", 0.70, 78,   12.5, 1700., 41.8781,  -87.6298),
+    (4,  "Houston",       "TX", "Houston",        2320268, "yes", 0.65, 47,   10.9, 1300., 29.7604,  -95.3698),
+    (5,  "St. Louis",     "MO", "St_Louis",        300576, "yes", 0.95, 67,   11.2, 1000., 38.6270,  -90.1994),
+    (6,  "Kansas City",   "MO", "Kansas_City",     495327, "yes", 0.80, 34,    9.8, 1100., 39.0997,  -94.5786),
+    (7,  "Kansas City",   "KS", "Kansas_City_KS",  152960, "yes", 0.60, 33,    9.6,  950., 39.1141,  -94.6275),
+    (8,  "San Francisco", "CA", "San_Francisco",   881549, "yes", 0.50, 88,    9.5, 2990., 37.7749, -122.4194),
+    (9,  "San Diego",     "CA", "San_Diego",      1423851, "yes", 0.30, 51,   12.0, 2200., 32.7157, -117.1611),
+    (10, "Denver",        "CO", "Denver",          727211, "yes", 0.40, 60,   10.5, 1600., 39.7392, -104.9903),
+    (11, "Springfield",   "IL", "Springfield",     114230, "no",  0.35, 40,   10.0,  900., 39.7817,  -89.6501),
+    (12, "Boise",         "ID", "Boise",           228959, "yes", 0.10, 39,   None, 1200., 43.6150, -116.2023),
+    (13, "Honolulu",      "HI", "Honolulu",        345064, "yes", 0.20, 65,    7.1, 2100., 21.3069, -157.8583),
+    (14, "Anchorage",     "AK", "Anchorage",         None, "yes", 0.75, 34,    8.0, 1400.,    None,      None),
+    (15, "Chicago",       "IL", "Chicago",        2693976, "yes", 0.10, 99,    7.0,  800., 41.8781,  -87.6298),
+    (16, "Fort Worth",    "TX", "Fort_Worth",      909585, "yes", 0.55, 35,   11.0, 1250., 32.7555,  -97.3308),
+]
+
+# Codes of the supported cities (active, first row of their city code)
+SUPPORTED = [row[3] for row in CITY_ROWS if row[5] == "yes" and row[0] != 15]
+
+
+@pytest.fixture(scope="session")
+def snap():
+    return snapshot.build_snapshot(CITY_ROWS, scoring.ScoreEngine())
+
+
+@pytest.fixture(scope="session")
+def snap_path(snap, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("snapshot") / "cityspire.snap")
+    snapshot_file.write_snapshot(path, snap)
+    return path
+
+
+@pytest.fixture(scope="session")
+def client(snap, snap_path):
+    # serve the snapshot file without a database, as SNAPSHOT_FILE deployments do
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("SNAPSHOT_FILE", snap_path)
+        mp.setenv("STARTUP_READY_TIMEOUT", "30")
+        mp.delenv("SNAPSHOT_SHARED_DIR", raising=False)
+        from app.main import app
+        with TestClient(app) as test_client:
+            deadline = time.monotonic() + 30
+            while snapshot.current().version != snap.version and time.monotonic() < deadline:
+                time.sleep(0.05)
+            assert snapshot.current().version == snap.version
+            yield test_client
@@ -0,0 +1,108 @@
+import time
+
+from app import cache, scoring, snapshot
+from app.tests.conftest import CITY_ROWS
+
+
+def test_normalize_query_fills_in_default_weights():
+    assert cache.normalize_query(b"") == cache.normalize_query(b"rent=5&crime=05")
+    assert cache.normalize_query(b"walk=7&limit=3") == "air=5&crime=5&limit=3&rent=5&walk=7"
+    assert cache.normalize_query(b"crime=abc") == "air=5&crime=abc&rent=5&walk=5"
+
+
+def test_response_cache_evicts_least_recently_used():
+    lru = cache.ResponseCache(maxsize=2, ttl=60)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    assert lru.get("a") == 1
+    lru.put("c", 3)
+    assert lru.get("b") == None and lru.get("a") == 1 and lru.get("c") == 3
+    assert lru.stats()["size"] == 2
+
+
+def test_response_cache_is_bounded_by_bytes():
+    lru = cache.ResponseCache(maxsize=100, ttl=60, maxbytes=10, max_entry_bytes=6)
+    assert lru.put("a", 1, 4) and lru.put("b", 2, 4)
+    assert not lru.put("big", 3, 7) and lru.get("big") == None
+    lru.put("c", 4, 5)
+    assert lru.get("a") == None and lru.get("b") == 2 and lru.get("c") == 4
+    assert lru.stats()["bytes"] == 9
+    lru.put("b", 5, 1)
+    assert lru.stats()["bytes"] == 6
+    lru.clear()
+    assert lru.stats()["bytes"] == 0
+
+
+def test_response_cache_expires_entries():
+    lru = cache.ResponseCache(maxsize=2, ttl=0.01)
+    lru.put("a", 1)
+    time.sleep(0.02)
+    assert lru.get("a") == None and lru.stats()["size"] == 0
+
+
+def test_etag_and_not_modified(client):
+    response = client.get("/city_scr/Houston")
+    etag = response.headers["etag"]
+    assert etag == f'W/"{snapshot.current().version}"'
+    assert "max-age" in response.headers["cache-control"]
+
+    for tags in (etag, f'W/"stale", {etag}', "*"):
+        not_modified = client.get("/city_scr/Houston", headers={"If-None-Match": tags})
+        assert not_modified.status_code == 304 and not_modified.content == b""
+    assert client.get("/city_scr/Houston", headers={"If-None-Match": 'W/"stale"'}).status_code == 200
+
+
+def test_equivalent_requests_are_served_from_the_cache(client):
+    cache.response_cache.clear()
+    first = client.get("/city_scr/Houston?crime=8")
+    hits = cache.response_cache.stats()["hits"]
+    again = client.get("/city_scr/Houston?crime=08&walk=5")
+    assert cache.response_cache.stats()["hits"] == hits + 1
+    assert again.content == first.content and again.headers["etag"] == first.headers["etag"]
+
+
+def test_reloading_the_snapshot_invalidates_tags_and_entries(client, snap):
+    response = client.get("/population_data/Houston")
+    etag, population = response.headers["etag"], response.json()["population"]
+
+    changed = [row[:4] + (row[4] + 1 if row[3] == "Houston" else row[4],) + row[5:] for row in CITY_ROWS]
+    snapshot.swap(snapshot.build_snapshot(changed, scoring.ScoreEngine(), snap))
+    try:
+        response = client.get("/population_data/Houston", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag and response.json()["population"] == population + 1
+    finally:
+        snapshot.swap(snap)
+    assert client.get("/population_data/Houston", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_renaming_a_city_changes_the_etag(snap):
+    # the city and state columns of Houston's row
+    for column, value in ((1, "Renamed"), (2, "ZZ")):
+        renamed = [row[:column] + (value,) + row[column + 1:] if row[3] == "Houston" else row for row in CITY_ROWS]
+        assert snapshot.build_snapshot(renamed, scoring.ScoreEngine()).version != snap.version
+
+
+def test_error_payloads_are_not_cached(client):
+    cache.response_cache.clear()
+    response = client.get("/population_data/Hoston")
+    assert response.status_code == 200 and "Error" in response.json()
+    assert "etag" not in response.headers and cache.response_cache.stats()["size"] == 0
+    assert "etag" in client.get("/population_data/Houston").headers
+
+
+def test_large_responses_are_served_but_not_cached(client, monkeypatch):
+    monkeypatch.setattr(cache.response_cache, "max_entry_bytes", 512)
+    cache.response_cache.clear()
+    full = client.get("/cities?fields=id,city,state,city_code,population,lat,lon")
+    assert full.status_code == 200 and len(full.content) > 512 and "etag" in full.headers
+    assert cache.response_cache.stats()["size"] == 0
+    client.get("/cities?page_size=1")
+    assert cache.response_cache.stats()["size"] == 1
+
+
+def test_uncacheable_responses_carry_no_etag(client):
+    assert "etag" not in client.post("/city_scr/batch", json={"city_codes": ["Houston"]}).headers
+    assert "etag" not in client.get("/rent_rate/Houston/history").headers
+    assert "etag" not in client.get("/city_scr/Hoston").headers
+    assert "etag" not in client.get("/healthz").headers
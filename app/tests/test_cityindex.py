@@ -0,0 +1,87 @@
+import pytest
+
+from app.cityindex import CityIndex, normalize
+
+
+@pytest.fixture(scope="module")
+def names(snap):
+    return snap.names
+
+
+@pytest.mark.parametrize("text, code", [
+    ("St_Louis", "St_Louis"),
+    ("Saint Louis, MO", "St_Louis"),
+    ("st. louis missouri", "St_Louis"),
+    ("NYC", "New_York_City"),
+    ("new york", "New_York_City"),
+    ("Ft Worth", "Fort_Worth"),
+    ("fort worth tx", "Fort_Worth"),
+    # a shared name resolves through its state or city code
+    ("Kansas City, MO", "Kansas_City"),
+    ("Kansas City, Kansas", "Kansas_City_KS"),
+    ("Kansas_City", "Kansas_City"),
+    # inactive cities resolve; the endpoints decide what to do with them
+    ("Springfield", "Springfield"),
+])
+def test_resolve_exact(names, text, code):
+    assert names.resolve(text) == code
+
+
+@pytest.mark.parametrize("text, code", [
+    ("San Franciscoo", "San_Francisco"),
+    ("Los Angeless", "Los_Angeles"),
+    ("Anchorrage", "Anchorage"),
+    ("houstonn", "Houston"),
+])
+def test_resolve_close_misspellings(names, text, code):
+    assert names.resolve(text) == code
+
+
+@pytest.mark.parametrize("text", ["Hoston", "Chicgo", "Kansas Cty", "kansas cityy", "zzzz", "", "  "])
+def test_resolve_rejects_distant_or_ambiguous_names(names, text):
+    assert names.resolve(text) == None
+
+
+def test_shared_names_do_not_resolve_but_suggest_their_cities(names):
+    assert names.resolve("kansas city") == None
+    assert names.suggest("Kansas City") == ["Kansas_City", "Kansas_City_KS"]
+    assert names.suggest("kansas city", limit=1) == ["Kansas_City"]
+
+    springfields = CityIndex([
+        {"city": "Springfield", "state": "IL", "city_code": "Springfield", "active": "yes"},
+        {"city": "Springfield", "state": "MO", "city_code": "Springfield_MO", "active": "yes"},
+        {"city": "Springfield", "state": "MA", "city_code": "Springfield_MA", "active": "yes"},
+    ])
+    assert springfields.resolve("springfield") == None and springfields.resolve("Springfeld") == None
+    assert springfields.suggest("springfield") == ["Springfield", "Springfield_MA", "Springfield_MO"]
+    assert springfields.resolve("Springfield, Missouri") == "Springfield_MO"
+    assert springfields.resolve("springfield ma") == "Springfield_MA"
+    # a city code names one city even when it is also a shared name
+    assert springfields.resolve("Springfield") == "Springfield"
+
+
+def test_suggest(names):
+    assert names.suggest("Hoston") == ["Houston"]
+    assert names.suggest("san fransisco") == ["San_Francisco"]
+    assert names.suggest("Kansas Cty") == ["Kansas_City", "Kansas_City_KS"]
+    assert names.suggest("San", limit=1) == ["San_Diego"]
+    assert names.suggest("zzzz") == []
+    assert names.suggest("") == []
+
+
+def test_complete_returns_active_cities_in_name_order(snap, names):
+    assert [snap.cities[row]["city_code"] for row in names.complete("san")] == ["San_Diego", "San_Francisco"]
+    assert [snap.cities[row]["city_code"] for row in names.complete("Kansas", limit=1)] == ["Kansas_City"]
+    assert names.complete("spring") == []
+
+
+def test_find_returns_the_first_row_of_a_city_code(snap):
+    assert snap.find("chicago") == 2
+    assert snap.find("Hoston") == None
+
+
+def test_normalize():
+    assert normalize("Saint  Louis, MO") == "st louis mo"
+    assert normalize("St_Louis") == "st louis"
+    assert normalize("Coeur d'Alêne") == "coeur d alene"
+    assert CityIndex([]).resolve("Houston") == None
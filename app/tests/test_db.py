@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+import sqlalchemy
+
+from app import db
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    # one pooled connection, so a second checkout has to wait for it
+    engine = db.instrument(sqlalchemy.create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}", poolclass=sqlalchemy.pool.QueuePool, pool_size=1, max_overflow=0,
+        pool_timeout=5, connect_args={"check_same_thread": False}))
+    monkeypatch.setattr(db, "engine", engine)
+    monkeypatch.setattr(db, "pool_stats", db.PoolStats())
+    monkeypatch.setattr(db, "wait_threshold", 0.05)
+    yield engine
+    engine.dispose()
+
+
+def checkout():
+    connections = db.get_db()
+    return connections, next(connections)
+
+
+def test_checkouts_that_wait_for_a_checkin_are_counted(engine):
+    held, _ = checkout()
+    # opening the first connection is not a wait
+    assert db.pool_stats.as_dict()["connects"] == 1 and db.pool_stats.as_dict()["waits"] == 0
+
+    waiter = threading.Thread(target=lambda: checkout()[0].close())
+    waiter.start()
+    time.sleep(0.2)
+    held.close()
+    waiter.join(5)
+
+    stats = db.pool_stats.as_dict()
+    assert stats["connects"] == 1 and stats["checkouts"] == 2 and stats["checkins"] == 2
+    assert stats["waits"] == 1 and 0.15 <= stats["wait_seconds"] == stats["max_wait_seconds"]
+
+    # a free pooled connection is handed out without a wait
+    checkout()[0].close()
+    assert db.pool_stats.as_dict()["waits"] == 1 and db.pool_stats.as_dict()["checkouts"] == 3
+
+
+def test_db_pool_endpoint(client, engine):
+    held, _ = checkout()
+    stats = client.get("/db_pool").json()
+    assert stats["checkouts"] == 1 and stats["connects"] == 1 and stats["waits"] == 0
+    assert (stats["size"], stats["checked_in"], stats["checked_out"], stats["overflow"]) == (1, 0, 1, 0)
+    held.close()
+    assert client.get("/db_pool").json()["checked_in"] == 1
+
+
+def test_db_pool_needs_the_engine(client, monkeypatch):
+    monkeypatch.setattr(db, "engine", None)
+    assert client.get("/db_pool").status_code == 503
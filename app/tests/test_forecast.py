@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+from app import forecast, rent_history
+from app.forecast import RentForecaster
+from app.rent_history import RentHistory, month_number
+
+FIRST = month_number(2018, 1)
+MONTHS = 48
+
+# log rent coefficients in forecast.FEATURES order: Houston grows 3% a year
+# with a 2% seasonal swing, Denver falls 1% a year
+TRUE_COEF = {
+    "Houston": [np.log(1300.), 0.03, 0.02, -0.01],
+    "Denver":  [np.log(1600.), -0.01, 0.005, 0.01],
+}
+
+
+def synthetic_history():
+    X = forecast.features(FIRST + np.arange(MONTHS), FIRST + MONTHS - 1)
+    rents = np.exp(np.array(list(TRUE_COEF.values())) @ X.T).astype(np.float32)
+    # a few gaps, and Boise with too few months to fit
+    rents[0, [30, 31, 40]] = np.nan
+    boise = np.full((1, MONTHS), np.nan, dtype=np.float32)
+    boise[0, -forecast.MIN_MONTHS + 1:] = 1200.
+    return RentHistory(list(TRUE_COEF) + ["Boise"], FIRST, np.vstack([rents, boise]))
+
+
+@pytest.fixture(scope="module")
+def model():
+    return forecast.train(synthetic_history())
+
+
+def test_fit_recovers_the_trend_and_seasonality(model):
+    assert model.codes == ["Houston", "Denver"] and model.end == FIRST + MONTHS - 1
+    # float32 rents and the ridge penalty keep the fit from being exact
+    assert model.coef == pytest.approx(np.array(list(TRUE_COEF.values())), abs=2e-4)
+    assert model.meta["rmse"] == pytest.approx([0, 0], abs=1e-5)
+
+
+def test_forecasts_continue_the_series(model):
+    months = model.months(12)
+    assert model.labels[:12] == [rent_history.month_label(m) for m in months.tolist()]
+    assert model.labels[0] == "2022-01"
+    expected = np.exp(forecast.features(months, model.end) @ np.array(TRUE_COEF["Houston"]))
+    assert model.forecast("Houston", 12) == pytest.approx(expected, rel=1e-3)
+    # a year on, the seasonal terms repeat and only the trend moved
+    assert model.forecast("Houston", 13)[12] / model.forecast("Houston", 1)[0] == pytest.approx(np.exp(0.03), rel=1e-4)
+    assert model.forecast("Boise", 3) is None
+
+    every = model.forecast_all(forecast.MAX_HORIZON + 6)
+    assert every.shape == (2, forecast.MAX_HORIZON + 6)
+    assert np.allclose(every[1, :12], model.forecast("Denver", 12))
+
+
+def test_artifact_round_trip(model, tmp_path):
+    path = str(tmp_path / "rent_forecast.npz")
+    model.save(path)
+    loaded = RentForecaster.load(path)
+    assert loaded.codes == model.codes and loaded.end == model.end and loaded.labels == model.labels
+    assert np.array_equal(loaded.coef, model.coef) and np.array_equal(loaded.meta["rmse"], model.meta["rmse"])
+    for horizon in (1, forecast.MAX_HORIZON, forecast.MAX_HORIZON + 6):
+        assert np.array_equal(loaded.forecast_all(horizon), model.forecast_all(horizon))
+    assert np.array_equal(loaded.forecast("Denver", 5), model.forecast("Denver", 5))
+
+
+def test_artifacts_of_another_version_are_rejected(model, tmp_path):
+    path = str(tmp_path / "old.npz")
+    np.savez(path, version=forecast.ARTIFACT_VERSION + 1, codes=np.array(model.codes), coef=model.coef,
+             end=model.end, features=np.array(forecast.FEATURES))
+    with pytest.raises(ValueError):
+        RentForecaster.load(path)
+
+
+def test_backtest_beats_the_last_value(model):
+    result = forecast.backtest(synthetic_history(), horizon=3)
+    assert result["cities"] == 2
+    assert result["model_mape"] < 1e-3 < result["last_value_mape"]
+
+
+def test_load_from_env(model, tmp_path, monkeypatch):
+    monkeypatch.setattr(forecast, "_current", None)
+    monkeypatch.setenv("RENT_FORECAST_MODEL", str(tmp_path / "missing.npz"))
+    forecast.load_from_env()
+    assert forecast.current() == None
+
+    broken = tmp_path / "broken.npz"
+    broken.write_bytes(b"not an artifact")
+    monkeypatch.setenv("RENT_FORECAST_MODEL", str(broken))
+    forecast.load_from_env()
+    assert forecast.current() == None
+
+    path = str(tmp_path / "rent_forecast.npz")
+    model.save(path)
+    monkeypatch.setenv("RENT_FORECAST_MODEL", path)
+    forecast.load_from_env()
+    assert forecast.current().codes == model.codes
+
+
+def test_forecast_endpoints(client, model, monkeypatch):
+    monkeypatch.setattr(forecast, "_current", None)
+    assert client.get("/rent_forecast/Houston").status_code == 503
+
+    monkeypatch.setattr(forecast, "_current", model)
+    body = client.get("/rent_forecast/houston?months=6").json()
+    assert body["city_code"] == "Houston" and body["months"] == model.labels[:6]
+    assert body["forecast"] == np.round(model.forecast("Houston", 6), 2).tolist()
+    assert client.get("/rent_forecast/Boise").status_code == 404
+    assert client.get("/rent_forecast/Hoston").json()["detail"]["suggestions"] == ["Houston"]
+    assert client.get("/rent_forecast/Houston?months=25").status_code == 422
+
+    every = client.get("/rent_forecast?months=2").json()
+    assert list(every["forecasts"]) == ["Houston", "Denver"] and len(every["forecasts"]["Denver"]) == 2
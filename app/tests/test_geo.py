@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from app import geo
+
+
+@pytest.fixture(scope="module")
+def index(snap):
+    return geo.GeoIndex(snap)
+
+
+def codes(snap, rows):
+    return [snap.cities[row]["city_code"] for row in rows]
+
+
+def test_index_holds_supported_cities_with_coordinates(snap, index):
+    # no Springfield (inactive), Anchorage (no coordinates) or the second Chicago row
+    assert len(index) == len(snap.supported) - 1
+    rows, _, _ = index.near(39.78, -89.65, 1, 10)
+    assert codes(snap, rows) == []
+
+
+def test_near_matches_a_brute_force_scan(snap, index):
+    lats, lons = snap.coords[:, 0], snap.coords[:, 1]
+    for lat, lon, radius in [(38.627, -90.199, 400), (39.1, -94.6, 10), (37.0, -120.0, 800), (0.0, 0.0, 2000)]:
+        rows, distances, count = index.near(lat, lon, radius, 3)
+        dist = geo.haversine_km(lat, lon, lats, lons)
+        within = [row for row in snap.supported.tolist() if dist[row] <= radius]
+        expected = sorted(within, key=lambda row: (dist[row], row))
+        assert count == len(within)
+        assert rows.tolist() == expected[:3]
+        assert np.allclose(distances, dist[expected[:3]])
+
+
+def test_near_nearest_first(snap, index):
+    rows, distances, count = index.near(39.1, -94.6, 10, 25)
+    assert codes(snap, rows) == ["Kansas_City", "Kansas_City_KS"]
+    assert count == 2 and distances[0] <= distances[1]
+
+
+def test_bbox_most_populous_first(snap, index):
+    rows, count = index.bbox(36, -95, 41, -89, 1)
+    assert count == 3
+    assert codes(snap, rows) == ["Kansas_City"]
+    rows, _ = index.bbox(36, -95, 41, -89, 10)
+    assert codes(snap, rows) == ["Kansas_City", "St_Louis", "Kansas_City_KS"]
+
+
+def test_bbox_across_the_antimeridian(snap, index):
+    rows, count = index.bbox(10, 170, 30, -150, 10)
+    assert codes(snap, rows) == ["Honolulu"] and count == 1
+    # the same edges the other way round: everything but the Pacific
+    rows, count = index.bbox(10, -150, 30, 170, 10)
+    assert codes(snap, rows) == ["Houston"] and count == 1
+
+
+def test_haversine_km():
+    # one degree of latitude
+    assert geo.haversine_km(0.0, 0.0, np.array([1.0]), np.array([0.0]))[0] == pytest.approx(geo.KM_PER_DEGREE)
+    assert geo.haversine_km(10.0, 179.5, np.array([10.0]), np.array([-179.5]))[0] < 110
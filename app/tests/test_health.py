@@ -0,0 +1,63 @@
+import logging
+import threading
+import time
+
+import pytest
+
+from app import ml, snapshot, snapshot_file
+
+
+@pytest.fixture
+def not_ready(client, snap, monkeypatch):
+    # a worker that has not loaded a snapshot yet
+    monkeypatch.setattr(snapshot, "_ready", threading.Event())
+    yield
+    snapshot.swap(snap)
+
+
+def test_readyz_answers_503_until_the_warm_up_is_done(client, snap, snap_path, not_ready, monkeypatch):
+    release = threading.Event()
+    read_snapshot = snapshot_file.read_snapshot
+
+    def slow_read(path):
+        release.wait(5)
+        return read_snapshot(path)
+
+    monkeypatch.setattr(snapshot_file, "read_snapshot", slow_read)
+    monkeypatch.setenv("SNAPSHOT_FILE", snap_path)
+    warm_up = threading.Thread(target=ml.warm_up)
+    warm_up.start()
+    try:
+        response = client.get("/readyz")
+        assert response.status_code == 503 and response.json()["detail"]["ok"] == False
+        # liveness does not wait for the data
+        assert client.get("/healthz").json() == {"ok": True}
+    finally:
+        release.set()
+        warm_up.join(5)
+
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["ok"] and body["version"] == snap.version and body["cities"] == len(snap)
+    assert body["loaded_at"] == snap.loaded_at
+
+
+def test_wait_ready(client, snap, not_ready, monkeypatch, caplog):
+    monkeypatch.setenv("STARTUP_READY_TIMEOUT", "0")
+    started = time.monotonic()
+    ml.wait_ready()
+    assert time.monotonic() - started < 0.05
+
+    monkeypatch.setenv("STARTUP_READY_TIMEOUT", "0.1")
+    with caplog.at_level(logging.ERROR, logger="app.ml"):
+        started = time.monotonic()
+        ml.wait_ready()
+    assert time.monotonic() - started >= 0.1 and "not loaded after 0.1s" in caplog.text
+
+    # returns as soon as a snapshot is swapped in
+    threading.Timer(0.05, snapshot.swap, (snap,)).start()
+    monkeypatch.setenv("STARTUP_READY_TIMEOUT", "5")
+    started = time.monotonic()
+    ml.wait_ready()
+    assert snapshot.ready() and time.monotonic() - started < 1
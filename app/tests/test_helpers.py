@@ -0,0 +1,40 @@
+import itertools
+
+import numpy as np
+
+from app import scoring
+from app.helpers import calc_wghtd_city_score, calc_wghtd_city_scores
+from app.scoring import DIMENSIONS
+
+# the undecorated helper, so the sweep is not timed into the metrics
+single_city_score = getattr(calc_wghtd_city_score, "__wrapped__", calc_wghtd_city_score)
+
+
+def test_batch_scores_match_single_city_scores():
+    profiles = [dict(zip(DIMENSIONS, profile)) for profile in scoring.PROFILE_SCORES.tolist()]
+    mismatches = 0
+    for weights in itertools.product(range(scoring.WEIGHT_LEVELS), repeat=len(DIMENSIONS)):
+        if sum(weights) == 0:
+            continue
+        weights = dict(zip(DIMENSIONS, weights))
+        batch = calc_wghtd_city_scores(scoring.PROFILE_SCORES, weights).tolist()
+        single = [single_city_score(scores, weights) for scores in profiles]
+        mismatches += sum(a != b for a, b in zip(batch, single))
+    assert mismatches == 0
+
+
+def test_batch_scores_round_like_python():
+    # 4*3 + 5*7 + 4*2 + 4*8 = 87 over 20: the double 4.35 is just below
+    # 4.35, so Python rounds it to 4.3 where np.round gives 4.4
+    weights = {"crime": 3, "walk": 7, "air": 2, "rent": 8}
+    scores = np.array([[4, 5, 4, 4]])
+    assert np.round(87 / 20, 1) == 4.4
+    assert calc_wghtd_city_score(dict(zip(DIMENSIONS, scores[0].tolist())), weights) == 4.3
+    assert calc_wghtd_city_scores(scores, weights).tolist() == [4.3]
+
+
+def test_batch_scores_with_non_integer_weights():
+    weights = {"crime": 0.5, "walk": 2.25, "air": 1, "rent": 12}
+    scores = scoring.PROFILE_SCORES[::7]
+    expected = [calc_wghtd_city_score(dict(zip(DIMENSIONS, row)), weights) for row in scores.tolist()]
+    assert calc_wghtd_city_scores(scores, weights).tolist() == expected
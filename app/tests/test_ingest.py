@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.ingest import air, common, crime, rent, walk
+
+
+@pytest.fixture
+def cities():
+    return pd.DataFrame([
+        (1, "New York City", "NY", "New_York_City"),
+        (2, "Dallas",        "TX", "Dallas"),
+        (3, "Fort Worth",    "TX", "Fort_Worth"),
+        (4, "Kansas City",   "MO", "Kansas_City"),
+        (5, "Kansas City",   "KS", "Kansas_City_KS"),
+        (6, "St. Louis",     "MO", "St_Louis"),
+        (7, "Boston",        "MA", "Boston"),
+    ], columns=["id", "city", "state", "city_code"])
+
+
+def test_normalize_names():
+    names = pd.Series(["Boston5,", "Saint Louis", "Fort  Worth!", None, "São Paulo"])
+    assert common.normalize_names(names).tolist() == ["boston", "st louis", "ft worth", "", "sao paulo"]
+
+
+def test_metro_cities_names_every_part_in_every_state():
+    metros = common.metro_cities(pd.Series(["Dallas-Fort Worth-Arlington, TX", "Kansas City, MO-KS", "New York, NY"]))
+    assert sorted(zip(metros.index, metros["name"], metros["state"])) == [
+        (0, "arlington", "TX"), (0, "dallas", "TX"), (0, "dallas ft worth arlington", "TX"), (0, "ft worth", "TX"),
+        (1, "kansas city", "KS"), (1, "kansas city", "MO"),
+        (2, "new york city", "NY"),
+    ]
+
+
+def test_match_cities(cities):
+    matched = common.match_cities(pd.Series(["st louis", "Kansas City", "Nowhere"]), pd.Series(["mo", "KS", "TX"]),
+                                  common.city_lookup(cities))
+    assert matched["city_code"].tolist()[:2] == ["St_Louis", "Kansas_City_KS"]
+    assert matched["city_id"].tolist()[:2] == [6, 5] and matched.iloc[2].isna().all()
+
+
+def test_impute_property_crime_uses_the_population_decile_ratio():
+    # ten deciles of two cities: one reporting a property/violent ratio of
+    # i + 1, the next largest missing its property crime count
+    df = pd.DataFrame({"population":     [pop for i in range(10) for pop in (1000 * (i + 1), 1000 * (i + 1) + 1)],
+                       "violent_crime":  [10, 20] * 10,
+                       "property_crime": [value for i in range(10) for value in (10 * (i + 1), np.nan)]})
+    imputed = crime.impute_property_crime(df)
+    assert imputed[0::2].tolist() == df["property_crime"][0::2].tolist()
+    assert imputed[1::2].tolist() == [20 * (i + 1) for i in range(10)]
+
+
+def test_scaled_crime_rates():
+    df = pd.DataFrame({"population":     [1000, 2000, 4000, 0],
+                       "violent_crime":  [10,   10,   10,   5],
+                       "property_crime": [40,   40,   40,   5]})
+    rates = crime.scaled_crime_rates(df)
+    # combined rates 1600, 800 and 400 per 100,000; no rate without a population
+    assert rates[:3].tolist() == pytest.approx([1.0, 1 / 3, 0.0])
+    assert np.isnan(rates[3])
+
+
+def test_build_crime_table_keeps_each_city_latest_year(cities, tmp_path):
+    # population, violent crime and property crime, the other counts zero
+    rows = [
+        ("NEW YORK",      "New York", "8,000,000", "40,000", "100,000", "NY", 2018),
+        ("NEW YORK",      "New York", "8,000,000", "30,000", "90,000",  "NY", 2019),
+        ("MASSACHUSETTS", "Boston5,", "690,000",   "5,000",  "",        "MA", 2019),
+        ("MISSOURI",      "St. Louis", "300,000",  "6,000",  "18,000",  "MO", 2019),
+        ("TEXAS",         "Nowhere",  "1,000",     "1",      "1",       "TX", 2019),
+    ]
+    others = [col for col in crime.COUNT_COLUMNS if col not in ("population", "violent_crime", "property_crime")]
+    path = tmp_path / "ucr.csv"
+    path.write_text("state,city,population,violent_crime,property_crime,state_abbr,year," + ",".join(others) + "\n"
+                    + "".join(",".join(f'"{value}"' for value in row) + ",0" * len(others) + "\n" for row in rows))
+
+    table = crime.build_crime_table(str(path), cities, chunksize=2).set_index("city_code")
+    assert sorted(table.index) == ["Boston", "New_York_City", "St_Louis"]
+    assert table.loc["New_York_City", "violent_crime"] == 30000
+    # three cities are three deciles, so Boston has no peer to estimate from
+    assert table.loc["Boston", "city_id"] == 7 and pd.isna(table.loc["Boston", "property_crime"])
+    assert np.isnan(table.loc["Boston", "combined_scaled_rate"])
+    # St. Louis has the highest combined rate, New York the lowest
+    assert table.loc["St_Louis", "combined_scaled_rate"] == 1.0
+    assert table.loc["New_York_City", "combined_scaled_rate"] == 0.0
+
+
+def test_build_air_quality(cities):
+    factbook = pd.DataFrame({
+        "cbsa":       ["Dallas-Fort Worth-Arlington, TX", "Kansas City, MO-KS", "St. Louis, MO-IL", "Nowhere, ZZ"],
+        "cbsa_code":  [19100, 28140, 41180, 99999],
+        "population": [7e6, 2e6, 2.8e6, 1e4],
+        "PM2.5":      [9.0, np.nan, 10.0, 5.0],
+        "O3":         [0.07, 0.06, np.nan, 0.05],
+    })
+    rows = air.build_air_quality(factbook, cities)
+    assert rows.columns.tolist() == air.TABLE_COLUMNS
+    assert rows["city_code"].tolist() == ["Dallas", "Fort_Worth", "Kansas_City", "Kansas_City_KS", "St_Louis"]
+    # missing values take the matched cities' mean
+    by_code = rows.set_index("city_code")
+    assert by_code.loc["Kansas_City", "PM2.5"] == pytest.approx((9.0 * 2 + 10.0) / 3)
+    assert by_code.loc["St_Louis", "O3"] == pytest.approx((0.07 * 2 + 0.06 * 2) / 4)
+    assert (rows["Combined Total"] == rows["PM2.5 Scaled"] + rows["O3 Scaled"]).all()
+    assert rows[["PM2.5 Scaled", "O3 Scaled"]].std(ddof=0).tolist() == pytest.approx([1.0, 1.0])
+
+
+def test_air_quality_crosswalk_and_most_populous_cbsa(cities):
+    factbook = pd.DataFrame({"cbsa": ["Boston-Cambridge, MA", "Cambridge, MA"], "cbsa_code": [14460, 1],
+                             "population": [4e6, 1e5], "PM2.5": [7.0, 8.0], "O3": [0.05, 0.06]})
+    crosswalk = pd.DataFrame({"cbsa_code": [1, 1], "city_code": ["Boston", "Nowhere"]})
+    table = air.cbsa_city_table(factbook, cities, crosswalk)
+    assert table["city_code"].tolist() == ["Boston"] and table["region"].tolist() == [0]
+
+
+def test_air_quality_edges_skip_zero_totals():
+    assert air.quantile_edges([0, 1, 2, 3, 4, 5]).tolist() == pytest.approx([1.0, 1.8, 2.6, 3.4, 4.2, 5.0])
+
+
+def test_read_factbook_csv(tmp_path):
+    path = tmp_path / "factbook.csv"
+    path.write_text("Air Quality Statistics by CBSA,,,,\n"
+                    "Core Based Statistical Area (CBSA),CBSA Code,2019 Population,PM2.5  Wtd AM (µg/m3),O3 8-hr (ppm)\n"
+                    "\"Dallas-Fort Worth-Arlington, TX\",19100,7573136,8.1,0.077\n"
+                    "\"Boston-Cambridge-Newton, MA-NH\",14460,4873019,ND,0.061\n"
+                    "Notes: ND = no data,,,,\n", encoding="utf-8")
+    df = air.read_factbook(str(path))
+    assert df["cbsa_code"].tolist() == [19100, 14460]
+    assert df["PM2.5"].tolist()[0] == 8.1 and np.isnan(df["PM2.5"].tolist()[1])
+
+
+def test_build_rent_history(cities):
+    zori = pd.DataFrame({"RegionName": ["New York, NY", "Dallas-Fort Worth, TX", "Boston, MA"],
+                         "SizeRank": [1, 0, 2],
+                         "2019-01": [2500., 1200., np.nan],
+                         "2019-02-28": [2510., 1210., 2000.]})
+    rows = rent.build_rent_history(zori, cities)
+    assert rows.columns.tolist() == rent.TABLE_COLUMNS
+    assert [(code, str(month), value) for code, month, value in rows.itertuples(index=False)] == [
+        ("Boston",        "2019-02-01", 2000.),
+        ("Dallas",        "2019-01-01", 1200.), ("Dallas",        "2019-02-01", 1210.),
+        ("Fort_Worth",    "2019-01-01", 1200.), ("Fort_Worth",    "2019-02-01", 1210.),
+        ("New_York_City", "2019-01-01", 2500.), ("New_York_City", "2019-02-01", 2510.),
+    ]
+    with pytest.raises(ValueError):
+        rent.build_rent_history(zori[["RegionName"]], cities)
+
+
+def test_validate_walk_scores(cities):
+    df = pd.DataFrame({
+        "city_id":    ["1", "2", "99", "3", "3", "7", "6", "4"],
+        "state":      ["ny", "TX", "TX", "TX", "TX", "MA", "MO", "KS"],
+        "city_name":  ["New York City", "Dallas", "X", "Fort Worth", "Ft Worth", "Boston", "St. Louis", "Kansas City"],
+        "walk_score": ["88", "101", "50", "35", "36", "4.5", "80", "40"],
+    })
+    rows, rejected = walk.validate_walk_scores(df, cities)
+    # unknown id, a score over 100, a fractional score and a state mismatch
+    assert rejected == 4
+    assert rows.columns.tolist() == walk.TABLE_COLUMNS
+    # a city listed twice keeps its last row
+    assert rows.values.tolist() == [[1, "NY", "New_York_City", 88], [3, "TX", "Fort_Worth", 36],
+                                    [6, "MO", "St_Louis", 80]]
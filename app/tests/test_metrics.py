@@ -0,0 +1,45 @@
+from app import metrics
+
+
+def request_counts(client):
+    # count of each (method, route, status) series in /metrics
+    counts = {}
+    for line in client.get("/metrics").text.splitlines():
+        if line.startswith("cityspire_request_duration_seconds_count{"):
+            labels, value = line[len("cityspire_request_duration_seconds_count{"):].split("} ")
+            counts[labels] = int(value)
+    return counts
+
+
+def test_requests_are_labelled_with_their_route(client):
+    before = request_counts(client)
+    client.post("/city_scr/batch", json={"city_codes": ["Houston"]})
+    client.get("/city_scr/Houston")
+    client.get("/city_scr/Not_A_City")
+    client.delete("/city_scr/Houston")
+    client.get("/no/such/path")
+    after = request_counts(client)
+
+    changed = {labels: after[labels] - before.get(labels, 0) for labels in after
+               if after[labels] != before.get(labels) and 'route="/metrics"' not in labels}
+    assert changed == {
+        'method="POST",route="/city_scr/batch",status="200"': 1,
+        'method="GET",route="/city_scr/{city}",status="200"': 1,
+        'method="GET",route="/city_scr/{city}",status="404"': 1,
+        'method="DELETE",route="/city_scr/{city}",status="405"': 1,
+        'method="GET",route="unmatched",status="404"': 1,
+    }
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_seconds", "Test latency.", ("name",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(("a",), value)
+    lines = histogram.render()
+    assert lines[2:] == [
+        'test_seconds_bucket{name="a",le="0.1"} 1',
+        'test_seconds_bucket{name="a",le="1.0"} 2',
+        'test_seconds_bucket{name="a",le="+Inf"} 3',
+        'test_seconds_sum{name="a"} 5.55',
+        'test_seconds_count{name="a"} 3',
+    ]
@@ -0,0 +1,215 @@
+from urllib.parse import parse_qs, urlparse
+
+from fastapi import HTTPException
+import pytest
+
+from app import ml
+from app.helpers import calc_wghtd_city_score
+from app.scoring import DIMENSIONS
+from app.tests.conftest import CITY_ROWS, SUPPORTED
+
+# /cities lists every active row, in id order
+ACTIVE_IDS = [row[0] for row in CITY_ROWS if row[5] == "yes"]
+
+WEIGHTS = [
+    {"crime": 5, "walk": 5, "air": 5, "rent": 5},
+    {"crime": 3, "walk": 7, "air": 2, "rent": 8},
+    {"crime": 10, "walk": 0, "air": 0, "rent": 1},
+    {"crime": 0, "walk": 9, "air": 4, "rent": 6},
+]
+
+
+def query(weights):
+    return "&".join(f"{dim}={value}" for dim, value in weights.items())
+
+
+@pytest.mark.parametrize("weights", WEIGHTS)
+def test_single_and_batch_scores_agree(client, weights):
+    single = {code: client.get(f"/city_scr/{code}?{query(weights)}").json().get("score") for code in SUPPORTED}
+    profile = {code: client.get(f"/city/{code}?{query(weights)}").json().get("score") for code in SUPPORTED}
+    batch = client.post("/city_scr/batch", json={"city_codes": SUPPORTED, "weights": weights}).json()
+    ranked = client.get(f"/rankings?{query(weights)}&limit=1000").json()["cities"]
+
+    assert profile == single
+    assert {city["city_code"]: city["score"] for city in batch["scores"]} == single
+    assert ranked and all(city["score"] == single[city["city_code"]] for city in ranked)
+    # only cities with every score are ranked; Boise has no air quality
+    assert "Boise" not in [city["city_code"] for city in ranked]
+
+
+def test_batch_reports_errors_per_city(client):
+    batch = client.post("/city_scr/batch", json={"city_codes": ["Houston", "Not_A_City", "Boise"]}).json()
+    assert batch["ok"] and [city["city_code"] for city in batch["scores"]] == ["Houston", "Not_A_City", "Boise"]
+    houston, unknown, boise = batch["scores"]
+    assert houston["ok"] and houston["score"] == client.get("/city_scr/Houston").json()["score"]
+    assert not unknown["ok"] and unknown["score"] == None and unknown["error"] != None
+    # Boise has no air quality
+    assert not boise["ok"] and boise["error"].startswith("air score")
+
+    zero = {"crime": 0, "walk": 0, "air": 0, "rent": 0}
+    assert client.post("/city_scr/batch", json={"city_codes": ["Houston"], "weights": zero}).status_code == 400
+    assert client.post("/city_scr/batch", json={"city_codes": ["Houston"], "weights": {"crime": 11}}).status_code == 422
+
+
+def test_rankings_limit_is_bounded(client):
+    assert client.get("/rankings?limit=1000").status_code == 200
+    assert client.get("/rankings?limit=1001").status_code == 422
+    assert client.get("/rankings?limit=0").status_code == 422
+
+
+def brute_force_rankings(snap, weights, state=None):
+    """
+    brute_force_rankings scores every ranked city with
+    calc_wghtd_city_score and sorts them best first, ties by snapshot row
+    """
+    ranked = []
+    for row in snap.supported.tolist():
+        scores = {dim: snap.get_score(row, dim) for dim in DIMENSIONS}
+        if None in scores.values() or (state != None and snap.states[row] != state):
+            continue
+        exact = sum(scores[dim] * weights[dim] for dim in DIMENSIONS) / sum(weights.values())
+        ranked.append((-exact, row, calc_wghtd_city_score(scores, weights)))
+    return [(snap.codes[row], score) for _, row, score in sorted(ranked)]
+
+
+@pytest.mark.parametrize("weights", WEIGHTS + [{"crime": 1, "walk": 0, "air": 0, "rent": 0}])
+def test_rankings_match_a_brute_force_sort(client, snap, weights):
+    expected = brute_force_rankings(snap, weights)
+    # a single dimension ties most cities, which keep snapshot row order
+    assert len(set(score for _, score in expected)) < len(expected)
+    for limit in (1, 3, 5, 1000):
+        ranked = client.get(f"/rankings?{query(weights)}&limit={limit}").json()["cities"]
+        assert [(city["city_code"], city["score"]) for city in ranked] == expected[:limit]
+    for state in ("CA", "TX", "MO"):
+        ranked = client.get(f"/rankings?{query(weights)}&state={state.lower()}&limit=1000").json()["cities"]
+        assert [(city["city_code"], city["score"]) for city in ranked] == brute_force_rankings(snap, weights, state)
+
+
+def test_rankings_best_first_within_a_state(client):
+    ranked = client.get("/rankings?state=ca").json()["cities"]
+    assert [city["rank"] for city in ranked] == [1, 2, 3]
+    assert {city["city_code"] for city in ranked} == {"Los_Angeles", "San_Francisco", "San_Diego"}
+    assert [city["score"] for city in ranked] == sorted((city["score"] for city in ranked), reverse=True)
+    assert len(client.get("/rankings?limit=2").json()["cities"]) == 2
+    assert client.get("/rankings?state=ZZ").json()["cities"] == []
+
+
+def test_city_profile_reports_missing_data_per_field(client, snap):
+    houston = client.get("/city/Houston").json()
+    assert houston["ok"] and houston["city"] == {"id": 4, "city": "Houston", "state": "TX", "city_code": "Houston"}
+    assert houston["population"] == 2320268 and houston["rent"]["avg_rent"] == 1300.
+    assert houston["walk"]["score"] == snap.get_score(snap.row("Houston"), "walk")
+    assert houston["score"] == client.get("/city_scr/Houston").json()["score"]
+
+    boise = client.get("/city/Boise").json()
+    assert boise["ok"] and boise["air"]["score"] == None and boise["air"]["error"] != None
+    assert boise["crime"]["score"] == 5 and boise["score"] == None and boise["score_error"] != None
+
+
+def test_cities_lists_active_cities_in_id_order(client):
+    cities = client.get("/cities").json()
+    assert [city["id"] for city in cities] == ACTIVE_IDS
+    assert list(cities[0]) == ["id", "city", "state", "city_code"]
+
+
+def test_cities_pages_follow_the_link_header(client):
+    full = client.get("/cities?fields=city_code,lat,lon,population").json()
+    pages, url = [], "/cities?page_size=4&fields=city_code,lat,lon,population"
+    while url != None:
+        response = client.get(url)
+        assert response.status_code == 200
+        pages.append(response.json())
+        link = response.headers.get("link")
+        url = None if link == None else link[link.index("<") + 1:link.index(">")]
+        if url != None:
+            # the cursor is the id of the page's last city
+            params = parse_qs(urlparse(url).query)
+            assert params == {"cursor": [str(ACTIVE_IDS[4 * len(pages) - 1])], "page_size": ["4"],
+                              "fields": ["city_code,lat,lon,population"]}
+
+    assert [len(page) for page in pages] == [4, 4, 4, 3]
+    assert [city for page in pages for city in page] == full
+    anchorage = [city for city in full if city["city_code"] == "Anchorage"][0]
+    assert anchorage == {"city_code": "Anchorage", "lat": None, "lon": None, "population": None}
+
+
+def test_cities_cursor_is_the_previous_last_id(client):
+    page = client.get(f"/cities?cursor={ACTIVE_IDS[2]}&page_size=2").json()
+    assert [city["id"] for city in page] == ACTIVE_IDS[3:5]
+    # a cursor between ids starts after it, as after a reload removed that city
+    page = client.get("/cities?cursor=11&page_size=2").json()
+    assert [city["id"] for city in page] == [12, 13]
+    last = client.get(f"/cities?cursor={ACTIVE_IDS[-2]}&page_size=100")
+    assert [city["id"] for city in last.json()] == ACTIVE_IDS[-1:] and "link" not in last.headers
+
+
+@pytest.mark.parametrize("path, status", [
+    ("/cities?cursor=abc", 400),
+    ("/cities?fields=city,secret", 400),
+    ("/cities?page_size=0", 422),
+    ("/cities?page_size=1001", 422),
+])
+def test_cities_rejects_bad_paging(client, path, status):
+    assert client.get(path).status_code == status
+
+
+def test_cities_autocomplete(client):
+    assert [city["city_code"] for city in client.get("/cities?q=san").json()] == ["San_Diego", "San_Francisco"]
+    assert client.get("/cities?q=zzz").json() == []
+
+
+def test_unknown_city_suggests_close_names(client):
+    response = client.get("/city_scr/Hoston")
+    assert response.status_code == 404
+    assert response.json()["detail"]["suggestions"] == ["Houston"]
+    assert client.get("/city/Hoston").json()["detail"]["suggestions"] == ["Houston"]
+    assert client.get("/city_scr/saint%20louis").json()["score"] == client.get("/city_scr/St_Louis").json()["score"]
+
+
+def test_shared_city_names_list_their_cities(client):
+    response = client.get("/city_scr/kansas%20city")
+    assert response.status_code == 404
+    assert response.json()["detail"]["suggestions"] == ["Kansas_City", "Kansas_City_KS"]
+    assert client.get("/city/Kansas%20City").json()["detail"]["suggestions"] == ["Kansas_City", "Kansas_City_KS"]
+    assert client.get("/city_scr/kansas%20city,%20mo").json()["score"] == client.get("/city_scr/Kansas_City").json()["score"]
+
+
+def test_near_and_bbox_endpoints(client):
+    near = client.get("/cities/near?lat=39.1&lon=-94.6&radius_km=10").json()
+    assert near["count"] == 2
+    assert [city["city_code"] for city in near["cities"]] == ["Kansas_City", "Kansas_City_KS"]
+    assert near["cities"][0]["scores"] == {"crime": 1, "walk": 2, "air": 5, "rent": 5}
+
+    box = client.get("/cities/bbox?south=36&west=-95&north=41&east=-89&limit=2").json()
+    assert box["count"] == 3
+    assert [city["city_code"] for city in box["cities"]] == ["Kansas_City", "St_Louis"]
+    assert client.get("/cities/bbox?south=41&west=-95&north=36&east=-89").status_code == 400
+
+
+@pytest.fixture
+def no_database(client):
+    # whatever DATABASE_URL says, answer like a server without a database
+    def unavailable():
+        raise HTTPException(status_code=503, detail={"error": "database unavailable"})
+    client.app.dependency_overrides[ml.get_db_conn] = unavailable
+    yield
+    client.app.dependency_overrides.clear()
+
+
+def test_admin_refresh_needs_the_admin_token(client, no_database, monkeypatch):
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    assert client.post("/admin/refresh").status_code == 403
+
+    monkeypatch.setenv("ADMIN_TOKEN", "s3cret")
+    assert client.post("/admin/refresh").status_code == 401
+    assert client.post("/admin/refresh", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert client.post("/admin/refresh", headers={"Authorization": "Basic s3cret"}).status_code == 401
+    # accepted, then fails for want of a database
+    assert client.post("/admin/refresh", headers={"Authorization": "Bearer s3cret"}).status_code == 503
+
+
+def test_admin_refresh_rejects_concurrent_calls(client, no_database, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "s3cret")
+    with ml._admin_refresh_lock:
+        assert client.post("/admin/refresh", headers={"Authorization": "Bearer s3cret"}).status_code == 409
+    assert client.post("/admin/refresh", headers={"Authorization": "Bearer s3cret"}).status_code == 503
@@ -0,0 +1,157 @@
+from datetime import datetime, timezone
+import socket
+
+import psycopg2
+import psycopg2.errors
+import pytest
+
+from app import refresher, snapshot
+from app.refresher import SnapshotRefresher
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append((sql, params))
+        answer = self.conn.answers.get(sql)
+        if isinstance(answer, Exception):
+            raise answer
+        self.rows = answer
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def close(self):
+        pass
+
+
+class FakeConn:
+    """
+    FakeConn answers each SQL statement with the rows (or exception) in
+    answers; once its socket is readable, poll() finds it closed
+    """
+
+    def __init__(self, answers=None):
+        self.answers  = answers or {}
+        self.executed = []
+        self.closed   = False
+        self.sock, self.peer = socket.socketpair()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def poll(self):
+        raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+        self.peer.close()
+
+
+T1 = datetime(2021, 3, 1, tzinfo=timezone.utc)
+T2 = datetime(2021, 3, 2, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def served(snap, monkeypatch):
+    # record the reloads instead of running them
+    reloads = []
+    monkeypatch.setattr(snapshot, "_current", snap)
+    monkeypatch.setattr(snapshot, "refresh", lambda conn: reloads.append(None) or {"error": None})
+    monkeypatch.setattr(snapshot, "refresh_cities", lambda conn, codes: reloads.append(codes) or {"error": None})
+    return reloads
+
+
+def test_changed_since_advances_the_watermark():
+    conn = FakeConn({refresher.CHANGED_SINCE_SQL: [("Houston", T1), ("Denver", T2), (None, T1)]})
+    watcher = SnapshotRefresher(None)
+    assert watcher._changed_since(conn) == {"Houston", "Denver"} and watcher.watermark == T2
+    assert conn.executed[-1][1] == {"since": refresher.EPOCH}
+
+    conn.answers[refresher.CHANGED_SINCE_SQL] = []
+    assert watcher._changed_since(conn) == set() and watcher.watermark == T2
+    assert conn.executed[-1][1] == {"since": T2}
+
+
+def test_apply_reloads_notified_and_polled_cities(served):
+    conn = FakeConn({refresher.CHANGED_SINCE_SQL: [("Denver", T2)]})
+    watcher = SnapshotRefresher(None)
+    watcher.watermark = T1
+    watcher._apply(conn, {"Houston"})
+    assert served == [{"Houston", "Denver"}] and watcher.watermark == T2
+
+
+def test_apply_reloads_everything_when_most_cities_changed(snap, served):
+    conn = FakeConn({refresher.CHANGED_SINCE_SQL: [], refresher.WATERMARK_SQL: [(T2,)]})
+    watcher = SnapshotRefresher(None)
+    watcher._apply(conn, set(snap.codes[:len(snap) // 2 + 1].tolist()))
+    # a full reload reads the watermark it starts from
+    watcher._apply(conn, None)
+    assert served == [None, None] and watcher.watermark == T2
+
+
+def test_apply_stops_polling_without_updated_at_columns(served):
+    conn = FakeConn({refresher.WATERMARK_SQL: psycopg2.errors.UndefinedColumn("updated_at")})
+    watcher = SnapshotRefresher(None)
+    watcher._apply(conn, None)
+    assert not watcher.polling and watcher.watermark == None
+    # notifications are still applied, without asking for changed rows
+    watcher._apply(conn, {"Houston"})
+    assert served == [None, {"Houston"}]
+    assert refresher.CHANGED_SINCE_SQL not in [sql for sql, _ in conn.executed]
+
+
+def test_apply_raises_when_the_reload_fails(served, monkeypatch):
+    monkeypatch.setattr(snapshot, "refresh_cities", lambda conn, codes: {"error": "boom"})
+    with pytest.raises(RuntimeError):
+        SnapshotRefresher(None)._apply(FakeConn({refresher.CHANGED_SINCE_SQL: []}), {"Houston"})
+
+
+class FakeSession:
+    """
+    FakeSession hands out the passed connections in turn, raising for
+    None
+    """
+
+    def __init__(self, conns):
+        self.conns    = list(conns)
+        self.returned = []
+
+    def getconn(self):
+        conn = self.conns.pop(0)
+        if conn == None:
+            raise psycopg2.OperationalError("could not connect to server")
+        return conn
+
+    def putconn(self, conn):
+        self.returned.append(conn)
+
+
+def test_reconnects_back_off_exponentially_up_to_a_cap(monkeypatch):
+    conn = FakeConn()
+    conn.peer.send(b"x")
+    sess = FakeSession([None, None, conn, None, None, None])
+    watcher = SnapshotRefresher(sess, backoff=1.0, max_backoff=3.0)
+    monkeypatch.setattr(watcher, "_catch_up", lambda conn: None)
+
+    waits = []
+
+    def wait(timeout):
+        waits.append(timeout)
+        if len(waits) == 6:
+            watcher.stopped.set()
+    monkeypatch.setattr(watcher.stopped, "wait", wait)
+
+    watcher._run()
+    # a connection that caught up starts the backoff over when it is lost
+    assert waits == [1.0, 2.0, 1.0, 2.0, 3.0, 3.0]
+    assert sess.returned == [conn] and conn.closed
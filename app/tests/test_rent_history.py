@@ -0,0 +1,80 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from app import rent_history
+from app.rent_history import parse_month
+
+# Houston 2019-01 to 2020-12 at 1000 + the month's index, Denver's
+# rents start in 2020-01; Boise has no rents at all
+ROWS = ([("Houston", date(2019 + i // 12, i % 12 + 1, 1), 1000. + i) for i in range(24)]
+        + [("Denver", date(2020, month, 1), 1500.) for month in range(1, 13)])
+
+
+@pytest.fixture(scope="module")
+def history():
+    return rent_history.build_history(ROWS)
+
+
+@pytest.fixture
+def served(client, history, monkeypatch):
+    monkeypatch.setattr(rent_history, "_current", history)
+    return history
+
+
+def test_parse_month():
+    assert parse_month("2019-01") == 2019 * 12 and parse_month("2019-12-31") == 2019 * 12 + 11
+    assert [parse_month(text) for text in ("2019-13", "2019/01", "2019-1", "19-01", "")] == [None] * 5
+
+
+def test_series_and_year_over_year_change(history):
+    months, rents, yoy = history.series("Houston")
+    assert months[0] == "2019-01" and months[-1] == "2020-12" and len(rents) == 24
+    assert np.isnan(yoy[:12]).all() and yoy[12] == pytest.approx(12 / 1000, abs=1e-6)
+    # a city's months are trimmed to those with a rent
+    assert history.series("Denver")[0] == ["2020-{m:02d}".format(m=m) for m in range(1, 13)]
+    assert history.series("Boise") == None
+
+
+@pytest.mark.parametrize("start, end, expected", [
+    ("2019-06", "2019-08", ["2019-06", "2019-07", "2019-08"]),
+    ("2000-01", "2019-02", ["2019-01", "2019-02"]),
+    ("2020-11", "2030-01", ["2020-11", "2020-12"]),
+    ("2020-12", "2020-12", ["2020-12"]),
+    ("2000-01", "2018-12", None),
+    ("2000-01", "2018-06", None),
+    ("2021-01", "2030-01", None),
+    ("2030-01", "2030-06", None),
+])
+def test_series_range_edges(history, start, end, expected):
+    series = history.series("Houston", parse_month(start), parse_month(end))
+    assert (None if series == None else series[0]) == expected
+
+
+def test_history_endpoint(client, served):
+    response = client.get("/rent_rate/Houston/history?from=2020-11")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["city_code"] == "Houston" and body["months"] == ["2020-11", "2020-12"]
+    assert body["rents"] == [1022., 1023.] and body["latest_yoy"] == pytest.approx(12 / 1011, abs=1e-4)
+    assert client.get("/rent_rate/houston/history").json()["months"][0] == "2019-01"
+
+
+@pytest.mark.parametrize("query, status", [
+    ("?from=2000-01&to=2018-06", 404),
+    ("?from=2030-01", 404),
+    ("?from=2020-06&to=2020-01", 400),
+    ("?from=2020-13", 400),
+    ("?to=2020", 400),
+])
+def test_history_endpoint_rejects_bad_and_empty_ranges(client, served, query, status):
+    assert client.get(f"/rent_rate/Houston/history{query}").status_code == status
+
+
+def test_history_endpoint_unknown_city(client, served):
+    response = client.get("/rent_rate/Hoston/history")
+    assert response.status_code == 404 and response.json()["detail"]["suggestions"] == ["Houston"]
+    # a known city without rents
+    response = client.get("/rent_rate/Boise/history")
+    assert response.status_code == 404 and response.json()["detail"]["suggestions"] == []
@@ -0,0 +1,121 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from app import scoring
+from app.scoring import DIMENSIONS
+
+engine = scoring.ScoreEngine()
+
+
+@pytest.mark.parametrize("dim, value, expected", [
+    # crime: lowest is best, a rate on a cutoff falls into the bucket above it
+    ("crime", -0.5, 5), ("crime", 0.0, 5), ("crime", 0.19999, 5), ("crime", 0.2, 4),
+    ("crime", 0.4, 3), ("crime", 0.6, 2), ("crime", 0.8, 1), ("crime", 1.0, 1), ("crime", 7.0, 1),
+    # walk: highest is best, a score on a cutoff falls into the bucket above it
+    ("walk", -1, 1), ("walk", 0, 1), ("walk", 19, 1), ("walk", 20, 2), ("walk", 40, 3),
+    ("walk", 60, 4), ("walk", 80, 5), ("walk", 100, 5), ("walk", 250, 5),
+    # rent: quantile edges, a rent on a cutoff falls into the bucket below it
+    ("rent", 0., 5), ("rent", 742., 5), ("rent", 1203.6, 5), ("rent", 1203.7, 4), ("rent", 1364., 4),
+    ("rent", 1535.6, 3), ("rent", 1721.2, 2), ("rent", 1721.3, 1), ("rent", 2993., 1), ("rent", 10000., 1),
+    # air: quantile edges like rent
+    ("air", 1.0, 5), ("air", 10.12566503, 5), ("air", 10.9, 3), ("air", 12.90177913, 2), ("air", 99.0, 1),
+])
+def test_bucketing_at_and_beyond_cutoffs(dim, value, expected):
+    assert engine.score_one(dim, value) == expected
+    assert engine.buckets[dim].score([value]).tolist() == [expected]
+
+
+def test_missing_values_score_zero():
+    metrics = np.array([[np.nan, 50, np.nan, 1000.], [0.5, np.nan, 11.0, np.nan]])
+    assert engine.score(metrics).tolist() == [[0, 3, 0, 5], [3, 0, 3, 0]]
+    assert engine.score_one("walk", None) == None
+
+
+def test_vectorized_scores_match_score_one():
+    rng = np.random.default_rng(0)
+    edges = {"crime": (0.2, 0.4, 0.6, 0.8), "walk": (20, 40, 60, 80),
+             "air": scoring.NOTEBOOK_AQ_EDGES, "rent": scoring.NOTEBOOK_RENT_EDGES}
+    for dim in DIMENSIONS:
+        lo, hi = min(edges[dim]), max(edges[dim])
+        span = hi - lo
+        # every cutoff exactly, plus values across and beyond the range
+        values = np.concatenate([edges[dim], rng.uniform(lo - span, hi + span, 500)])
+        vectorized = engine.buckets[dim].score(values).tolist()
+        assert vectorized == [engine.score_one(dim, value) for value in values.tolist()]
+
+
+def test_quantile_bucketing_uses_the_inner_edges():
+    bucketing = scoring.quantile_bucketing((1., 2., 3., 4., 5., 6.))
+    assert bucketing.cutoffs == (2., 3., 4., 5.)
+    assert [bucketing.score_one(v) for v in (0., 1., 2., 2.5, 5., 5.5, 6., 60.)] == [5, 5, 5, 4, 2, 1, 1, 1]
+
+
+# Raw metrics (crime rate, walk score, air quality total, rent) of a few
+# cities, from the best to the worst profile
+SAMPLED_CITIES = [
+    (0.05, 95, 8.0, 900.),
+    (0.55, 89, 11.5, 2900.),
+    (0.30, 51, 12.0, 1400.),
+    (0.65, 47, 10.9, 1300.),
+    (0.95, 5, 16.0, 3500.),
+]
+
+
+@pytest.mark.parametrize("mode", ["full", "lru"])
+def test_weight_grid_matches_score_one_for_every_weight(mode):
+    from app.helpers import calc_wghtd_city_score
+
+    grid = scoring.WeightGrid(mode, lru_size=64)
+    cities = []
+    for metrics in SAMPLED_CITIES:
+        scores = {dim: engine.score_one(dim, value) for dim, value in zip(DIMENSIONS, metrics)}
+        cities.append((int(scoring.profile_index(engine.score(metrics))[0]), scores))
+    assert len(set(profile for profile, _ in cities)) == len(SAMPLED_CITIES)
+
+    mismatches = []
+    for weights in itertools.product(range(scoring.WEIGHT_LEVELS), repeat=len(DIMENSIONS)):
+        weights = dict(zip(DIMENSIONS, weights))
+        for profile, scores in cities:
+            expected = calc_wghtd_city_score(scores, weights) if sum(weights.values()) else None
+            if grid.lookup(profile, weights) != expected:
+                mismatches.append((profile, weights))
+    assert mismatches == []
+    if mode == "lru":
+        assert len(grid.columns) == 64
+    else:
+        assert grid.grid.shape == (scoring.N_PROFILES, scoring.N_WEIGHTS)
+
+
+def test_weight_grid_declines_what_it_cannot_answer():
+    grid = scoring.WeightGrid("lru", lru_size=2)
+    weights = {"crime": 5, "walk": 5, "air": 5, "rent": 5}
+    assert grid.lookup(-1, weights) == None
+    assert grid.lookup(0, dict(weights, crime=11)) == None and grid.lookup(0, dict(weights, crime=2.5)) == None
+    assert grid.lookup(0, dict.fromkeys(DIMENSIONS, 0)) == None
+
+    # the least recently used weight vector is evicted
+    for crime in (1, 2, 1, 3):
+        assert grid.lookup(0, dict(weights, crime=crime)) == 1.0
+    assert sorted(grid.columns) == sorted(scoring.weight_index(dict(weights, crime=c)) for c in (1, 3))
+    assert grid.nbytes() == 2 * scoring.N_PROFILES + grid.tenths.nbytes
+
+
+@pytest.mark.parametrize("env, mode, lru_size", [
+    ({}, None, None),
+    ({"WEIGHT_GRID": "off"}, None, None),
+    ({"WEIGHT_GRID": "sometimes"}, None, None),
+    ({"WEIGHT_GRID": "FULL"}, "full", 4096),
+    ({"WEIGHT_GRID": "lru", "WEIGHT_GRID_LRU_SIZE": "16"}, "lru", 16),
+])
+def test_weight_grid_from_env(monkeypatch, env, mode, lru_size):
+    monkeypatch.delenv("WEIGHT_GRID", raising=False)
+    monkeypatch.delenv("WEIGHT_GRID_LRU_SIZE", raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    grid = scoring.weight_grid_from_env()
+    if mode == None:
+        assert grid == None
+    else:
+        assert grid.mode == mode and grid.lru_size == lru_size and grid.grid is None
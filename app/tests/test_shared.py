@@ -0,0 +1,77 @@
+import os
+import threading
+
+import pytest
+
+from app import scoring, shared, snapshot
+from app.shared import SharedStore
+from app.tests.conftest import CITY_ROWS
+
+
+@pytest.fixture
+def stores(tmp_path, snap):
+    """
+    stores makes SharedStores of one directory, like the workers of a
+    host; they are stopped and the served snapshot restored afterwards
+    """
+    made = []
+
+    def make(poll=1.0):
+        made.append(SharedStore(str(tmp_path), poll))
+        return made[-1]
+
+    yield make
+    for store in made:
+        store.stop()
+    snapshot.swap(snap)
+
+
+def changed(population):
+    rows = [row[:4] + (population,) + row[5:] if row[3] == "Houston" else row for row in CITY_ROWS]
+    return snapshot.build_snapshot(rows, scoring.ScoreEngine())
+
+
+def test_one_worker_leads(stores):
+    first, second = stores(), stores()
+    assert first.try_lead() and first.try_lead()
+    assert not second.try_lead() and not second.leader
+    # a follower does not publish
+    second.publish(changed(1))
+    assert first.latest() == 0
+
+
+def test_followers_attach_every_new_generation(stores, snap):
+    leader, follower = stores(), stores()
+    assert leader.try_lead() and not follower.attach()
+
+    leader.publish(snap)
+    assert follower.attach() and follower.generation == 1
+    assert snapshot.current().version == snap.version and not follower.attach()
+
+    for population in range(1, 5):
+        leader.publish(changed(population))
+    assert leader.generation == follower.latest() == 5
+    assert follower.attach() and follower.generation == 5
+    assert snapshot.current().get_population(snapshot.current().row("Houston")) == 4
+    # older generations are removed once no follower should still map them
+    files = sorted(name for name in os.listdir(leader.directory) if name.endswith(".bin"))
+    assert files == [f"snapshot-{gen}.bin" for gen in range(5 - shared.KEEP_GENERATIONS, 6)]
+
+
+def test_a_follower_takes_over_when_the_leader_exits(stores, snap, monkeypatch):
+    promoted = threading.Event()
+    monkeypatch.setattr(shared, "ON_LEAD", [promoted.set])
+    leader, follower = stores(), stores(poll=0.02)
+    assert leader.try_lead()
+    leader.publish(snap)
+
+    follower.start()
+    # a starting follower serves the published snapshot right away
+    assert follower.generation == 1 and not follower.leader
+    assert not promoted.wait(0.1)
+
+    leader.stop()
+    assert promoted.wait(5) and follower.leader
+    # the new leader publishes after the generations already out there
+    follower.publish(changed(1))
+    assert follower.latest() == 2
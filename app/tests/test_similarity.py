@@ -0,0 +1,154 @@
+import math
+import time
+
+import numpy as np
+import pytest
+
+from app import scoring, similarity, snapshot
+from app.scoring import DIMENSIONS
+from app.similarity import FEATURES, SimilarityIndex
+from app.tests.conftest import CITY_ROWS, SUPPORTED
+
+WEIGHTS = [
+    dict.fromkeys(FEATURES, 5),
+    dict.fromkeys(FEATURES, 1),
+    {"crime": 10, "walk": 0, "air": 3, "rent": 7, "population": 1},
+    {"crime": 0, "walk": 0, "air": 0, "rent": 0, "population": 4},
+]
+
+
+def brute_force(snap, row, weights):
+    """
+    brute_force returns the (distance, row) of every supported city but
+    row, nearest first, computed one city and feature at a time
+    """
+    def raw(r):
+        population = snap.get_population(r)
+        return [snap.get_metric(r, dim) for dim in DIMENSIONS] + [math.log10(population) if population else None]
+
+    rows = snap.supported.tolist()
+    stats = []
+    for j in range(len(FEATURES)):
+        known = [raw(r)[j] for r in rows if raw(r)[j] != None]
+        mean = sum(known) / len(known)
+        stats.append((mean, math.sqrt(sum((value - mean) ** 2 for value in known) / len(known)) or 1.0))
+
+    def standardized(r):
+        return [0.0 if value == None else (value - mean) / std for value, (mean, std) in zip(raw(r), stats)]
+
+    wght = [weights[feature] for feature in FEATURES]
+    z = standardized(row)
+    return sorted((math.sqrt(sum(w * (a - b) ** 2 for w, a, b in zip(wght, standardized(r), z)) / sum(wght)), r)
+                  for r in rows if r != row)
+
+
+@pytest.fixture(scope="module")
+def index(snap):
+    return SimilarityIndex(snap, neighbors=0)
+
+
+def test_features_are_standardized_over_the_supported_cities(snap, index):
+    known = ~np.isnan(similarity.raw_features(snap)[snap.supported])
+    supported = index.Z[snap.supported]
+    for j in range(len(FEATURES)):
+        column = supported[known[:, j], j]
+        assert column.mean() == pytest.approx(0, abs=1e-12) and column.std() == pytest.approx(1)
+    # a missing value is the mean: Boise's air quality, Anchorage's population
+    assert not known.all()
+    assert index.Z[snap.row("Boise"), FEATURES.index("air")] == 0
+    assert index.Z[snap.row("Anchorage"), FEATURES.index("population")] == 0
+    assert len(index) == len(SUPPORTED) and index.columns.shape == (len(FEATURES), len(SUPPORTED))
+
+
+@pytest.mark.parametrize("weights", WEIGHTS)
+def test_queries_match_a_brute_force_search(snap, index, weights):
+    # the inactive Springfield is compared against, never returned
+    for code in SUPPORTED + ["Springfield"]:
+        row = snap.row(code)
+        expected = brute_force(snap, row, weights)
+        rows, distances = index.query(row, weights, 100)
+        assert rows.tolist() == [r for _, r in expected], code
+        assert distances.tolist() == pytest.approx([d for d, _ in expected], rel=1e-9)
+        assert index.query(row, weights, 3)[0].tolist() == rows[:3].tolist()
+
+
+def test_neighbor_table_matches_a_brute_force_search(snap):
+    table_index = SimilarityIndex(snap, neighbors=5)
+    table_index.table.build()
+    neighbors, distances = table_index.table.get()
+    assert neighbors.shape == (len(SUPPORTED), 5)
+    for pos, row in enumerate(snap.supported.tolist()):
+        expected = brute_force(snap, row, WEIGHTS[0])[:5]
+        assert snap.supported[neighbors[pos]].tolist() == [r for _, r in expected]
+        assert distances[pos].tolist() == pytest.approx([d for d, _ in expected], rel=1e-9)
+    # the table answers equal weights of any size up to its k
+    houston = snap.row("Houston")
+    assert table_index.query(houston, WEIGHTS[1], 5)[0].tolist() == [r for _, r in brute_force(snap, houston, WEIGHTS[1])[:5]]
+
+
+def test_neighbor_table_is_built_on_first_use(snap, index):
+    lazy = SimilarityIndex(snap, neighbors=5)
+    assert lazy.table.neighbors is None
+    houston = snap.row("Houston")
+    # the first query takes the full pass while the table builds
+    first = lazy.query(houston, WEIGHTS[0], 5)
+    deadline = time.monotonic() + 5
+    while lazy.table.get() == None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert lazy.table.neighbors is not None
+    again = lazy.query(houston, WEIGHTS[0], 5)
+    assert again[0].tolist() == first[0].tolist() and again[1].tolist() == pytest.approx(first[1].tolist())
+    # more neighbours than the table holds, or unequal weights, take the full pass
+    assert lazy.query(houston, WEIGHTS[0], 8)[0].tolist() == index.query(houston, WEIGHTS[0], 8)[0].tolist()
+    assert lazy.query(houston, WEIGHTS[2], 5)[0].tolist() == index.query(houston, WEIGHTS[2], 5)[0].tolist()
+
+
+def test_small_or_disabled_catalogues_have_no_table(snap):
+    assert SimilarityIndex(snap, neighbors=0).table == None
+    assert SimilarityIndex(snap, neighbors=5, table_max=len(SUPPORTED) - 1).table == None
+    assert SimilarityIndex(snap, neighbors=100).table.k == len(SUPPORTED) - 1
+
+
+def test_unchanged_features_reuse_the_previous_index(snap):
+    previous = SimilarityIndex(snap, neighbors=5)
+    renamed = [row[:1] + ("Renamed",) + row[2:] if row[3] == "Houston" else row for row in CITY_ROWS]
+    reused = SimilarityIndex(snapshot.build_snapshot(renamed, scoring.ScoreEngine()), neighbors=5, previous=previous)
+    assert reused.reused and reused.table is previous.table and reused.Z is previous.Z
+
+    moved = [row[:7] + (row[7] + 1,) + row[8:] if row[3] == "Houston" else row for row in CITY_ROWS]
+    rebuilt = SimilarityIndex(snapshot.build_snapshot(moved, scoring.ScoreEngine()), neighbors=5, previous=previous)
+    assert not rebuilt.reused and rebuilt.table is not previous.table
+
+
+def test_similar_endpoint(client, snap):
+    assert similarity.current().snap.version == snap.version
+    houston = snap.row("Houston")
+    response = client.get("/similar/houston")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["city"] == {"id": 4, "city": "Houston", "state": "TX", "city_code": "Houston"}
+    expected = brute_force(snap, houston, WEIGHTS[0])
+    assert [city["city_code"] for city in body["similar"]] == [snap.codes[r] for _, r in expected[:10]]
+    assert [city["rank"] for city in body["similar"]] == list(range(1, 11))
+    assert [city["distance"] for city in body["similar"]] == pytest.approx([d for d, _ in expected[:10]], abs=1e-4)
+
+    weighted = client.get("/similar/Houston?k=3&crime=10&walk=0&air=3&rent=7&population=1").json()["similar"]
+    assert [city["city_code"] for city in weighted] == [snap.codes[r] for _, r in brute_force(snap, houston, WEIGHTS[2])[:3]]
+    # k above the number of other cities returns them all
+    assert len(client.get("/similar/Houston?k=100").json()["similar"]) == len(SUPPORTED) - 1
+
+
+@pytest.mark.parametrize("path, status", [
+    ("/similar/Houston?k=0", 422),
+    ("/similar/Houston?k=101", 422),
+    ("/similar/Houston?population=11", 422),
+    ("/similar/Houston?crime=0&walk=0&air=0&rent=0&population=0", 400),
+    ("/similar/Not_A_City", 404),
+])
+def test_similar_endpoint_rejects_bad_requests(client, path, status):
+    assert client.get(path).status_code == status
+
+
+def test_similar_endpoint_suggests_close_names(client):
+    response = client.get("/similar/Hoston")
+    assert response.status_code == 404 and response.json()["detail"]["suggestions"] == ["Houston"]
@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+
+from app import scoring, snapshot
+from app.helpers import calc_wghtd_city_score
+from app.scoring import DIMENSIONS
+from app.tests.conftest import CITY_ROWS
+
+
+def test_duplicate_city_codes_keep_their_first_row(snap):
+    assert len(snap) == len(CITY_ROWS)
+    assert snap.row("Chicago") == 2 and snap.get_metric(2, "walk") == 78
+    assert snap.row("Not_A_City") == None
+
+
+def test_missing_metrics_have_no_score(snap):
+    boise = snap.row("Boise")
+    assert snap.get_metric(boise, "air") == None and snap.get_score(boise, "air") == None
+    assert snap.get_score(boise, "rent") != None
+    assert snap.get_population(snap.row("Anchorage")) == None
+
+
+def test_score_endpoints_read_the_snapshot(client, snap):
+    houston = snap.row("Houston")
+    for path, dim in (("/crime_scr/Houston", "crime"), ("/walk_scr/Houston", "walk"),
+                      ("/air_qual_scr/Houston", "air"), ("/rent_rate/Houston", "rent")):
+        assert client.get(path).json()["score"] == snap.get_score(houston, dim)
+    assert client.get("/rent_rate/Houston").json()["avg_rent"] == 1300.
+    assert client.get("/population_data/Houston").json()["population"] == 2320268
+
+
+def test_swap_replaces_the_served_snapshot(client, snap):
+    changed = [row[:4] + (row[4] + 1 if row[3] == "Houston" else row[4],) + row[5:] for row in CITY_ROWS]
+    snapshot.swap(snapshot.build_snapshot(changed, scoring.ScoreEngine()))
+    try:
+        assert client.get("/population_data/Houston").json()["population"] == 2320269
+        assert snapshot.current().version != snap.version
+    finally:
+        snapshot.swap(snap)
+    assert client.get("/population_data/Houston").json()["population"] == 2320268
+
+
+def assert_same_snapshot(patched, rebuilt):
+    assert patched.version == rebuilt.version and patched.cities == rebuilt.cities
+    assert patched.index == rebuilt.index
+    for name in ("population", "metrics", "scores", "profiles", "coords", "supported", "rank_rows",
+                 "by_profile", "profile_starts", "by_state", "state_starts"):
+        assert np.array_equal(getattr(patched, name), getattr(rebuilt, name), equal_nan=True), name
+    assert patched.state_blocks == rebuilt.state_blocks
+    weights = {"crime": 3, "walk": 7, "air": 2, "rent": 8}
+    for state in (None, "CA", "TX"):
+        top, rebuilt_top = patched.top_cities(weights, 1000, state), rebuilt.top_cities(weights, 1000, state)
+        assert np.array_equal(top[0], rebuilt_top[0]) and np.array_equal(top[1], rebuilt_top[1])
+
+
+def patch(snap, rows, codes):
+    # the rows CHANGED_SQL fetches for the changed codes, in id order
+    return snapshot.patch_snapshot(snap, codes, sorted((row for row in rows if row[3] in codes), key=lambda r: r[0]))
+
+
+def test_patching_updated_rows_matches_a_full_rebuild(snap):
+    rows = [row[:4] + (row[4] + 1, row[5], 0.9) + row[7:] if row[3] == "Houston" else row for row in CITY_ROWS]
+    patched = patch(snap, rows, {"Houston"})
+    assert_same_snapshot(patched, snapshot.build_snapshot(rows, snap.engine))
+    assert patched.get_population(patched.row("Houston")) == 2320269
+    # the cities are unchanged, so their name index is reused
+    assert patched.names is snap.names and patched.index is snap.index
+
+
+def test_patching_inserted_and_deleted_rows_matches_a_full_rebuild(snap):
+    austin = (17, "Austin", "TX", "Austin", 961855, "yes", 0.4, 42, 9.9, 1500., 30.2672, -97.7431)
+    # Denver is deleted, Austin inserted and Chicago's first row deleted,
+    # so its second row becomes the one served
+    rows = [row for row in CITY_ROWS if row[3] != "Denver" and row[0] != 3] + [austin]
+    patched = patch(snap, rows, {"Denver", "Austin", "Chicago"})
+    assert_same_snapshot(patched, snapshot.build_snapshot(rows, snap.engine))
+
+    assert patched.row("Denver") == None and patched.find("denver, co") == None
+    assert patched.find("austin") == patched.row("Austin") and patched.get_metric(patched.row("Chicago"), "walk") == 99
+    assert "Denver" not in patched.codes[patched.supported].tolist()
+    # the passed snapshot is left as it was
+    assert snap.row("Denver") != None and snap.row("Austin") == None and len(snap) == len(CITY_ROWS)
+
+
+def test_patching_codes_without_rows_removes_them(snap):
+    rows = [row for row in CITY_ROWS if row[3] not in ("Boise", "Anchorage")]
+    patched = patch(snap, rows, {"Boise", "Anchorage", "Not_A_City"})
+    assert_same_snapshot(patched, snapshot.build_snapshot(rows, snap.engine))
+    assert len(patched) == len(CITY_ROWS) - 2
+
+
+def synthetic_rows(n, seed=7):
+    """
+    synthetic_rows returns n SNAPSHOT_SQL shaped rows over six states,
+    with inactive cities and missing metrics
+    """
+    rng = np.random.default_rng(seed)
+    states = ["CA", "TX", "NY", "MO", "CO", "WA"]
+    rows = []
+    for i in range(n):
+        crime, walk, air, rent = rng.uniform(0, 1), int(rng.integers(0, 101)), rng.uniform(6, 17), rng.uniform(700, 3000)
+        rows.append((i + 1, f"City {i}", states[i % 6], f"City_{i}", int(rng.integers(1000, 10 ** 6)),
+                     "no" if i % 17 == 0 else "yes", crime, walk, None if i % 23 == 0 else air, rent, None, None))
+    return rows
+
+
+def brute_force_top(snap, weights, limit, state=None):
+    ranked = []
+    for row in snap.supported.tolist():
+        scores = {dim: snap.get_score(row, dim) for dim in DIMENSIONS}
+        if None in scores.values() or (state != None and snap.states[row] != state):
+            continue
+        ranked.append((-sum(scores[dim] * weights[dim] for dim in DIMENSIONS) / sum(weights.values()), row, scores))
+    ranked.sort(key=lambda item: item[:2])
+    return [row for _, row, _ in ranked[:limit]], [calc_wghtd_city_score(scores, weights) for _, _, scores in ranked[:limit]]
+
+
+@pytest.mark.parametrize("weights", [
+    {"crime": 5, "walk": 5, "air": 5, "rent": 5},
+    {"crime": 3, "walk": 7, "air": 2, "rent": 8},
+    {"crime": 0, "walk": 10, "air": 0, "rent": 1},
+])
+def test_top_cities_match_a_brute_force_sort(weights):
+    # more cities than score profiles, so profiles are ranked, not cities
+    snap = snapshot.build_snapshot(synthetic_rows(3000), scoring.ScoreEngine())
+    assert len(snap.rank_rows) > scoring.N_PROFILES
+    for state in (None, "CA", "MO"):
+        for limit in (1, 10, 250, 1000):
+            rows, wgt_avg = snap.top_cities(weights, limit, state)
+            expected_rows, expected_scores = brute_force_top(snap, weights, limit, state)
+            assert rows.tolist() == expected_rows, (state, limit)
+            assert [calc_wghtd_city_score(dict(zip(DIMENSIONS, snap.scores[row].tolist())), weights)
+                    for row in rows.tolist()] == expected_scores
+            assert (np.diff(wgt_avg) <= 0).all()
+    assert snap.top_cities(weights, 1000, "ZZ")[0].tolist() == []
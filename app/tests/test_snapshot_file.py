@@ -0,0 +1,80 @@
+import struct
+
+import numpy as np
+import pytest
+
+from app import cache, snapshot
+from app.snapshot_file import read_snapshot, write_snapshot
+from app.tests.conftest import CITY_ROWS
+
+# The scripts/snapshot_file_diff.py requests, for the conftest cities
+WEIGHTS = ("", "?crime=8&walk=4&air=4&rent=9", "?crime=0&walk=10&air=1&rent=3")
+
+CITY_PATHS = ("/crime_scr/{city}", "/walk_scr/{city}", "/air_qual_scr/{city}", "/rent_rate/{city}",
+              "/population_data/{city}")
+WEIGHTED_PATHS = ("/city_scr/{city}", "/city/{city}")
+
+OTHER_PATHS = (
+    "/cities", "/cities?q=new", "/cities?q=st+lo", "/cities?q=san&limit=1", "/cities?page_size=5",
+    "/cities?fields=city_code,lat,lon,population", "/rankings", "/rankings?crime=8&walk=4&air=4&rent=9&limit=5",
+    "/rankings?state=CA", "/rankings?crime=0&walk=10&air=0&rent=0&limit=100",
+    "/cities/near?lat=38.6&lon=-90.2&radius_km=500", "/cities/bbox?south=30&west=-125&north=45&east=-90",
+    "/similar/Houston", "/city_scr/Not_A_City", "/city/Not_A_City", "/crime_scr/Not_A_City",
+    "/city_scr/new%20york",
+)
+
+
+def requests():
+    codes = [row[3] for row in CITY_ROWS]
+    paths = [path.format(city=code) for code in codes for path in CITY_PATHS]
+    paths += [path.format(city=code) + weights for code in codes for path in WEIGHTED_PATHS for weights in WEIGHTS]
+    return paths + list(OTHER_PATHS)
+
+
+def responses(client, snap):
+    snapshot.swap(snap)
+    cache.response_cache.clear()
+    answers = {path: client.get(path) for path in requests()}
+    batch = client.post("/city_scr/batch", json={"city_codes": [row[3] for row in CITY_ROWS] + ["Not_A_City"],
+                                                 "weights": {"crime": 8, "walk": 4, "air": 4, "rent": 9}})
+    answers["POST /city_scr/batch"] = batch
+    return {path: (response.status_code, response.content) for path, response in answers.items()}
+
+
+def test_file_round_trip(snap, snap_path):
+    generation, mapped = read_snapshot(snap_path)
+    assert generation == 0
+    assert mapped.version == snap.version and mapped.cities == snap.cities
+    for name in ("population", "metrics", "scores", "coords", "supported", "rank_rows"):
+        assert np.array_equal(getattr(mapped, name), getattr(snap, name), equal_nan=True), name
+    assert mapped.engine.quantile_edges == snap.engine.quantile_edges
+
+
+def test_file_generation(snap, tmp_path):
+    path = str(tmp_path / "generation.snap")
+    write_snapshot(path, snap, generation=7)
+    assert read_snapshot(path)[0] == 7
+
+
+def test_other_layouts_are_rejected(snap, tmp_path):
+    path = str(tmp_path / "layout1.snap")
+    write_snapshot(path, snap)
+    with open(path, "r+b") as f:
+        # the layout field follows the 8-byte magic
+        f.seek(8)
+        f.write(struct.pack("<I", 1))
+    with pytest.raises(ValueError, match="is not a layout 2 snapshot file"):
+        read_snapshot(path)
+
+
+def test_file_snapshot_answers_like_the_loaded_snapshot(client, snap, snap_path):
+    _, mapped = read_snapshot(snap_path)
+    try:
+        from_file = responses(client, mapped)
+        loaded = responses(client, snap)
+    finally:
+        snapshot.swap(snap)
+
+    differences = [path for path in loaded if loaded[path] != from_file[path]]
+    assert differences == []
+    assert sum(status == 200 for status, _ in loaded.values()) > len(loaded) // 2
@@ -0,0 +1,429 @@
+"""Benchmark suite for the scoring API
+
+For every requested catalogue size (default 200, 10,000 and 100,000
+cities) the suite:
+
+  1. seeds a scratch Postgres database with synthetic cityspire_* tables
+     shaped like the production ones (same columns), with the city_code
+     indexes of `python -m app.refresher --indexes` unless --no-indexes
+  2. micro-benchmarks the gen_*_score helpers and calc_wghtd_city_score
+     and times loading the snapshot
+  3. drives every endpoint with concurrent clients for a fixed time,
+     in-process (ASGI calls, no network) and over uvicorn (HTTP)
+
+and reports throughput and p50/p95/p99 latency. The response cache is
+disabled so endpoint work is measured, not cache lookups.
+
+Results can be written as a JSON baseline; a later run given
+--compare fails (exit 1) when a latency grew or a throughput fell by
+more than --tolerance against it.
+
+The database is dropped and recreated table by table, so its name must
+contain "bench" (or pass --force):
+
+    createdb cityspire_bench
+    python scripts/benchmark.py --database-url postgresql://user@localhost/cityspire_bench \\
+        --json baseline.json
+    # ... change the code ...
+    python scripts/benchmark.py --database-url ... --compare baseline.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urlparse
+
+import numpy as np
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import fetch, percentile  # noqa: E402
+
+DEFAULT_SIZES = [200, 10000, 100000]
+
+STATES = [
+    "AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "FL", "GA", "HI", "ID", "IL", "IN", "IA", "KS",
+    "KY", "LA", "ME", "MD", "MA", "MI", "MN", "MS", "MO", "MT", "NE", "NV", "NH", "NJ", "NM", "NY",
+    "NC", "ND", "OH", "OK", "OR", "PA", "RI", "SC", "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV",
+    "WI", "WY",
+]
+
+# The production tables' columns (project/archive/db backup), with the id
+# columns `python -m app.refresher --indexes` adds to the air and rent tables
+SCHEMA_SQL = """
+    DROP TABLE IF EXISTS cityspire_cities, cityspire_crime, cityspire_wlk_scr,
+                         cityspire_air_quality, cityspire_rent;
+    CREATE TABLE cityspire_cities (
+        id integer PRIMARY KEY, city text, state text, city_code text,
+        state_name text, population numeric, active text);
+    CREATE TABLE cityspire_crime (
+        state text, city text, population bigint, violent_crime bigint,
+        murder_nonnegligent_manslaughter bigint, rape bigint, robbery bigint,
+        aggravated_assault bigint, property_crime bigint, burglary bigint,
+        larceny_theft bigint, motor_vehicle_theft bigint, arson bigint,
+        state_abbr text, id serial PRIMARY KEY, combined_scaled_rate numeric,
+        city_code text, city_id integer);
+    CREATE TABLE cityspire_wlk_scr (
+        id serial PRIMARY KEY, city_id integer, state text, city_code text, walk_score integer);
+    CREATE TABLE cityspire_air_quality (
+        "City" text, "State" text, city_code text, "PM2.5" double precision,
+        "O3" double precision, "PM2.5 Scaled" double precision,
+        "O3 Scaled" double precision, "Combined Total" double precision,
+        id bigserial);
+    CREATE TABLE cityspire_rent (
+        "City" text, "State" text, city_code text, "Dec Avg Rent" double precision,
+        id bigserial);
+"""
+
+# Endpoint name -> path template; {city} is filled with random active cities
+ENDPOINTS = {
+    "/cities":                 "/cities",
+    "/cities?q=":              "/cities?q=city+1",
+    "/cities?page_size=":      "/cities?page_size=100&cursor={cursor}",
+    "/cities?fields=":         "/cities?page_size=100&cursor={cursor}&fields=city_code,population",
+    "/crime_scr/{city}":       "/crime_scr/{city}",
+    "/walk_scr/{city}":        "/walk_scr/{city}",
+    "/rent_rate/{city}":       "/rent_rate/{city}",
+    "/air_qual_scr/{city}":    "/air_qual_scr/{city}",
+    "/population_data/{city}": "/population_data/{city}",
+    "/city_scr/{city}":        "/city_scr/{city}?crime=8&walk=4&air=4&rent=9",
+    "/city/{city}":            "/city/{city}",
+    "/rankings":               "/rankings?crime=8&walk=4&air=4&rent=9&limit=10",
+    "/similar/{city}":         "/similar/{city}?k=10",
+}
+
+# Result keys where lower is better / higher is better
+LOWER_IS_BETTER  = ("p50_ms", "p95_ms", "p50_us", "p95_us", "ms")
+HIGHER_IS_BETTER = ("rps",)
+
+
+def copy_rows(cursor, table, columns, rows):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join("\\N" if v is None else str(v) for v in row) + "\n")
+    buf.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+
+def seed(database_url, n, rng, indexes=True):
+    """
+    seed recreates the cityspire_* tables with n synthetic cities, half of
+    them active, each with a crime, walk, air quality and rent row, and
+    the city_code indexes if indexes is set
+    """
+    from app import snapshot
+
+    ids    = np.arange(1, n + 1)
+    states = rng.choice(STATES, n)
+    pop    = np.round(rng.lognormal(11, 1.2, n)).astype(np.int64)
+    names  = [f"City {i}" for i in ids]
+    codes  = [f"City_{i}" for i in ids]
+    active = np.where(ids % 2 == 1, "yes", "no")
+
+    violent  = np.round(pop * rng.uniform(0.001, 0.02, n)).astype(np.int64)
+    property_ = np.round(pop * rng.uniform(0.01, 0.05, n)).astype(np.int64)
+    scaled   = np.round(rng.uniform(0, 1, n), 6)
+    walk     = rng.integers(0, 101, n)
+    pm25     = np.round(rng.uniform(4, 14, n), 3)
+    o3       = np.round(rng.uniform(0.04, 0.08, n), 4)
+    aq_total = np.round(rng.uniform(7, 17, n), 6)
+    rent     = np.round(rng.uniform(700, 3000, n), 0)
+
+    conn = psycopg2.connect(database_url)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(SCHEMA_SQL)
+        copy_rows(cursor, "cityspire_cities",
+                  ["id", "city", "state", "city_code", "state_name", "population", "active"],
+                  zip(ids, names, states, codes, states, pop, active))
+        copy_rows(cursor, "cityspire_crime",
+                  ["state", "city", "population", "violent_crime", "property_crime",
+                   "state_abbr", "combined_scaled_rate", "city_code", "city_id"],
+                  zip(states, names, pop, violent, property_, states, scaled, codes, ids))
+        copy_rows(cursor, "cityspire_wlk_scr", ["city_id", "state", "city_code", "walk_score"],
+                  zip(ids, states, codes, walk))
+        copy_rows(cursor, "cityspire_air_quality",
+                  ['"City"', '"State"', "city_code", '"PM2.5"', '"O3"', '"Combined Total"'],
+                  zip(names, states, codes, pm25, o3, aq_total))
+        copy_rows(cursor, "cityspire_rent", ['"City"', '"State"', "city_code", '"Dec Avg Rent"'],
+                  zip(names, states, codes, rent))
+        cursor.execute("ANALYZE")
+        conn.commit()
+        if indexes:
+            snapshot.install_indexes(conn)
+    finally:
+        conn.close()
+    return [code for code, act in zip(codes, active) if act == "yes"]
+
+
+def latency_stats(samples, unit=1000.0, suffix="ms"):
+    vals = sorted(s * unit for s in samples)
+    return {
+        f"p50_{suffix}": round(percentile(vals, 50), 3),
+        f"p95_{suffix}": round(percentile(vals, 95), 3),
+        f"p99_{suffix}": round(percentile(vals, 99), 3),
+    }
+
+
+def micro(db_conn, cities, calls):
+    """
+    micro times single calls of the database score helpers and the
+    weighted score calculation; returns per-function latency in µs
+    """
+    from app import helpers
+
+    results = {}
+    picks = [random.choice(cities) for _ in range(calls)]
+    for name in ("gen_crime_score", "gen_walk_score", "gen_rent_score", "gen_aq_score"):
+        func = getattr(helpers, name)
+        samples = []
+        for city in picks:
+            start = time.perf_counter()
+            func(db_conn, city)
+            samples.append(time.perf_counter() - start)
+        results[name] = dict(latency_stats(samples, 1e6, "us"), calls=calls)
+
+    scores  = {"crime": 3, "walk": 4, "air": 2, "rent": 5}
+    weights = {"crime": 8, "walk": 4, "air": 4, "rent": 9}
+    samples = []
+    for _ in range(calls * 50):
+        start = time.perf_counter()
+        helpers.calc_wghtd_city_score(scores, weights)
+        samples.append(time.perf_counter() - start)
+    results["calc_wghtd_city_score"] = dict(latency_stats(samples, 1e6, "us"), calls=calls * 50)
+    return results
+
+
+async def asgi_get(app, path):
+    """
+    asgi_get calls the ASGI app with a GET of path and returns the status
+    """
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": query.encode(), "root_path": "", "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+    status = []
+    requested = False
+    done = asyncio.Event()
+
+    async def receive():
+        # like a server: the request body once, then a disconnect only
+        # after the response (streaming responses listen for it)
+        nonlocal requested
+        if requested:
+            await done.wait()
+            return {"type": "http.disconnect"}
+        requested = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+        elif message["type"] == "http.response.body" and not message.get("more_body", False):
+            done.set()
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+async def drive(open_client, paths, clients, seconds):
+    """
+    drive runs `clients` concurrent clients issuing requests of paths back
+    to back for `seconds` and returns (latencies, errors, elapsed);
+    open_client is an async callable returning a (request, close) pair
+    of one client's request(path) -> status and close() functions
+    """
+    latencies = []
+    errors = [0]
+    deadline = time.perf_counter() + seconds
+
+    async def client(offset):
+        request, close = await open_client()
+        try:
+            i = offset
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                status = await request(paths[i % len(paths)])
+                latencies.append(time.perf_counter() - start)
+                if status >= 500:
+                    errors[0] += 1
+                i += 1
+        finally:
+            close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(i) for i in range(clients)])
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def load_stats(latencies, errors, elapsed):
+    return dict(latency_stats(latencies), requests=len(latencies), errors=errors,
+                rps=round(len(latencies) / elapsed, 1))
+
+
+def endpoint_paths(cities):
+    sample = random.sample(cities, min(100, len(cities)))
+    # page cursors are city ids, the seeded City_<id> codes' numbers
+    cursors = [int(city.rsplit("_", 1)[1]) for city in sample]
+    return {
+        name: [template.format(city=city, cursor=cursor) for city, cursor in zip(sample, cursors)]
+        if "{" in template else [template]
+        for name, template in ENDPOINTS.items()
+    }
+
+
+def run_inprocess(app, cities, clients, seconds):
+    async def open_client():
+        return (lambda path: asgi_get(app, path)), (lambda: None)
+
+    return {name: load_stats(*asyncio.run(drive(open_client, paths, clients, seconds)))
+            for name, paths in endpoint_paths(cities).items()}
+
+
+def run_uvicorn(env, cities, clients, seconds, port):
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 120
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/readyz", timeout=1) as rsp:
+                    if rsp.status == 200:
+                        break
+            except (urllib.error.URLError, ConnectionError, OSError):
+                if time.monotonic() > deadline or proc.poll() != None:
+                    raise SystemExit("uvicorn did not become ready")
+            time.sleep(0.05)
+
+        async def open_client():
+            # one keep-alive connection per client
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            return (lambda path: fetch(reader, writer, "127.0.0.1", path)), writer.close
+
+        return {name: load_stats(*asyncio.run(drive(open_client, paths, clients, seconds)))
+                for name, paths in endpoint_paths(cities).items()}
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def compare(baseline, current, tolerance, path=""):
+    """
+    compare returns the regressions of current against baseline as
+    (key path, baseline value, current value) tuples
+    """
+    regressions = []
+    for key, base in baseline.items():
+        if key not in current:
+            continue
+        cur = current[key]
+        where = f"{path}/{key}" if path else key
+        if isinstance(base, dict) and isinstance(cur, dict):
+            regressions.extend(compare(base, cur, tolerance, where))
+        elif key in LOWER_IS_BETTER and base and cur > base * (1 + tolerance):
+            regressions.append((where, base, cur))
+        elif key in HIGHER_IS_BETTER and base and cur < base * (1 - tolerance):
+            regressions.append((where, base, cur))
+    return regressions
+
+
+def print_table(title, results, keys):
+    print(f"\n{title}")
+    print(f"  {'':<26}" + "".join(f"{k:>12}" for k in keys))
+    for name, stats in results.items():
+        print(f"  {name:<26}" + "".join(f"{stats.get(k, ''):>12}" for k in keys))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"),
+                        help="scratch database to seed (default $BENCH_DATABASE_URL)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="city catalogue sizes")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent clients per endpoint")
+    parser.add_argument("--seconds", type=float, default=3.0, help="seconds of load per endpoint")
+    parser.add_argument("--calls", type=int, default=200, help="calls per micro-benchmarked helper")
+    parser.add_argument("--port", type=int, default=8767, help="port for the uvicorn runs")
+    parser.add_argument("--skip-uvicorn", action="store_true", help="only run in-process")
+    parser.add_argument("--seed", type=int, default=42, help="random seed of the synthetic data")
+    parser.add_argument("--json", help="write the results to this JSON file (a baseline)")
+    parser.add_argument("--compare", help="baseline JSON to compare against; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--force", action="store_true", help="seed a database whose name lacks 'bench'")
+    parser.add_argument("--no-indexes", action="store_true", help="seed without the city_code indexes")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        raise SystemExit("ERROR: pass --database-url or set BENCH_DATABASE_URL")
+    if "bench" not in urlparse(args.database_url).path and not args.force:
+        raise SystemExit("ERROR: refusing to replace the cityspire_* tables of a database not named *bench*")
+
+    # the app reads these at import
+    os.environ.update({"DATABASE_URL": args.database_url, "SNAPSHOT_REFRESH": "false",
+                       "RESPONSE_CACHE_SIZE": "0"})
+    from app import ml, snapshot
+    from app.main import app
+
+    random.seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+    report = {"meta": {"sizes": args.sizes, "clients": args.clients, "seconds": args.seconds,
+                       "calls": args.calls, "indexes": not args.no_indexes, "python": sys.version.split()[0]},
+              "sizes": {}}
+
+    for n in args.sizes:
+        print(f"\n=== {n} cities ===")
+        start = time.perf_counter()
+        cities = seed(args.database_url, n, rng, not args.no_indexes)
+        result = {"seed_s": round(time.perf_counter() - start, 2)}
+
+        ml.db_sess.connect()
+        with ml.db_sess.connection() as db_conn:
+            start = time.perf_counter()
+            snapshot.refresh(db_conn)
+            result["snapshot_load"] = {"ms": round((time.perf_counter() - start) * 1000, 2)}
+            result["micro"] = micro(db_conn, cities, args.calls)
+
+        result["inprocess"] = run_inprocess(app, cities, args.clients, args.seconds)
+        if not args.skip_uvicorn:
+            result["uvicorn"] = run_uvicorn(dict(os.environ), cities, args.clients, args.seconds, args.port)
+        report["sizes"][str(n)] = result
+
+        print(f"seeded in {result['seed_s']}s, snapshot loaded in {result['snapshot_load']['ms']} ms")
+        print_table("helpers (µs)", result["micro"], ("p50_us", "p95_us", "p99_us"))
+        for mode in ("inprocess", "uvicorn"):
+            if mode in result:
+                print_table(f"{mode} ({args.clients} clients, {args.seconds}s per endpoint)", result[mode],
+                            ("rps", "p50_ms", "p95_ms", "p99_ms", "errors"))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline["sizes"], report["sizes"], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regressions beyond {args.tolerance:.0%}:")
+            for where, base, cur in regressions:
+                print(f"  {where}: {base} -> {cur}")
+            sys.exit(1)
+        print(f"\nno regressions beyond {args.tolerance:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
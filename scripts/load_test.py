@@ -0,0 +1,171 @@
+"""Concurrent load test for the DS API
+
+Drives a running API instance with N concurrent clients, each issuing
+requests back to back over its own keep-alive connection, and reports
+throughput plus p50/p95/p99 latency per path.
+
+Usage:
+    uvicorn app.main:app --port 8000 &
+    python scripts/load_test.py --url http://127.0.0.1:8000 --clients 100 --requests 50
+
+    # compare two builds (e.g. before/after a change) on the same paths
+    python scripts/load_test.py --json before.json ...
+    python scripts/load_test.py --json after.json ...
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+DEFAULT_PATHS = [
+    "/cities",
+    "/crime_scr/St_Louis",
+    "/walk_scr/St_Louis",
+    "/air_qual_scr/St_Louis",
+    "/rent_rate/St_Louis",
+    "/population_data/St_Louis",
+    "/city_scr/St_Louis?crime=8&walk=4&air=4&rent=9",
+]
+
+
+def percentile(sorted_vals, pct):
+    """
+    percentile returns the nearest-rank percentile of a sorted list
+    """
+    if not sorted_vals:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_vals)))
+    return sorted_vals[rank - 1]
+
+
+async def fetch(reader, writer, host, path):
+    """
+    fetch issues one HTTP/1.1 GET on an open keep-alive connection
+    and returns the response status code
+    """
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n".encode())
+    await writer.drain()
+
+    status_line = await reader.readline()
+    status = int(status_line.split()[1])
+    length = 0
+    chunked = False
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        name = name.strip().lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "transfer-encoding" and "chunked" in value.lower():
+            chunked = True
+
+    if chunked:
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length:
+        await reader.readexactly(length)
+
+    return status
+
+
+async def client(host, port, paths, n_requests, results):
+    """
+    client sends n_requests requests, cycling through paths,
+    and records (path, status, seconds) per request
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for i in range(n_requests):
+            path = paths[i % len(paths)]
+            start = time.perf_counter()
+            status = await fetch(reader, writer, host, path)
+            results.append((path, status, time.perf_counter() - start))
+    finally:
+        writer.close()
+
+
+async def run(url, paths, n_clients, n_requests):
+    parsed = urlparse(url)
+    host = parsed.hostname
+    port = parsed.port or 80
+
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        client(host, port, paths[i % len(paths):] + paths[:i % len(paths)], n_requests, results)
+        for i in range(n_clients)
+    ])
+    elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+def summarize(results, elapsed):
+    """
+    summarize computes throughput and latency percentiles (ms) per path
+    """
+    by_path = defaultdict(list)
+    errors = defaultdict(int)
+    for path, status, secs in results:
+        by_path[path].append(secs * 1000.0)
+        if status >= 500:
+            errors[path] += 1
+
+    all_ms = sorted(ms for vals in by_path.values() for ms in vals)
+    summary = {
+        "requests": len(results),
+        "seconds": round(elapsed, 3),
+        "rps": round(len(results) / elapsed, 1) if elapsed else None,
+        "p50_ms": percentile(all_ms, 50),
+        "p95_ms": percentile(all_ms, 95),
+        "p99_ms": percentile(all_ms, 99),
+        "paths": {},
+    }
+    for path, vals in sorted(by_path.items()):
+        vals.sort()
+        summary["paths"][path] = {
+            "requests": len(vals),
+            "errors": errors[path],
+            "p50_ms": percentile(vals, 50),
+            "p95_ms": percentile(vals, 95),
+            "p99_ms": percentile(vals, 99),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="base URL of a running API")
+    parser.add_argument("--clients", type=int, default=100, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=50, help="requests per client")
+    parser.add_argument("--path", action="append", dest="paths", help="path to request (repeatable)")
+    parser.add_argument("--json", help="also write the summary to this JSON file")
+    args = parser.parse_args()
+
+    results, elapsed = asyncio.run(run(args.url, args.paths or DEFAULT_PATHS, args.clients, args.requests))
+    summary = summarize(results, elapsed)
+
+    print(f"{summary['requests']} requests from {args.clients} clients in {summary['seconds']}s "
+          f"({summary['rps']} req/s)")
+    print(f"{'path':<50} {'n':>6} {'5xx':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for path, stats in summary["paths"].items():
+        print(f"{path:<50} {stats['requests']:>6} {stats['errors']:>5} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+    print(f"{'all':<50} {summary['requests']:>6} {'':>5} "
+          f"{summary['p50_ms']:>8.2f} {summary['p95_ms']:>8.2f} {summary['p99_ms']:>8.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
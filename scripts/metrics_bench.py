@@ -0,0 +1,109 @@
+"""Metrics overhead benchmark for the DS API
+
+Boots `uvicorn app.main:app` alternately with METRICS_ENABLED=false and
+METRICS_ENABLED=true, drives each boot with the load_test.py clients and
+reports the throughput and latency difference. Rounds alternate so both
+configurations see the same machine conditions.
+
+Default paths are served from the snapshot and the response cache, so
+requests are as cheap as they get and the recording cost is as large a
+share of them as it can be.
+
+Usage:
+    python scripts/metrics_bench.py --rounds 3 --clients 50 --requests 200
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import DEFAULT_PATHS, run, summarize  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_ready(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url + "/readyz", timeout=1) as rsp:
+                if rsp.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.05)
+    raise SystemExit(f"API at {url} did not become ready")
+
+
+def measure(enabled, port, paths, clients, requests):
+    """
+    measure boots one API process and returns its load test summary
+    """
+    env = dict(os.environ, METRICS_ENABLED="true" if enabled else "false")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_ready(url)
+        # warm the response cache and connections, then measure
+        asyncio.run(run(url, paths, clients, 5))
+        results, elapsed = asyncio.run(run(url, paths, clients, requests))
+        return summarize(results, elapsed)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=3, help="boots per configuration")
+    parser.add_argument("--port", type=int, default=8766, help="port to boot the API on")
+    parser.add_argument("--clients", type=int, default=50, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="requests per client")
+    parser.add_argument("--path", action="append", dest="paths", help="path to request (repeatable)")
+    parser.add_argument("--json", help="also write the summary to this JSON file")
+    args = parser.parse_args()
+    paths = args.paths or DEFAULT_PATHS
+
+    runs = {False: [], True: []}
+    for _ in range(args.rounds):
+        for enabled in (False, True):
+            runs[enabled].append(measure(enabled, args.port, paths, args.clients, args.requests))
+
+    result = {}
+    for enabled, summaries in runs.items():
+        result["on" if enabled else "off"] = {
+            "rps":    round(statistics.median(s["rps"] for s in summaries), 1),
+            "p50_ms": round(statistics.median(s["p50_ms"] for s in summaries), 2),
+            "p99_ms": round(statistics.median(s["p99_ms"] for s in summaries), 2),
+        }
+    off, on = result["off"], result["on"]
+    result["overhead_pct"] = {
+        "rps":    round(100.0 * (off["rps"] - on["rps"]) / off["rps"], 2),
+        "p50_ms": round(100.0 * (on["p50_ms"] - off["p50_ms"]) / off["p50_ms"], 2),
+    }
+
+    print(f"{'metrics':<8} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for name in ("off", "on"):
+        r = result[name]
+        print(f"{name:<8} {r['rps']:>9.1f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+    print(f"overhead: {result['overhead_pct']['rps']:.2f}% throughput, "
+          f"{result['overhead_pct']['p50_ms']:.2f}% p50 latency")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
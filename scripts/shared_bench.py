@@ -0,0 +1,119 @@
+"""Multi-worker memory benchmark for the shared snapshot
+
+Boots `uvicorn app.main:app --workers N` for each worker count, once with
+every worker loading its own snapshot and once with SNAPSHOT_SHARED_DIR
+set (see app/shared.py). Once every worker is ready it reports:
+
+  - pss:      total proportional set size of the workers, so pages shared
+              between them (the mapped snapshot, the page cache) count once
+  - ready:    seconds from spawn until all workers answered /readyz
+  - versions: distinct snapshot versions served (1 = no drift)
+
+Point DATABASE_URL at a large catalogue (e.g. a benchmark.py database) to
+see the arrays dominate.
+
+Usage:
+    DATABASE_URL=postgresql://user@localhost/cityspire_bench python scripts/shared_bench.py --workers 1 2 4
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def children(pid):
+    """
+    children returns the pids of the child processes of pid
+    """
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(p) for p in f.read().split()]
+
+
+def pss_kb(pid):
+    """
+    pss_kb returns the proportional set size of a process in KB
+    """
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1])
+    return 0
+
+
+def readyz(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as rsp:
+            return json.loads(rsp.read())
+    except (urllib.error.URLError, ConnectionError, OSError, ValueError):
+        return None
+
+
+def boot(workers, shared_dir, port, timeout):
+    """
+    boot starts uvicorn with the passed number of workers and returns the
+    workers' total PSS in MB, the seconds until every worker was ready
+    (None if they never were) and the snapshot versions they served
+    """
+    env = dict(os.environ, SNAPSHOT_REFRESH="false", RESPONSE_CACHE_SIZE="0")
+    env.pop("SNAPSHOT_SHARED_DIR", None)
+    if shared_dir != None:
+        env["SNAPSHOT_SHARED_DIR"] = shared_dir
+
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        # workers share the listening socket; count the boot as ready once
+        # 20 consecutive requests per worker all answered 200
+        ready, versions, streak = None, set(), 0
+        while time.perf_counter() - start < timeout:
+            rsp = readyz(f"http://127.0.0.1:{port}/readyz")
+            streak = streak + 1 if rsp != None else 0
+            if rsp != None:
+                versions.add(rsp["version"])
+            if streak >= 20 * workers:
+                ready = time.perf_counter() - start
+                break
+            time.sleep(0.01)
+        # a single worker runs in the uvicorn process itself
+        pss = sum(pss_kb(pid) for pid in children(proc.pid) or [proc.pid]) / 1024
+    finally:
+        proc.terminate()
+        proc.wait()
+    return pss, ready, versions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="worker counts to boot")
+    parser.add_argument("--port", type=int, default=8768, help="port to boot the API on")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for the workers")
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'mode':<8} {'pss MB':>8} {'MB/worker':>10} {'ready s':>8} {'versions':>9}")
+    for workers in args.workers:
+        for mode in ("own", "shared"):
+            shared_dir = tempfile.mkdtemp(prefix="cityspire-", dir="/dev/shm") if mode == "shared" else None
+            try:
+                pss, ready, versions = boot(workers, shared_dir, args.port, args.timeout)
+            finally:
+                if shared_dir != None:
+                    shutil.rmtree(shared_dir)
+            ready = "failed" if ready == None else f"{ready:.2f}"
+            print(f"{workers:>7} {mode:<8} {pss:>8.1f} {pss / workers:>10.1f} {ready:>8} {len(versions):>9}")
+
+
+if __name__ == "__main__":
+    main()
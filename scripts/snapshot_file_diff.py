@@ -0,0 +1,144 @@
+"""Differential test of the DB-less snapshot file mode
+
+Exports the database behind DATABASE_URL to a snapshot file, then boots
+two API servers:
+
+  - db:   loads its snapshot from Postgres, as in production
+  - file: SNAPSHOT_FILE set and no database configured at all
+
+and requests the same paths from both: every scoring endpoint for every
+city in the file (active or not), several weight vectors, autocomplete
+queries, rankings, the batch endpoint and unknown cities. Any difference
+in status code or response body is printed; exits 1 if there was one.
+
+It also times read_snapshot() on the exported file, the part of a file
+mode cold start that depends on the catalogue.
+
+Usage:
+    DATABASE_URL=postgresql://user@localhost/cityspire python scripts/snapshot_file_diff.py
+    DATABASE_URL=... python scripts/snapshot_file_diff.py --max-cities 2000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.snapshot_file import read_snapshot
+
+# Weight querystrings requested for every city
+WEIGHTS = ("", "?crime=8&walk=4&air=4&rent=9", "?crime=0&walk=10&air=1&rent=3")
+
+CITY_PATHS = ("/crime_scr/{city}", "/walk_scr/{city}", "/air_qual_scr/{city}", "/rent_rate/{city}",
+              "/population_data/{city}")
+WEIGHTED_PATHS = ("/city_scr/{city}", "/city/{city}")
+
+OTHER_PATHS = (
+    "/cities", "/cities?q=new", "/cities?q=st+lo", "/cities?q=san&limit=3", "/cities?q=city+1",
+    "/rankings", "/rankings?crime=8&walk=4&air=4&rent=9&limit=25", "/rankings?state=CA",
+    "/rankings?crime=0&walk=10&air=0&rent=0&limit=100",
+    "/city_scr/Not_A_City", "/city/Not_A_City", "/crime_scr/Not_A_City", "/city_scr/new%20york",
+)
+
+
+def get(base, path, body=None):
+    """
+    get returns the status and decoded JSON body of a GET (or, with body,
+    a POST) of path
+    """
+    data = json.dumps(body).encode() if body != None else None
+    req = urllib.request.Request(base + path, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=10) as rsp:
+            return rsp.status, json.loads(rsp.read())
+    except urllib.error.HTTPError as err:
+        return err.code, json.loads(err.read() or "null")
+
+
+def boot(env, port, timeout=120):
+    """
+    boot starts an API server and returns the process once it is ready
+    """
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if get(f"http://127.0.0.1:{port}", "/readyz")[0] == 200:
+                return proc
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.05)
+    proc.terminate()
+    raise SystemExit(f"ERROR: the server on port {port} never became ready")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", help="snapshot file to write (default: a temporary file)")
+    parser.add_argument("--max-cities", type=int, help="only request the first N cities of the file")
+    parser.add_argument("--port", type=int, default=8769, help="port of the db server; the file server uses the next one")
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL"):
+        raise SystemExit("ERROR: set DATABASE_URL to the database to compare against")
+    path = args.file or os.path.join(tempfile.mkdtemp(prefix="cityspire-"), "cityspire.snap")
+    subprocess.run([sys.executable, "-m", "app.snapshot_file", path], cwd=ROOT, check=True)
+
+    start = time.perf_counter()
+    _, snap = read_snapshot(path)
+    print(f"read_snapshot: {len(snap)} cities in {(time.perf_counter() - start) * 1000:.1f} ms "
+          f"({os.path.getsize(path) / 1024:.0f} KB)")
+
+    base_env = dict(os.environ, SNAPSHOT_REFRESH="false", RESPONSE_CACHE_SIZE="0")
+    for name in ("SNAPSHOT_FILE", "SNAPSHOT_SHARED_DIR"):
+        base_env.pop(name, None)
+    file_env = dict(base_env, SNAPSHOT_FILE=path)
+    file_env.pop("DATABASE_URL")
+
+    codes = [c["city_code"] for c in snap.cities][:args.max_cities]
+    paths = list(OTHER_PATHS)
+    for code in codes:
+        paths.extend(p.format(city=code) for p in CITY_PATHS)
+        paths.extend(p.format(city=code) + w for p in WEIGHTED_PATHS for w in WEIGHTS)
+    batch = {"city_codes": codes[:500] + ["Not_A_City"], "weights": {"crime": 8, "walk": 4, "air": 4, "rent": 9}}
+
+    servers = [boot(base_env, args.port), boot(file_env, args.port + 1)]
+    try:
+        db_base, file_base = f"http://127.0.0.1:{args.port}", f"http://127.0.0.1:{args.port + 1}"
+        diffs = 0
+        requests = [(p, None) for p in paths] + [("/city_scr/batch", batch)]
+        for path, body in requests:
+            expected, actual = get(db_base, path, body), get(file_base, path, body)
+            if expected != actual:
+                diffs += 1
+                if diffs <= 20:
+                    print(f"DIFF {path}\n  db:   {expected}\n  file: {actual}")
+
+        _, db_ready = get(db_base, "/readyz")
+        _, file_ready = get(file_base, "/readyz")
+        if db_ready["version"] != file_ready["version"]:
+            diffs += 1
+            print(f"DIFF /readyz version: db {db_ready['version']}, file {file_ready['version']}")
+    finally:
+        for proc in servers:
+            proc.terminate()
+            proc.wait()
+
+    print(f"{len(requests)} requests, {diffs} differences")
+    if diffs:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Worker startup benchmark for the DS API
+
+Boots `uvicorn app.main:app` repeatedly and measures, from process spawn:
+
+  - listen: the port accepts connections (liveness path answers 200)
+  - ready:  the readiness path answers 200 (city data loaded)
+
+Cold boots first delete every __pycache__ directory under app/, so imports
+compile from source as on a fresh container; warm boots reuse the
+bytecode of the previous run.
+
+Usage:
+    python scripts/startup_bench.py --runs 5
+    python scripts/startup_bench.py --runs 5 --json after.json
+
+    # builds without /healthz and /readyz: the docs page answers once the
+    # port is bound and /cities once the city data is loaded
+    python scripts/startup_bench.py --live-path / --ready-path /cities
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+
+
+def clear_bytecode():
+    """
+    clear_bytecode deletes every __pycache__ directory under app/
+    """
+    for root, dirs, _ in os.walk(APP_DIR):
+        if "__pycache__" in dirs:
+            shutil.rmtree(os.path.join(root, "__pycache__"))
+
+
+def answers(url):
+    """
+    answers returns True if a GET of url answers 200
+    """
+    try:
+        with urllib.request.urlopen(url, timeout=1) as rsp:
+            return rsp.status == 200
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return False
+
+
+def boot(port, live_path, ready_path, timeout):
+    """
+    boot starts one uvicorn worker and returns the seconds until it
+    answered live_path and ready_path (None if it never did)
+    """
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(APP_DIR), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    live = ready = None
+    try:
+        while time.perf_counter() - start < timeout and ready == None:
+            if live == None and answers(base + live_path):
+                live = time.perf_counter() - start
+            if live != None and answers(base + ready_path):
+                ready = time.perf_counter() - start
+            time.sleep(0.005)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return live, ready
+
+
+def summarize(samples):
+    """
+    summarize returns the median, min and max of the non-None samples in ms
+    """
+    vals = [s * 1000 for s in samples if s != None]
+    if not vals:
+        return None
+    return {"median": round(statistics.median(vals), 1), "min": round(min(vals), 1),
+            "max": round(max(vals), 1), "failed": len(samples) - len(vals)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="boots per mode")
+    parser.add_argument("--port", type=int, default=8765, help="port to boot the API on")
+    parser.add_argument("--live-path", default="/healthz", help="path answering 200 once the port is bound")
+    parser.add_argument("--ready-path", default="/readyz", help="path answering 200 once the data is loaded")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for one boot")
+    parser.add_argument("--json", help="also write the summary to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ("cold", "warm"):
+        lives, readies = [], []
+        for _ in range(args.runs):
+            if mode == "cold":
+                clear_bytecode()
+            live, ready = boot(args.port, args.live_path, args.ready_path, args.timeout)
+            lives.append(live)
+            readies.append(ready)
+        results[mode] = {"listen_ms": summarize(lives), "ready_ms": summarize(readies)}
+
+    print(f"{'boot':<6} {'listen ms (median/min/max)':>28} {'ready ms (median/min/max)':>28}")
+    for mode, res in results.items():
+        cols = []
+        for key in ("listen_ms", "ready_ms"):
+            s = res[key]
+            cols.append("failed" if s == None else f"{s['median']:.1f} / {s['min']:.1f} / {s['max']:.1f}")
+        print(f"{mode:<6} {cols[0]:>28} {cols[1]:>28}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
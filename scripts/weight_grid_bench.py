@@ -0,0 +1,105 @@
+"""Weight grid benchmark for /city_scr
+
+Compares the weighted score computation of /city_scr with the weight grid
+off (calc_wghtd_city_score), in full mode and in lru mode. Reports the
+build time, the memory held (in total and per city for --cities cities)
+and the mean time per score for random score profiles and weights.
+
+Weight vectors are drawn from --distinct distinct vectors, so lru mode
+can be measured with a working set below or above its size.
+
+With --verify, every score profile under every weight vector is checked
+against calc_wghtd_city_score (9.15M calls, about a minute).
+
+Usage:
+    python scripts/weight_grid_bench.py
+    python scripts/weight_grid_bench.py --cities 100000 --distinct 20000 --lru-size 4096
+    python scripts/weight_grid_bench.py --verify
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from app.helpers import calc_wghtd_city_score
+from app.scoring import DIMENSIONS, N_PROFILES, N_WEIGHTS, WEIGHT_LEVELS, WeightGrid
+
+
+def weights_of(widx):
+    levels = np.unravel_index(widx, (WEIGHT_LEVELS,) * len(DIMENSIONS))
+    return {dim: int(w) for dim, w in zip(DIMENSIONS, levels)}
+
+
+def verify():
+    """
+    verify checks the full grid against calc_wghtd_city_score for every
+    score profile and weight vector and returns the number of mismatches
+    """
+    grid = WeightGrid("full")
+    grid.warm()
+    bad = 0
+    for widx in range(N_WEIGHTS):
+        weights = weights_of(widx)
+        if sum(weights.values()) == 0:
+            continue
+        for profile, scores in enumerate(grid.profile_scores):
+            expected = calc_wghtd_city_score(dict(zip(DIMENSIONS, scores.tolist())), weights)
+            if grid.lookup(profile, weights) != expected:
+                bad += 1
+    return bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cities", type=int, default=10000, help="cities the per-city memory is reported for")
+    parser.add_argument("--calls", type=int, default=200000, help="scores computed per mode")
+    parser.add_argument("--distinct", type=int, default=1000, help="distinct weight vectors requested")
+    parser.add_argument("--lru-size", type=int, default=4096, help="weight vectors kept in lru mode")
+    parser.add_argument("--verify", action="store_true", help="check every profile and weight vector")
+    args = parser.parse_args()
+
+    rng = random.Random(17)
+    vectors = [weights_of(w) for w in rng.sample(range(1, N_WEIGHTS), min(args.distinct, N_WEIGHTS - 1))]
+    requests = [(rng.randrange(N_PROFILES), rng.choice(vectors)) for _ in range(args.calls)]
+    profile_scores = WeightGrid("lru", 0).profile_scores
+    profile_dicts = [dict(zip(DIMENSIONS, s.tolist())) for s in profile_scores]
+    # the profile index is read from an int16 snapshot array, as in /city_scr
+    profiles = np.arange(N_PROFILES, dtype=np.int16)
+
+    print(f"{'mode':<6} {'build ms':>9} {'held KB':>9} {'B/city':>8} {'µs/score':>9}")
+
+    start = time.perf_counter()
+    for profile, weights in requests:
+        calc_wghtd_city_score(profile_dicts[profile], weights)
+    per_call = (time.perf_counter() - start) / len(requests) * 1e6
+    print(f"{'off':<6} {'-':>9} {'-':>9} {'-':>8} {per_call:>9.2f}")
+
+    for mode in ("full", "lru"):
+        grid = WeightGrid(mode, args.lru_size)
+        start = time.perf_counter()
+        grid.warm()
+        build = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        for profile, weights in requests:
+            grid.lookup(profiles[profile], weights)
+        per_call = (time.perf_counter() - start) / len(requests) * 1e6
+
+        held = grid.nbytes() + args.cities * profiles.itemsize
+        print(f"{mode:<6} {build:>9.1f} {held / 1024:>9.0f} {held / args.cities:>8.1f} {per_call:>9.2f}")
+
+    if args.verify:
+        bad = verify()
+        print(f"verify: {bad} mismatches")
+        if bad:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()